@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+#
+# Benchmark for the compiled Simulation backend: Compares the dense numpy right
+# hand side (Simulation(circuit)) with the generated one which contains only the
+# nonzero terms (Simulation(circuit, backend="compiled")), both for single RHS
+# evaluations and for whole solve_ivp calls, for the circuits in examples/simulated.
+#
+# Usage:
+#
+#  export PYTHONPATH=../..  # uses lucipy without installing
+#  python compiled_rhs.py
+#
+
+import time
+import numpy as np
+from lucipy import Simulation
+from simulated_circuits import load_all
+
+num_evaluations = 5000
+t_final = 50
+
+def evaluations_per_sec(sim, states):
+    start = time.perf_counter()
+    for state in states:
+        sim.rhs(0, state)
+    return len(states) / (time.perf_counter() - start)
+
+def solve_time(sim):
+    start = time.perf_counter()
+    sim.solve_ivp(t_final)
+    return time.perf_counter() - start
+
+circuits = load_all()
+Simulation(circuits["lorenz"]).solve_ivp(1) # imports scipy, not to be measured
+
+states = np.random.default_rng(42).uniform(-1, 1, (num_evaluations, 8))
+print(f"{'circuit':>24} {'routes':>6} {'numpy rhs/s':>12} {'compiled rhs/s':>15} {'speedup':>8} {'solve_ivp speedup':>18}")
+for name, circuit in circuits.items():
+    numpy, compiled = Simulation(circuit), Simulation(circuit, backend="compiled")
+    compiled.rhs(0, np.zeros(8)) # generates the function
+    rates = [ evaluations_per_sec(sim, states) for sim in (numpy, compiled) ]
+    times = [ solve_time(sim) for sim in (numpy, compiled) ]
+    print(f"{name:>24} {len(circuit.routes):>6} {rates[0]:>12.0f} {rates[1]:>15.0f} {rates[1]/rates[0]:>7.1f}x {times[0]/times[1]:>17.1f}x")
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+#
+# Benchmark for delta uploads: A parameter sweep (in the spirit of the Mathieu
+# stability map in examples/rev1-hw/mathieu.py) which changes a single coefficient
+# per sweep point. Compares full set_circuit uploads with LUCIDAC.delta_uploads,
+# where only the changed entities are sent. Reports bytes and time per sweep point.
+#
+# By default an Emulation is started on localhost. Set LUCIDAC_ENDPOINT to
+# measure against a real device instead.
+#
+# Usage:
+#
+#  export PYTHONPATH=../..  # uses lucipy without installing
+#  python delta.py
+#
+
+import os, time
+import numpy as np
+from lucipy import LUCIDAC, Emulation, Circuit, Route
+
+num_points = 500
+
+def damped_oscillator(damping):
+    c = Circuit()
+    x = c.int(ic=+1)
+    y = c.int(ic=0)
+    c.add( Route(x, 2,  1, y) )
+    c.add( Route(y, 3, -1, x) )
+    c.add( Route(y, 4, -damping, y) )
+    c.measure(x)
+    c.measure(y)
+    return c
+
+if "LUCIDAC_ENDPOINT" in os.environ:
+    proc = None
+    endpoint = os.environ["LUCIDAC_ENDPOINT"]
+else:
+    emu = Emulation(bind_port=0)
+    proc = emu.serve_forking()
+    endpoint = emu.endpoint()
+
+try:
+    print(f"Sweep with {num_points} points against {endpoint}")
+    for delta_uploads in [False, True]:
+        hc = LUCIDAC(endpoint)
+        hc.delta_uploads = delta_uploads
+        hc.get_mac()
+        hc.instrumentation.reset()
+        start = time.perf_counter()
+        for damping in np.linspace(0, 1, num_points).tolist():
+            hc.set_circuit(damped_oscillator(damping).generate())
+        duration = time.perf_counter() - start
+        stats = hc.stats()
+        print(f"{delta_uploads=!s:>5}: {stats['bytes_out']/num_points:8.0f} bytes/point, "
+              f"{duration/num_points*1e3:8.3f} ms/point")
+        hc.close()
+finally:
+    if proc:
+        proc.terminate()
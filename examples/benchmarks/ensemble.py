@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+#
+# Benchmark for Simulation.solve_ensemble: Solves ensembles of N perturbed copies
+# (1% noise on the initial conditions and route coefficients) of chaotic circuits
+# from examples/simulated, for N = 1 .. 100_000, and compares the throughput with
+# one Simulation.solve_ivp call per member. The loop is only timed for
+# max_loop members (with unperturbed coefficients), its throughput does not depend on N.
+#
+# Usage:
+#
+#  export PYTHONPATH=../..  # uses lucipy without installing
+#  python ensemble.py
+#
+
+import time
+import numpy as np
+from lucipy import Simulation
+from simulated_circuits import load
+
+t_final = 20
+t_eval = np.linspace(0, t_final, 20)
+sizes = [1, 10, 100, 1_000, 10_000, 100_000]
+max_loop = 100
+
+def ensemble(sim, num_members, rng):
+    ics = sim.ics * rng.normal(1, 0.01, (num_members, 8))
+    coefficients = sim.route_coefficients * rng.normal(1, 0.01, (num_members, len(sim.route_coefficients)))
+    return ics, coefficients
+
+for name in ["lorenz", "sprott", "hyperchaos"]:
+    circuit = load(name)
+    sim = Simulation(circuit)
+    sim.solve_ensemble(None, t_eval, sim.route_coefficients[None, :]) # imports scipy, not to be measured
+    rng = np.random.default_rng(42)
+
+    # baseline: one solve_ivp per member, with the same ics (coefficients unperturbed)
+    ics, coefficients = ensemble(sim, max_loop, rng)
+    start = time.perf_counter()
+    for n in range(max_loop):
+        sim.solve_ivp(t_final, ics=ics[n], t_eval=t_eval)
+    loop_rate = max_loop / (time.perf_counter() - start)
+
+    print(f"{name}: solve_ivp loop {loop_rate:.0f} members/s")
+    print(f"{'N':>8} {'time':>9} {'members/s':>10} {'speedup':>8}")
+    for num_members in sizes:
+        ics, coefficients = ensemble(sim, num_members, rng)
+        out = np.empty((num_members, 8, len(t_eval)))
+        start = time.perf_counter()
+        sim.solve_ensemble(ics, t_eval, coefficients, out=out)
+        duration = time.perf_counter() - start
+        print(f"{num_members:>8} {duration:>8.3f}s {num_members/duration:>10.0f} {num_members/duration/loop_rate:>7.1f}x")
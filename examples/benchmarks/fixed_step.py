@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+#
+# Benchmark for the fixed step engine: Solves the circuits in examples/simulated on
+# a uniform sampling grid (as the emulator does with the DAQ sample rate) with
+# Simulation.solve_fixed (RK4 and forward Euler, numpy and compiled backend) and
+# with scipy's solve_ivp (RK45 with default tolerances, interpolated on the grid, and
+# RK45 with rtol=1e-8 which is about as accurate as RK4).
+# Reports the wall time and the maximum deviation from a reference solution
+# (DOP853 with rtol=1e-12). Finally, times Emulation.start_run-like runs in real
+# time units, at the default DAQ sample rate of 500 kS/s.
+#
+# Usage:
+#
+#  export PYTHONPATH=../..  # uses lucipy without installing
+#  python fixed_step.py
+#
+
+import time
+import numpy as np
+from lucipy import Simulation
+from simulated_circuits import load_all
+
+t_final = 10
+sample_rate = 100 # samples per time unit, i.e. 1000 samples
+
+def timed(f):
+    start = time.perf_counter()
+    y = f()
+    return time.perf_counter() - start, y
+
+circuits = load_all()
+Simulation(circuits["lorenz"]).solve_ivp(1) # imports scipy, not to be measured
+
+t = np.arange(int(t_final * sample_rate)) / sample_rate
+print(f"{'circuit':>24} | {'solve_ivp':>16} | {'solve_ivp 1e-8':>16} | {'rk4':>16} | {'rk4 compiled':>16} | {'euler compiled':>16}")
+for name, circuit in circuits.items():
+    numpy, compiled = Simulation(circuit), Simulation(circuit, backend="compiled")
+    reference = numpy.solve_ivp(t_final, t_eval=t, method="DOP853", rtol=1e-12, atol=1e-12).y
+    if reference.shape[1] != len(t):
+        continue # diverges
+    results = [
+        timed(lambda: numpy.solve_ivp(t_final, dense_output=True).sol(t)),
+        timed(lambda: numpy.solve_ivp(t_final, t_eval=t, rtol=1e-8, atol=1e-10).y),
+        timed(lambda: numpy.solve_fixed(t_final, sample_rate)[1]),
+        timed(lambda: compiled.solve_fixed(t_final, sample_rate)[1]),
+        timed(lambda: compiled.solve_fixed(t_final, sample_rate, method="euler")[1]),
+    ]
+    columns = [ f"{duration:>6.3f}s {np.abs(y - reference).max():>8.1e}" for duration, y in results ]
+    print(f"{name:>24} | " + " | ".join(columns))
+
+op_time = 1e-3 # seconds
+daq_rate = 500_000
+t = np.arange(int(op_time * daq_rate)) / daq_rate
+print(f"\nRuns of {op_time*1e3:.0f} ms at {daq_rate/1e3:.0f} kS/s ({len(t)} samples)")
+print(f"{'circuit':>24} | {'solve_ivp':>16} | {'rk4 compiled':>16}")
+for name, circuit in circuits.items():
+    numpy, compiled = Simulation(circuit, realtime=True), Simulation(circuit, realtime=True, backend="compiled")
+    reference = numpy.solve_ivp(op_time, t_eval=t, method="DOP853", rtol=1e-12, atol=1e-12).y
+    if reference.shape[1] != len(t):
+        continue
+    results = [
+        timed(lambda: numpy.solve_ivp(op_time, dense_output=True).sol(t)),
+        timed(lambda: compiled.solve_fixed(op_time, daq_rate)[1]),
+    ]
+    columns = [ f"{duration:>6.3f}s {np.abs(y - reference).max():>8.1e}" for duration, y in results ]
+    print(f"{name:>24} | " + " | ".join(columns))
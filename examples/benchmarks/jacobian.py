@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+#
+# Benchmark for the analytic Jacobian with implicit solvers. Circuits from
+# examples/simulated are made stiff by switching every other integrator to the
+# slow k0=100, so that time scales differing by a factor of 100 are mixed. Each
+# is solved with Radau, BDF and LSODA, once with finite difference Jacobians
+# (jac=None) and once with Simulation.jac, which solve_ivp passes by default.
+#
+# Usage:
+#
+#  export PYTHONPATH=../..  # uses lucipy without installing
+#  python jacobian.py
+#
+
+import time
+from lucipy import Simulation
+from simulated_circuits import load
+
+t_final = 500
+names = ["lorenz", "vdp", "hindmarsh-rose-neuron", "mathieu", "ttss", "sprott"]
+
+def solve(sim, **kwargs):
+    "Returns the wall time and the number of rhs calls, including the ones for finite differences"
+    calls = [0]
+    rhs = sim.rhs
+    def counting_rhs(t, state, clip=False):
+        calls[0] += state.shape[1] if state.ndim == 2 else 1 # vectorized calls
+        return rhs(t, state, clip)
+    sim.rhs = counting_rhs
+    start = time.perf_counter()
+    res = sim.solve_ivp(t_final, rtol=1e-6, atol=1e-9, **kwargs)
+    duration = time.perf_counter() - start
+    del sim.rhs
+    return duration, calls[0], res
+
+Simulation(load("lorenz")).solve_ivp(1) # imports scipy, not to be measured
+
+print(f"{'circuit':>24} {'method':>6} {'fd time':>9} {'fd rhs':>8} {'jac time':>9} {'jac rhs':>8} {'njev':>5} {'speedup':>8}")
+for name in names:
+    circuit = load(name)
+    for i in range(0, 8, 2):
+        circuit.set_k0_slow(i, True)
+    sim = Simulation(circuit)
+    for method in ["Radau", "BDF", "LSODA"]:
+        fd_time, fd_calls, fd = solve(sim, method=method, jac=None)
+        jac_time, jac_calls, jac = solve(sim, method=method)
+        print(f"{name:>24} {method:>6} {fd_time:>8.3f}s {fd_calls:>8} {jac_time:>8.3f}s {jac_calls:>8} {jac.njev:>5} {fd_time/jac_time:>7.1f}x")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+#
+# Benchmark for pipelined queries: Measures the throughput in requests per
+# second for blocking queries (one round trip each) and for LUCIDAC.query_many,
+# which sends requests back-to-back and matches the replies by envelope id.
+#
+# By default an Emulation is started on localhost and measured twice: directly,
+# where a round trip costs about as much as handling the request, and through a
+# relay which delays the traffic in each direction by `latency` seconds, as a
+# network between host and device does. Pipelining pays off in the second case,
+# since the requests in flight share the round trip time.
+#
+# Set LUCIDAC_ENDPOINT to measure against a real device instead.
+#
+# Usage:
+#
+#  export PYTHONPATH=../..  # uses lucipy without installing
+#  python pipeline.py
+#
+
+import os, time, socket, threading, queue
+from lucipy import LUCIDAC, Emulation
+
+num_requests = 2000
+latency = 0.001 # seconds, in each direction
+
+def relay(target, latency):
+    """
+    Forwards connections on a free local port to target=(host, port), delaying the
+    data in each direction by latency seconds without limiting the throughput.
+    Returns the port.
+    """
+    listener = socket.create_server(("127.0.0.1", 0))
+
+    def forward(source, sink):
+        chunks = queue.Queue()
+        def deliver():
+            while True:
+                due, data = chunks.get()
+                time.sleep(max(0, due - time.monotonic()))
+                if not data:
+                    sink.shutdown(socket.SHUT_WR)
+                    return
+                sink.sendall(data)
+        threading.Thread(target=deliver, daemon=True).start()
+        while True:
+            data = source.recv(65536)
+            chunks.put((time.monotonic() + latency, data))
+            if not data:
+                return
+
+    def accept():
+        while True:
+            client, _ = listener.accept()
+            server = socket.create_connection(target)
+            for source, sink in [(client, server), (server, client)]:
+                for sock in (source, sink):
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                threading.Thread(target=forward, args=(source, sink), daemon=True).start()
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1]
+
+def benchmark(hc, num_requests):
+    leds = lambda i: ("set_circuit", {"entity": [hc.get_mac(), "FP"], "config": {"leds": i % 256}})
+
+    def blocking():
+        for i in range(num_requests):
+            hc.query(*leds(i))
+
+    def pipelined(window):
+        return lambda: hc.query_many([leds(i) for i in range(num_requests)], window=window)
+
+    variants = { "blocking": blocking }
+    variants.update({ f"query_many(window={w})": pipelined(w) for w in [1, 8, 32, 128] })
+
+    print(f"{num_requests} requests against {hc}")
+    for name, method in variants.items():
+        start = time.perf_counter()
+        method()
+        duration = time.perf_counter() - start
+        print(f"{name:>25}: {num_requests/duration:10.0f} requests/sec")
+
+if "LUCIDAC_ENDPOINT" in os.environ:
+    hc = LUCIDAC()
+    try:
+        benchmark(hc, num_requests)
+    finally:
+        hc.close()
+else:
+    emu = Emulation(bind_port=0)
+    proc = emu.serve_forking()
+    try:
+        hc = LUCIDAC(emu.endpoint())
+        try:
+            benchmark(hc, num_requests)
+        finally:
+            hc.close()
+
+        port = relay(emu.obtained_addr, latency)
+        print(f"\nWith {latency*1e3:.1f} ms latency in each direction:")
+        hc = LUCIDAC(f"tcp://127.0.0.1:{port}")
+        try:
+            benchmark(hc, num_requests // 10) # blocking queries take a round trip each
+        finally:
+            hc.close()
+    finally:
+        time.sleep(2*latency) # lets the relay pass on the close before the emulator goes away
+        proc.terminate()
+        proc.join()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+#
+# Benchmark for the client side of runs with recorded traffic. A run is recorded
+# once (from the emulator, or from a real device if LUCIDAC_ENDPOINT is set) and
+# then replayed with the replay:/ endpoint, as fast as possible and paced by the
+# original timing. This measures parsing and Run throughput without the device.
+#
+# Usage:
+#
+#  export PYTHONPATH=../..  # uses lucipy without installing
+#  python replay.py [trace.jsonl]
+#
+# If the trace file exists, it is replayed without recording it again.
+#
+
+import os, sys, time
+from lucipy import LUCIDAC, Emulation, Circuit, Route
+
+trace = sys.argv[1] if len(sys.argv) > 1 else "run-trace.jsonl"
+num_repetitions = 5
+
+def session(endpoint, method="data_array"):
+    hc = LUCIDAC(endpoint)
+    c = Circuit()
+    x, y = c.int(ic=+1), c.int(ic=0)
+    c.add( Route(x, 2,  1, y) )
+    c.add( Route(y, 3, -1, x) )
+    for i in range(8):
+        c.measure(x if i % 2 else y)
+    hc.set_circuit(c.generate())
+    hc.set_daq(num_channels=8, sample_rate=500_000)
+    hc.set_run(op_time=200_000_000)
+    start = time.perf_counter()
+    data = getattr(hc.start_run(), method)()
+    duration = time.perf_counter() - start
+    hc.close()
+    return len(data), duration
+
+if not os.path.exists(trace):
+    endpoint = os.environ.get("LUCIDAC_ENDPOINT", "emu:/")
+    num_samples, duration = session(f"{endpoint}?record={trace}")
+    print(f"Recorded {num_samples} samples from {endpoint} in {duration:.3f}s to {trace}")
+
+size_mb = os.path.getsize(trace) / 1e6
+for name, endpoint, method in [
+        ("replay data()", f"replay:{trace}", "data"),
+        ("replay data_array()", f"replay:{trace}", "data_array"),
+        ("paced data_array()", f"replay:{trace}?paced", "data_array") ]:
+    timings = [ session(endpoint, method) for i in range(num_repetitions if "paced" not in endpoint else 1) ]
+    num_samples, duration = min(timings, key=lambda t: t[1])
+    print(f"{name:>20}: {num_samples/duration/1e3:10.1f} kSamples/sec, {size_mb/duration:8.1f} MB/sec (trace)")
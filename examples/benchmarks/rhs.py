@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+#
+# Benchmark for the right hand side of the Simulation: Measures RHS evaluations
+# per second for the circuits in examples/simulated, comparing the multiplier
+# evaluation along the precomputed plan (Simulation.Mul_out) with the former
+# fixed point iteration (Simulation.Mul_out_unrolled).
+#
+# Usage:
+#
+#  export PYTHONPATH=../..  # uses lucipy without installing
+#  python rhs.py
+#
+
+import time
+import numpy as np
+from lucipy import Simulation
+from simulated_circuits import load_all
+
+num_evaluations = 5000
+
+def evaluations_per_sec(sim, states):
+    start = time.perf_counter()
+    for state in states:
+        sim.rhs(0, state)
+    return len(states) / (time.perf_counter() - start)
+
+states = np.random.default_rng(42).uniform(-1, 1, (num_evaluations, 8))
+print(f"{'circuit':>24} {'muls':>4} {'levels':>6} {'planned':>10} {'unrolled':>10} {'speedup':>8}")
+for name, circuit in load_all().items():
+    sim = Simulation(circuit)
+    planned = evaluations_per_sec(sim, states)
+    plan = sim.mul_levels
+    sim.mul_levels = None # forces Mul_out_unrolled
+    unrolled = evaluations_per_sec(sim, states)
+    num_muls = np.count_nonzero(np.any((sim.C != 0) | (sim.D != 0), axis=1).reshape(4,2).any(axis=1))
+    print(f"{name:>24} {num_muls:>4} {len(plan) if plan else '-':>6} {planned:>10.0f} {unrolled:>10.0f} {planned/unrolled:>7.1f}x")
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+#
+# Benchmark for the round trip latency of queries against the emulator over
+# different transports: TCP, a Unix domain socket, the in-process emu:/ (which
+# still serializes to JSON on both sides) and emu:/?direct (which passes the
+# envelopes as dictionaries). The TCP and Unix servers run in their own process,
+# as in the tests.
+#
+# Usage:
+#
+#  export PYTHONPATH=../..  # uses lucipy without installing
+#  python roundtrip.py
+#
+
+import os, tempfile, time
+from lucipy import LUCIDAC, Emulation, Circuit
+
+num_queries = 2000
+
+tcp = Emulation(bind_port=0)
+tcp_proc = tcp.serve_forking()
+unix = Emulation(unix_socket=os.path.join(tempfile.mkdtemp(), "emu.sock"))
+unix_proc = unix.serve_forking()
+
+# A small circuit, its configuration is sent with each set_circuit query
+c = Circuit()
+x, y = c.int(ic=+1), c.int()
+c.connect(x, y)
+c.connect(y, x, weight=-1)
+c.measure(x)
+config = c.generate()
+
+for name, endpoint in [ ("tcp", tcp.endpoint()), ("unix", unix.endpoint()), ("emu", "emu:/"), ("emu direct", "emu:/?direct") ]:
+    hc = LUCIDAC(endpoint + ("&" if "?" in endpoint else "?") + "cache_ttl=0")
+    hc.get_mac()
+    for query, send in [ ("get_circuit", lambda: hc.get_circuit()), ("set_circuit", lambda: hc.set_circuit(config)) ]:
+        start = time.perf_counter()
+        for i in range(num_queries):
+            send()
+        duration = time.perf_counter() - start
+        print(f"{name:>12} {query}: {duration/num_queries*1e6:8.1f} us per round trip")
+    hc.close()
+
+tcp_proc.terminate()
+unix_proc.terminate()
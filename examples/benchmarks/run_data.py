@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+#
+# Benchmark for assembling the DAQ data of a run on the client side.
+#
+# Compares the list based Run.data() (and the former quadratic sum(chunks, []))
+# with the preallocated numpy path Run.data_array(). The device is faked
+# by a callback which replies with prepared JSONL envelopes, as the emulator
+# would be far too slow to produce 500kS/s with 8 channels.
+#
+# Usage:
+#
+#  export PYTHONPATH=../..  # uses lucipy without installing
+#  python run_data.py
+#
+
+import json, time
+import numpy as np
+from lucipy import LUCIDAC
+from lucipy.synchc import emusocket
+
+num_channels = 8
+sample_rate = 500_000
+chunk_size = 100 # samples per run_data envelope, as in the emulator
+
+def fake_device(op_time_sec):
+    num_samples = int(op_time_sec * sample_rate)
+    chunk = np.random.uniform(-1, 1, (chunk_size, num_channels)).round(6).tolist()
+    run_data = json.dumps({"type": "run_data", "msg": {"id": None, "entity": [], "data": chunk}})
+    replies = [ json.dumps({"type": "start_run", "msg": {}}) ]
+    replies += [ run_data ] * (num_samples // chunk_size)
+    replies += [ json.dumps({"type": "run_state_change", "msg": {"old": "OP", "new": "DONE"}}) ]
+    return lambda line: list(replies)
+
+def bench(method, op_time_sec):
+    hc = LUCIDAC("emu:/")
+    hc.sock.sock = emusocket(fake_device(op_time_sec))
+    hc.set_daq(num_channels=num_channels, sample_rate=sample_rate)
+    hc.set_run(op_time=int(op_time_sec*1e9))
+    run = hc.start_run()
+    start = time.perf_counter()
+    data = method(run)
+    duration = time.perf_counter() - start
+    assert data.shape == (run.expected_samples(), num_channels)
+    return duration
+
+methods = {
+    "sum(next_data(), [])": lambda run: np.array(sum(run.next_data(), [])),
+    "np.array(data())":     lambda run: np.array(run.data()),
+    "data_array()":         lambda run: run.data_array(),
+}
+
+print("op_time_sec " + " ".join(f"{name:>22}" for name in methods))
+for op_time_sec in [0.001, 0.01, 0.1, 1]:
+    timings = []
+    for name, method in methods.items():
+        if name.startswith("sum") and op_time_sec > 0.1:
+            timings.append(float("nan")) # takes minutes
+            continue
+        timings.append(bench(method, op_time_sec))
+    print(f"{op_time_sec:11} " + " ".join(f"{t:21.4f}s" for t in timings))
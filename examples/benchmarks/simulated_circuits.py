@@ -0,0 +1,35 @@
+#
+# Helper for the simulation benchmarks: Builds the circuits of the scripts in
+# examples/simulated without running their simulations and plots. Each script
+# is executed up to the line "sim = Simulation(circuit)".
+#
+
+import os, re, io, contextlib
+
+simulated_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "simulated")
+
+def load(name):
+    "Returns the circuit of examples/simulated/<name>.py"
+    lines = open(os.path.join(simulated_dir, name + ".py")).read().splitlines()
+    for i, line in enumerate(lines):
+        match = re.match(r"sim\s*=\s*Simulation\((\w+)\)", line)
+        if match:
+            break
+    else:
+        raise ValueError(f"{name}.py does not construct a Simulation")
+    code = "\n".join(line for line in lines[:i] if "matplotlib" not in line)
+    scope = {}
+    with contextlib.redirect_stdout(io.StringIO()): # some scripts print their circuits
+        exec(code, scope)
+    return scope[match.group(1)]
+
+def load_all():
+    "Returns a dictionary of all circuits which can be loaded"
+    circuits = {}
+    for filename in sorted(os.listdir(simulated_dir)):
+        if filename.endswith(".py"):
+            try:
+                circuits[filename[:-3]] = load(filename[:-3])
+            except ValueError:
+                pass
+    return circuits
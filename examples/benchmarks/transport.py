@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+#
+# Benchmark for the TCP receive path: Measures the throughput in MB/s of
+# reading and JSON-decoding a run_data stream, comparing the former text mode
+# file object (socket.makefile + readline + json.loads on str) with the bytes
+# level tcpsocket as used by LUCIDAC.
+#
+# The stream is produced by the Emulation once (this is what the emulator
+# would send over TCP for a run) and then served by a plain TCP server, so
+# the benchmark measures the client side only and not the ODE solver.
+#
+# Usage:
+#
+#  export PYTHONPATH=../..  # uses lucipy without installing
+#  python transport.py
+#
+
+import json, socket, threading, time, uuid
+from lucipy import Circuit, Emulation
+from lucipy.synchc import tcpsocket, jsonlines
+
+# A sine/cosine oscillator, sampled with 8 channels for 20ms at 500kS/s
+sinus = Circuit()
+x, y = sinus.int(ic=+1), sinus.int()
+sinus.connect(x, y)
+sinus.connect(y, x, weight=-1)
+for i in range(8):
+    sinus.measure(x if i % 2 else y)
+
+emu = Emulation()
+emu.set_circuit([emu.mac], sinus.generate())
+start_run = json.dumps({"id": str(uuid.uuid4()), "type": "start_run", "msg": {"id": str(uuid.uuid4()),
+    "config": {"op_time": 20_000_000}, "daq_config": {"num_channels": 8, "sample_rate": 500_000}}})
+stream = "".join(emu.handle_request(start_run)).encode("utf-8")
+num_lines = stream.count(b"\n")
+
+def serve(server):
+    while True:
+        conn, addr = server.accept()
+        conn.sendall(stream)
+        conn.close()
+
+server = socket.create_server(("127.0.0.1", 0))
+threading.Thread(target=serve, args=(server,), daemon=True).start()
+host, port = server.getsockname()
+
+def textmode():
+    s = socket.create_connection((host, port))
+    fh = s.makefile(mode="r", encoding="utf-8")
+    for i in range(num_lines):
+        json.loads(fh.readline())
+    s.close()
+
+def bytesmode(**socket_options):
+    def read():
+        sock = jsonlines(tcpsocket(host, port, auto_reconnect=False, **socket_options))
+        for i in range(num_lines):
+            sock.read()
+        sock.close()
+    return read
+
+variants = {
+    "makefile text mode": textmode,
+    "tcpsocket": bytesmode(),
+    "tcpsocket rcvbuf=4MB": bytesmode(rcvbuf=4*1024*1024),
+    "tcpsocket bufsize=1MB": bytesmode(bufsize=1024*1024),
+}
+
+repetitions = 5
+print(f"Stream of {num_lines} lines, {len(stream)/1e6:.1f} MB")
+for name, method in variants.items():
+    start = time.perf_counter()
+    for i in range(repetitions):
+        method()
+    duration = (time.perf_counter() - start) / repetitions
+    print(f"{name:>25}: {len(stream)/duration/1e6:8.1f} MB/s")
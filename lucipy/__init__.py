@@ -11,8 +11,6 @@ Does not provide:
 
 * Typing. Not yet sure.
 * Administrative interface
-* Async IO for exploiting all of parallelity single
-  threaded python can provide.
 
 Paradigms and software technical goodies:
 
@@ -22,7 +20,8 @@ Paradigms and software technical goodies:
   might not work for REDAC but does for LUCIDAC.
 * No poetry, no deeply nested directories, no large class
   hierarchies, no large stack traces
-* No async code
+* No async code, except for the optional :class:`AsyncLUCIDAC`
+  for driving many devices from a single event loop.
 * Human friendly for getting started in programming,
   in particular in interactive settings like IPython and
   Jupyter notebooks.
@@ -35,8 +34,38 @@ Paradigms and software technical goodies:
   This makes it super easy to get started.
 """
 
-# the four major entrypoints for the library:
-from .synchc import LUCIDAC
-from .circuits import Circuit, Route, Connection
+# The major entrypoints for the library. They are imported lazily on first
+# access (PEP 562), so that "from lucipy import LUCIDAC" only loads the client
+# and not the simulator or the circuit compiler. This keeps short scripts fast.
+_entrypoints = {
+    "LUCIDAC": "synchc",
+    "AsyncLUCIDAC": "asynchc",
+    "Scheduler": "scheduler",
+    "Circuit": "circuits", "Route": "circuits", "Connection": "circuits",
+    "Simulation": "simulator", "Emulation": "simulator",
+}
+
+# Submodules which were reachable as attributes before (such as lucipy.simulator
+# after "import lucipy") are imported on first access as well.
+_submodules = ["synchc", "asynchc", "scheduler", "circuits", "simulator", "proxy"]
+
+# The detect function shadows its submodule of the same name, and any import of
+# lucipy.detect (as done by the client) would reset the package attribute to the
+# module. Therefore this lightweight module is imported eagerly.
 from .detect import Endpoint, detect
-from .simulator import Simulation, Emulation
+
+__all__ = list(_entrypoints) + ["Endpoint", "detect"]
+
+def __getattr__(name):
+    if name in _entrypoints:
+        import importlib
+        value = getattr(importlib.import_module("." + _entrypoints[name], __name__), name)
+        globals()[name] = value # cache, __getattr__ is not called again
+        return value
+    if name in _submodules:
+        import importlib
+        return importlib.import_module("." + name, __name__) # also sets the package attribute
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(list(globals()) + __all__ + _submodules))
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+
+"""
+An Asynchronous Hybrid Controller Python Client for LUCIDAC.
+
+This is the :mod:`asyncio` counterpart of :mod:`~lucipy.synchc`. It is meant for
+the situations where the blocking :class:`~lucipy.synchc.LUCIDAC` would require
+one thread per device, for instance when driving several LUCIDACs at the same
+time or when overlapping the DAQ data streaming with computations on the host.
+If you just want to program a single LUCIDAC interactively, stick to
+:class:`~lucipy.synchc.LUCIDAC`.
+
+The :class:`AsyncLUCIDAC` exposes the same commands as the synchronous client,
+just as coroutines:
+
+>>> async def main():                                        # doctest: +SKIP
+...     async with AsyncLUCIDAC("tcp://192.168.1.2") as hc:
+...         await hc.set_circuit(circuit)
+...         hc.set_daq(num_channels=2)
+...         hc.set_run(op_time=900_000)
+...         run = await hc.start_run()
+...         async for chunk in run:
+...             process(chunk)
+>>> asyncio.run(main())                                      # doctest: +SKIP
+
+Replies are matched to requests by the envelope id, therefore many requests can
+be in flight at the same time, for instance with ``asyncio.gather``. Since this
+is built on asyncio streams, only TCP endpoints are supported.
+"""
+
+import asyncio, contextlib, json, logging, os, uuid, typing
+log = logging.getLogger('asynchc')
+
+from .detect import detect, Endpoint
+from .synchc import LUCIDAC, RemoteError, LocalError, dotdict
+
+__all__ = "AsyncLUCIDAC AsyncRun".split()
+
+
+class AsyncRun:
+    """
+    The asynchronous counterpart of :class:`~lucipy.synchc.Run`, as returned by
+    :meth:`AsyncLUCIDAC.start_run`. Iterate over it with ``async for`` in order to
+    get the DAQ data chunk by chunk, or await :meth:`data` for all data at once.
+    """
+    def __init__(self, hc, run_id):
+        self.hc = hc
+        self.id = run_id
+        self.op_end_data = None
+        # filled by the reader task of AsyncLUCIDAC, None means connection loss
+        self.queue = asyncio.Queue()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> typing.List[typing.List[float]]:
+        while True:
+            envelope = await self.queue.get()
+            if envelope is None:
+                raise LocalError("Connection lost during run")
+            if envelope["type"] == "run_data":
+                if "state" in envelope["msg"] and envelope["msg"]["state"] == "OP_END":
+                    if self.op_end_data is None:
+                        self.op_end_data = []
+                    self.op_end_data.append(envelope["msg"]["data"])
+                    continue
+                msg_data = envelope["msg"]["data"]
+                assert all(self.hc.daq_config["num_channels"] == len(line) for line in msg_data)
+                return msg_data
+            elif envelope["type"] == "run_state_change":
+                msg_new = envelope["msg"]["new"]
+                if msg_new == "DONE" and not self.hc.run_config.repetitive:
+                    self.hc.runs.pop(self.id, None)
+                    raise StopAsyncIteration
+                if msg_new == "ERROR":
+                    self.hc.runs.pop(self.id, None)
+                    raise LocalError(f"Could not properly start the run. Most likely the DAQ ({self.hc.daq_config}) or RUN ({self.hc.run_config}) configuration not accepted by the server side.")
+
+    async def data(self, empty_is_fine=False) -> typing.List[typing.List[float]]:
+        "Returns all measurement data of the run, see :meth:`~lucipy.synchc.Run.data`."
+        res = []
+        async for chunk in self:
+            res.extend(chunk)
+        if len(res) == 0 and not empty_is_fine:
+            raise LocalError("Expected data stream but got not a single data point")
+        return res
+
+    async def data_array(self, empty_is_fine=False):
+        "Returns all measurement data of the run as numpy array, see :meth:`~lucipy.synchc.Run.data_array`."
+        import numpy as np
+        num_channels = self.hc.daq_config.num_channels
+        chunks = [ np.asarray(chunk, dtype=float).reshape(-1, num_channels) async for chunk in self ]
+        if not chunks:
+            if not empty_is_fine:
+                raise LocalError("Expected data stream but got not a single data point")
+            return np.empty((0, num_channels))
+        return np.concatenate(chunks)
+
+    def op_end_state(self):
+        "M-outputs at the end of the OP-cycle, see :meth:`~lucipy.synchc.Run.op_end_state`."
+        return self.op_end_data
+
+
+class AsyncLUCIDAC:
+    """
+    Asynchronous LUCIDAC client. The constructor does not connect, use either
+    ``await hc.connect()`` or ``async with AsyncLUCIDAC(...) as hc``.
+
+    All commands of :attr:`LUCIDAC.commands <lucipy.synchc.LUCIDAC.commands>` are
+    available as coroutines, such as ``await hc.get_circuit()``. Local run and DAQ
+    configuration (:meth:`set_run`, :meth:`set_daq`, :meth:`set_op_time`) works
+    exactly as in :class:`~lucipy.synchc.LUCIDAC` and is not a coroutine.
+
+    :param endpoint_url: A TCP endpoint. If not given, the same lookup as in
+       :class:`~lucipy.synchc.LUCIDAC` takes place.
+    """
+
+    def __init__(self, endpoint_url=None):
+        if not endpoint_url:
+            if LUCIDAC.ENDPOINT_ENV_NAME in os.environ:
+                endpoint_url = os.environ[LUCIDAC.ENDPOINT_ENV_NAME]
+            else:
+                endpoint_url = detect(single=True)
+                if not endpoint_url:
+                    raise ValueError("No endpoint provided as argument or in ENV variable "
+                                     + LUCIDAC.ENDPOINT_ENV_NAME + " and did not discover a network endpoint.")
+        self.endpoint = Endpoint(endpoint_url)
+        if self.endpoint.scheme != "tcp":
+            raise ValueError(f"AsyncLUCIDAC only supports TCP endpoints, got {self.endpoint}")
+
+        self.reader, self.writer, self.reader_task = None, None, None
+
+        #: Futures of queries waiting for their reply, by envelope id
+        self.pending = {}
+        #: Runs receiving data, by run id
+        self.runs = {}
+
+        self.hc_mac = None
+        self.run_config = dotdict(
+            halt_on_external_trigger = False,
+            halt_on_overload  = True,
+            ic_time = 0,
+            op_time = 0,
+            unlimited_op_time = False,
+            repetitive = False
+        )
+        self.daq_config = dotdict(
+            num_channels = 0,
+            sample_op = True,
+            sample_op_end = True,
+            sample_rate = 500_000,
+        )
+        self.circuit_options = dotdict(
+            reset_before=True,
+            sh_kludge=True,
+            mul_calib_kludge=True,
+            calibrate_mblock=True,
+            calibrate_offset=True,
+            calibrate_routes=True,
+        )
+
+    #: Maximum length of a received line in bytes. The default of asyncio (64 KiB) is
+    #: too small for large circuits and DAQ chunks.
+    line_limit = 2**24
+
+    def __repr__(self):
+        return f"AsyncLUCIDAC(\"{self.endpoint.url()}\")"
+
+    async def connect(self):
+        "Opens the connection and starts the background task dispatching the replies"
+        log.info(f"Connecting to TCP {self.endpoint.host}:{self.endpoint.port}...")
+        self.reader, self.writer = await asyncio.open_connection(self.endpoint.host, self.endpoint.port, limit=self.line_limit)
+        self.reader_task = asyncio.ensure_future(self._read_forever())
+        if self.endpoint.user:
+            await self.login(self.endpoint.user, self.endpoint.password)
+        return self
+
+    async def close(self):
+        "Closes the connection. Queries still waiting for replies fail with a ``ConnectionError``."
+        if self.reader_task:
+            self.reader_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.reader_task
+        if self.writer:
+            self.writer.close()
+            await self.writer.wait_closed()
+        self.reader, self.writer, self.reader_task = None, None, None
+        for msg_type, future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"Connection to {self.endpoint} closed"))
+        self.pending.clear()
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _read_forever(self):
+        error = None
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break # EOF
+                if not line.strip():
+                    continue
+                self._dispatch(dotdict(json.loads(line)))
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            log.error(f"Reading from {self.endpoint} failed: {e!r}")
+            error = e
+        finally:
+            # the queries waiting for replies would hang forever otherwise
+            for msg_type, future in self.pending.values():
+                if not future.done():
+                    future.set_exception(error or ConnectionError(f"Connection to {self.endpoint} lost"))
+            self.pending.clear()
+            for run in self.runs.values():
+                run.queue.put_nowait(None)
+
+    def _dispatch(self, resp):
+        "Routes an incoming envelope to the waiting query or run"
+        if "type" in resp and resp.type in ("run_data", "run_state_change"):
+            run_id = resp.msg.get("id") if isinstance(resp.msg, dict) else None
+            run = self.runs.get(run_id) or (next(iter(self.runs.values())) if len(self.runs) == 1 else None)
+            if run:
+                run.queue.put_nowait(resp)
+            else:
+                log.info(f"{resp.type} for unknown run: {resp.msg}")
+            return
+        if "type" in resp and resp.type == "log":
+            log.info(f"Device Log {resp}")
+            return
+
+        key = resp.get("id")
+        if key not in self.pending:
+            # replies without id are matched to the oldest query of the same type
+            key = next((k for k, (msg_type, f) in self.pending.items() if msg_type == resp.get("type")), None)
+        if key is None:
+            log.error(f"Received unexpected: {resp=}")
+            return
+
+        msg_type, future = self.pending.pop(key)
+        if future.done():
+            return # cancelled by the caller
+        if "error" in resp:
+            future.set_exception(RemoteError(resp))
+        else:
+            future.set_result(resp.msg if resp.msg != {} else None)
+
+    async def send(self, msg_type, msg={}, envelope_id=None):
+        "Sets up an envelope and sends it, but does not wait for reply"
+        if not self.writer:
+            raise LocalError(f"{self} is not connected, call connect() first")
+        envelope = dict(id=envelope_id or str(uuid.uuid4()), type=msg_type, msg=msg)
+        self.writer.write((json.dumps(envelope) + "\n").encode("utf-8"))
+        await self.writer.drain()
+        return envelope
+
+    async def query(self, msg_type, msg={}, timeout=None):
+        """
+        Sends a query and waits for the answer, returns that answer.
+        Raises ``asyncio.TimeoutError`` if no answer arrived within ``timeout`` seconds.
+        """
+        envelope_id = str(uuid.uuid4())
+        future = asyncio.get_running_loop().create_future()
+        # register before sending, the reply might arrive before send() returns
+        self.pending[envelope_id] = (msg_type, future)
+        try:
+            await self.send(msg_type, msg, envelope_id)
+        except:
+            self.pending.pop(envelope_id, None)
+            raise
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.pending.pop(envelope_id, None)
+            raise
+
+    async def login(self, user, password):
+        "Login to the system"
+        return await self.query("login", dict(user=user, password=password))
+
+    async def get_mac(self):
+        "Get system ethernet mac address. Is cached."
+        if not self.hc_mac:
+            await self.get_entities()
+        return self.hc_mac
+
+    async def get_entities(self):
+        "Gets entities and determines system Mac address"
+        entities = (await self.query("get_entities"))["entities"]
+        mac = list(entities.keys())[0]
+        if mac[0] == "/":
+            mac = mac[1:]
+        assert self.hc_mac == None or mac == self.hc_mac, "Inconsistent device mac"
+        self.hc_mac = mac
+        return entities
+
+    async def set_circuit(self, carrier_config, **further_commands):
+        "Sets a carrier level configuration, see :meth:`~lucipy.synchc.LUCIDAC.set_circuit`."
+        from .circuits import Circuit
+        if isinstance(carrier_config, Circuit):
+            carrier_config = carrier_config.generate()
+
+        outer_config = dict(
+            entity = [await self.get_mac()],
+            config = carrier_config,
+            **further_commands
+        )
+
+        if "/0" in carrier_config:
+            cluster_config = carrier_config["/0"]
+            if "/M0" in cluster_config and not "ic_time" in self.run_config:
+                self.run_config.ic_time = self.determine_idal_ic_time_from_k0s(cluster_config["/M0"])
+
+        if "adc_channels" in carrier_config:
+            from .simulator import remove_trailing
+            num_channels = len(remove_trailing(carrier_config["adc_channels"], None))
+            self.set_daq(num_channels=num_channels)
+
+        return await self.query("set_circuit", outer_config)
+
+    async def set_by_path(self, path, config):
+        "Set element configuration by path, see :meth:`~lucipy.synchc.LUCIDAC.set_by_path`."
+        path, config = self.resolve_path(path, config)
+        return await self.query("set_circuit", {
+            "entity": [await self.get_mac()] + path,
+            "config": config,
+            **self.circuit_options
+        })
+
+    async def set_leds(self, leds_as_integer):
+        return await self.set_by_path("FP", { "leds": leds_as_integer })
+
+    async def manual_mode(self, to:str):
+        "manual mode control"
+        return await self.query("manual_mode", dict(to=to))
+
+    # pure local configuration handling is shared with the synchronous client
+    determine_idal_ic_time_from_k0s = staticmethod(LUCIDAC.determine_idal_ic_time_from_k0s)
+    resolve_path = staticmethod(LUCIDAC.resolve_path)
+    allowed_sample_rates = LUCIDAC.allowed_sample_rates
+    set_op_time = LUCIDAC.set_op_time
+    set_daq = LUCIDAC.set_daq
+    set_run = LUCIDAC.set_run
+
+    async def start_run(self, clear_queue=True, end_repetitive=True, run_type="sleepy", **run_and_daq_config) -> AsyncRun:
+        """
+        Start a run on the LUCIDAC, see :meth:`~lucipy.synchc.LUCIDAC.start_run`.
+        Returns an :class:`AsyncRun` once the device acknowledged the run.
+        """
+        for k,v in run_and_daq_config.items():
+            if k in self.run_config:
+                self.run_config[k] = v
+            elif k in self.daq_config:
+                self.daq_config[k] = v
+            else:
+                raise KeyError(f"Unknown configuration key '{k}'. Please manually assign to run_config, daq_config or elsewhere.")
+
+        run = AsyncRun(self, str(uuid.uuid4()))
+        self.runs[run.id] = run
+        try:
+            ret = await self.query("start_run", dict(
+                id = run.id,
+                session = None,
+                config = self.run_config,
+                daq_config = self.daq_config,
+                clear_queue = clear_queue,
+                end_repetitive = end_repetitive,
+                run_type = run_type,
+            ))
+        except:
+            self.runs.pop(run.id, None)
+            raise
+        if ret:
+            self.runs.pop(run.id, None)
+            raise LocalError(f"Run did not start successfully. Expected answer to 'start_run' but got {ret=}")
+        return run
+
+    async def run(self, **kwargs) -> AsyncRun:
+        "Alias for :meth:`start_run`. See there for details."
+        return await self.start_run(**kwargs)
+
+for cmd in LUCIDAC.commands:
+    shorthand = (lambda cmd: lambda self, msg={}: self.query(cmd, msg))(cmd)
+    shorthand.__doc__ = f'Shorthand for ``await query("{cmd}", msg)``, see :meth:`query`.'
+    if not hasattr(AsyncLUCIDAC, cmd):
+        setattr(AsyncLUCIDAC, cmd, shorthand)
@@ -9,29 +9,11 @@ happens typically within a few hundred milliseconds. If you want to wait for mor
 then one device, use the --all option.
 """
 
-# all python included
-import asyncio, logging, socket, sys, argparse, inspect, ast, pathlib, time, collections, itertools, urllib.parse, re
+# all python included. Slow to import modules (asyncio, argparse, the optional
+# zeroconf and pyserial) are only imported when needed, see lucipy.__init__.
+import logging, socket, sys, time, urllib.parse, re
 from typing import Any, Optional, List, cast, Iterator
 
-try:
-    # pip install pyserial
-    import serial, serial.tools.list_ports
-except ModuleNotFoundError:
-    serial = None
-
-try:
-    # pip install zeroconf
-    # An OS-independent all-python zeroconf/bonjour client
-    from zeroconf import IPVersion, ServiceStateChange, Zeroconf
-    from zeroconf.asyncio import (
-        AsyncServiceBrowser,
-        AsyncServiceInfo,
-        AsyncZeroconf,
-        AsyncZeroconfServiceTypes,
-    )
-except ModuleNotFoundError:
-    Zeroconf = None
-
 verbosity = 0
 err = lambda msg: print(msg, file=sys.stderr)
 log = lambda level, msg: print(msg, file=sys.stderr) if verbosity >= level else None
@@ -69,6 +51,12 @@ class Endpoint:
     >>> Endpoint.fromDevice("COM0") # port name at Windows
     Endpoint("serial:/COM0")
 
+    Query arguments work for serial devices as well:
+
+    >>> e = Endpoint("serial:/dev/ttyACM0?timeout=2")
+    >>> e.host, e.args
+    ('/dev/ttyACM0', {'timeout': '2'})
+
     Endpoints with scheme only are fine and used in the code. Note that
     schemes are the only part of the URL which is always canonically
     lowercased:
@@ -121,8 +109,8 @@ class Endpoint:
         # fixes for serial scheme, mainly neccessary because
         # result.hostname is lowercased, which is bad for "ttyACM0" or "COM0".
         # Will also fix problems such as serial://dev/foo resulting in host= "dev/foo"
-        posix = re.match("serial:/?(/.+)", endpoint, re.IGNORECASE)
-        win = re.match("serial:/?/(.+)", endpoint, re.IGNORECASE)
+        posix = re.match("serial:/?(/[^?]+)", endpoint, re.IGNORECASE)
+        win = re.match("serial:/?/([^?]+)", endpoint, re.IGNORECASE)
         if posix:
             self.host = posix.group(1)
         elif win:
@@ -184,7 +172,9 @@ def can_resolve_to(hostname, expected_ip:str):
 class ZeroconfDetector:
     def __init__(self, timeout_ms=500):
         # self.search_for = "lucidac-AA-BB-CC" # something which results in an abortion condition!
-        if not Zeroconf:
+        try:
+            import zeroconf
+        except ModuleNotFoundError:
             raise ModuleNotFoundError("Constructing a ZeroconfDetector object requires zeroconf, install with 'pip install zeroconf'")
         self.aiobrowser: Optional[AsyncServiceBrowser] = None
         self.aiozc: Optional[AsyncZeroconf] = None
@@ -195,12 +185,15 @@ class ZeroconfDetector:
         # types are actually
         # zeroconf: Zeroconf, service_type: str, name: str, state_change: ServiceStateChange
         # but not using them for avoiding dependencies.
+        import asyncio
+        from zeroconf import ServiceStateChange
         vv(f"Service {name} of type {service_type} state changed: {state_change}")
         if state_change is not ServiceStateChange.Added:
             return
         asyncio.ensure_future(self._enqueue_service_info(zeroconf, service_type, name))
         
     async def _enqueue_service_info(self, zeroconf, service_type: str, name: str):
+        from zeroconf.asyncio import AsyncServiceInfo
         info = AsyncServiceInfo(service_type, name)
         await info.async_request(zeroconf, 3000)
         vv("Zeroconf found: %r" % (info))
@@ -219,6 +212,9 @@ class ZeroconfDetector:
 
     async def start(self) -> None:
         "Starts Zeroconf browser detection. Returns after timeout."
+        import asyncio
+        from zeroconf import IPVersion
+        from zeroconf.asyncio import AsyncServiceBrowser, AsyncZeroconf
         self.aiozc = aiozc = AsyncZeroconf(ip_version=IPVersion.V4Only)
     
         services = [ "_lucijsonl._tcp.local." ] # not even _http
@@ -245,6 +241,7 @@ class ZeroconfDetector:
     def sync_start(self):
         "merely a helper to trigger and endless run"
         
+        import asyncio
         #loop = asyncio.get_event_loop()
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
@@ -260,7 +257,10 @@ def detect_usb_teensys() -> List[Endpoint]:
     teensy_vid = 0x16C0
     teensy_pid = 0x0483
     
-    if not serial:
+    try:
+        # pip install pyserial
+        import serial.tools.list_ports
+    except ModuleNotFoundError:
         raise ModuleNotFoundError("lucipy.detect.detect_usb_teensys for USB requires pyserial, install with 'pip install pyserial'")
     
     found = []
@@ -276,7 +276,11 @@ def detect_usb_teensys() -> List[Endpoint]:
 
 def detect_network_teensys(zeroconf_timeout=500) -> List[Endpoint]:
     "Yields all endpoints in the local broadcast domain using Zeroconf, requires python zeroconf package"
-    if not Zeroconf:
+    try:
+        # pip install zeroconf
+        # An OS-independent all-python zeroconf/bonjour client
+        import zeroconf
+    except ModuleNotFoundError:
         raise ModuleNotFoundError("lucipy.detect.detect_network_teensys requires zeroconf, install with 'pip install zeroconf'")
     
     return ZeroconfDetector(zeroconf_timeout).sync_start()
@@ -309,6 +313,7 @@ def detect(single=False, prefer_network=True, zeroconf_timeout=500):# -> Optiona
 
 if __name__ == '__main__':
     #logging.basicConfig(level=logging.INFO)
+    import argparse, ast, pathlib
     file_docstring = ast.get_docstring(ast.parse(pathlib.Path(__file__).read_text()), clean=True)    
     parser = argparse.ArgumentParser(description="Scanner to discover locally or network-attached LUCIDAC analog/digital hybrid computers.",
         epilog = file_docstring,
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+
+"""
+A local daemon which shares LUCIDACs between several client programs.
+
+A LUCIDAC should be driven by only one client at a time. If several scripts (for
+instance a notebook and a few analysis scripts) want to use the same device, each of
+them connects, logs in, queries ``get_entities`` and so on. The proxy holds a single
+persistent connection per device instead and accepts any number of local clients on
+a Unix domain socket. Start it with
+
+::
+
+    python -m lucipy.proxy tcp://192.168.1.2 --listen /tmp/lucidac.sock
+
+and use ``unix:/tmp/lucidac.sock`` as endpoint URL in the clients, i.e.
+``LUCIDAC("unix:/tmp/lucidac.sock")``. Several devices can be given, each one gets
+its own socket.
+
+The proxy forwards the JSONL messages unchanged and routes the answers back by their
+envelope id. It takes care that the clients do not interfere:
+
+* A client which sends ``lock_acquire`` owns the device until it sends
+  ``lock_release`` or disconnects. Requests of other clients wait meanwhile. These
+  two messages are answered by the proxy itself, as is ``login``, since the proxy is
+  already logged in with the credentials of its endpoint URL.
+* A ``start_run`` makes the client own the device until the run is finished, and the
+  ``run_data`` and ``run_state_change`` messages go only to that client. If a client
+  disconnects during a run, the run is stopped.
+* Answers to idempotent queries such as ``get_entities`` are cached, see
+  :class:`~lucipy.synchc.ResponseCache`. Changes of any client invalidate the cache.
+  Clients with ``unix:`` endpoints do not cache themselves by default, so they see
+  the changes of the other clients.
+
+All other messages from the device, such as ``log``, go to all clients.
+
+This module uses threads and not ``asyncio``, in line with :mod:`~lucipy.synchc`.
+"""
+
+import logging, socketserver, threading, json, os, uuid
+log = logging.getLogger('proxy')
+
+from .synchc import LUCIDAC, ResponseCache, endpoint2socket
+from .detect import Endpoint
+
+__all__ = ["Proxy"]
+
+class Proxy:
+    """
+    Shares a single device between the clients of a Unix domain socket.
+
+    >>> from lucipy import Emulation
+    >>> emu = Emulation(bind_port=0)
+    >>> proc = emu.serve_forking()
+    >>> import tempfile, os
+    >>> path = os.path.join(tempfile.mkdtemp(), "lucidac.sock")
+    >>> proxy = Proxy(emu.endpoint(), path).start()
+    >>> hc1, hc2 = LUCIDAC(proxy.endpoint()), LUCIDAC(proxy.endpoint())
+    >>> hc1.get_entities() == hc2.get_entities()
+    True
+    >>> proxy.close()
+    >>> proc.terminate()
+
+    :arg endpoint: Endpoint of the device, see :func:`~lucipy.synchc.endpoint2socket`.
+       It must be a stream such as ``tcp`` or ``serial``. If it contains a user name,
+       the proxy logs in once.
+    :arg path: Filename of the Unix domain socket to listen on
+    :arg cache_ttl: Lifetime of cached answers in seconds, ``0`` disables the cache
+    """
+    def __init__(self, endpoint, path, cache_ttl=60):
+        self.endpoint_url = Endpoint(endpoint)
+        self.path = path
+        self.device = endpoint2socket(self.endpoint_url)
+        self.cache = ResponseCache(ttl=cache_ttl)
+        # Counts the invalidations of the cache. An answer is only cached if there was
+        # no invalidation since its request was sent, otherwise it might be stale.
+        self.cache_generation = 0
+
+        # request id -> (client or None, request envelope, cache generation at sending
+        # or None if the answer is not cached)
+        self.pending = {}
+        # run id -> (client, whether the run is repetitive)
+        self.runs = {}
+        self.clients = set()
+        #: Client owning the device, None if it is free
+        self.owner = None
+        self.owner_locked = False # owner sent lock_acquire
+        self.state = threading.Condition()
+        self.send_lock = threading.Lock()
+
+        if self.endpoint_url.user:
+            self._login()
+
+        parent = self
+        class ClientHandler(socketserver.StreamRequestHandler):
+            def setup(self):
+                super().setup()
+                self.write_lock = threading.Lock()
+            def write(self, line):
+                with self.write_lock:
+                    self.wfile.write(line)
+                    self.wfile.flush()
+            def reply(self, envelope, msg={}):
+                "Answers a request as the firmware does, with an error code"
+                reply = dict(id=envelope.get("id"), type=envelope.get("type"), msg=msg, code=0)
+                if isinstance(msg, dict) and "error" in msg:
+                    reply.update(msg={}, error=msg["error"], code=-2)
+                self.write((json.dumps(reply) + "\n").encode("utf-8"))
+            def handle(self):
+                parent._connected(self)
+                try:
+                    for line in self.rfile:
+                        if line.strip():
+                            parent._request(self, line)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    parent._disconnected(self)
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        if os.path.exists(path):
+            os.unlink(path) # stale socket of an earlier proxy
+        self.server = Server(path, ClientHandler)
+
+    def _login(self):
+        envelope = dict(id=str(uuid.uuid4()), type="login",
+            msg=dict(user=self.endpoint_url.user, password=self.endpoint_url.password))
+        self.device.send(json.dumps(envelope))
+        while True:
+            line = self.device.read()
+            if not line.strip():
+                continue
+            reply = json.loads(line)
+            if reply.get("id") == envelope["id"] and reply != envelope: # serial devices echo
+                break
+        if "error" in reply or "error" in reply.get("msg", {}):
+            raise ValueError(f"Proxy cannot login at {self.endpoint_url}: {reply}")
+
+    def endpoint(self):
+        "Endpoint URL for clients of this proxy"
+        return f"unix:{self.path}"
+
+    def _connected(self, client):
+        log.info(f"New client at {self.path}")
+        with self.state:
+            self.clients.add(client)
+
+    def _disconnected(self, client):
+        log.info(f"Client at {self.path} disconnected")
+        with self.state:
+            self.clients.discard(client)
+            for msg_id, (owner, request, generation) in self.pending.items():
+                if owner is client:
+                    self.pending[msg_id] = (None, request, generation) # answer is dropped
+            stopped = [ run_id for run_id, (owner, repetitive) in self.runs.items() if owner is client ]
+            for run_id in stopped:
+                del self.runs[run_id]
+            if self.owner is client:
+                self._release()
+        if stopped:
+            log.warning(f"Stopping run of disconnected client")
+            self._send(None, dict(id=str(uuid.uuid4()), type="stop_run", msg=dict(end_repetitive=True)))
+
+    def _release(self):
+        "Gives up the ownership of the device, with self.state held"
+        self.owner, self.owner_locked = None, False
+        self.state.notify_all()
+
+    def _await_ownership(self, client):
+        "Blocks until the device is free or owned by the client, with self.state held"
+        self.state.wait_for(lambda: self.owner is None or self.owner is client)
+
+    def _send(self, client, envelope, line=None, cache=False):
+        "Sends a request to the device after registering for its answer"
+        with self.state:
+            if "id" in envelope:
+                self.pending[envelope["id"]] = (client, envelope, self.cache_generation if cache else None)
+        with self.send_lock:
+            self.device.send(line.decode("utf-8").rstrip("\n") if line else json.dumps(envelope))
+
+    def _request(self, client, line):
+        try:
+            envelope = json.loads(line)
+            msg_type, msg = envelope["type"], envelope.get("msg", {})
+        except (json.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError) as e:
+            return client.reply({}, dict(error=f"Proxy cannot read message: {e}"))
+
+        answer = self._admit(client, envelope, msg_type, msg)
+        if answer is not None:
+            client.reply(envelope, answer)
+        else:
+            self._send(client, envelope, line, cache=msg_type in LUCIDAC.cacheable)
+
+    def _admit(self, client, envelope, msg_type, msg):
+        """
+        Waits until the client may use the device and updates the ownership. Returns
+        the answer if the proxy answers the request itself, else None.
+        """
+        with self.state:
+            if msg_type == "lock_acquire":
+                self._await_ownership(client)
+                self.owner, self.owner_locked = client, True
+                return {}
+            if msg_type == "lock_release":
+                if self.owner is not client:
+                    return dict(error="Client does not hold the lock")
+                if any(owner is client for owner, repetitive in self.runs.values()):
+                    self.owner_locked = False # released when the run ends
+                else:
+                    self._release()
+                return {}
+            if msg_type == "login":
+                return {}
+
+            self._await_ownership(client)
+
+            if msg_type in LUCIDAC.mutating:
+                self._invalidate()
+            if msg_type in LUCIDAC.cacheable:
+                answer = self.cache.get(msg_type, msg)
+                if answer is not None:
+                    return answer
+            if envelope.get("id") in self.pending:
+                return dict(error="Proxy has a pending request with the same id")
+
+            if msg_type == "start_run":
+                self.owner = client
+                self.runs[msg.get("id")] = (client, bool(msg.get("config", {}).get("repetitive")))
+
+    def _invalidate(self):
+        "Empties the cache, with self.state held"
+        self.cache.invalidate()
+        self.cache_generation += 1
+
+    def _end_run(self, run_id):
+        "Releases the ownership when a run finished, with self.state held"
+        owner, repetitive = self.runs.pop(run_id, (None, False))
+        if owner is not None and self.owner is owner and not self.owner_locked:
+            self._release()
+
+    def _dispatch(self, line):
+        "Routes a single message from the device"
+        try:
+            envelope = json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            log.info(f"Received non-JSON message from device: {line}")
+            return
+        msg_type, msg_id = envelope.get("type"), envelope.get("id")
+        msg = envelope.get("msg") if isinstance(envelope.get("msg"), dict) else {}
+
+        with self.state:
+            if msg_id in self.pending:
+                client, request, generation = self.pending[msg_id]
+                if envelope == request:
+                    return # serial devices echo the request
+                del self.pending[msg_id]
+                failed = "error" in envelope or "error" in msg
+                if request.get("type") in LUCIDAC.mutating:
+                    # answers to requests sent before this one, which arrived meanwhile,
+                    # may have been cached with the old state
+                    self._invalidate()
+                if generation == self.cache_generation and not failed:
+                    self.cache.put(msg_type, request.get("msg", {}), envelope.get("msg"))
+                if msg_type == "start_run" and failed:
+                    self._end_run(request.get("msg", {}).get("id"))
+                if msg_type == "stop_run":
+                    for run_id in [ run_id for run_id, (owner, repetitive) in self.runs.items() if owner is client ]:
+                        self._end_run(run_id)
+                receivers = [client] if client else []
+            elif msg_type in ("run_data", "run_state_change"):
+                client, repetitive = self.runs.get(msg.get("id"), (self.owner, False))
+                receivers = [client] if client else []
+                # repetitive runs end with a stop_run
+                if msg_type == "run_state_change" and msg.get("id") in self.runs and \
+                        (msg.get("new") == "ERROR" or (msg.get("new") == "DONE" and not repetitive)):
+                    self._end_run(msg.get("id"))
+            else:
+                receivers = list(self.clients)
+
+        for client in receivers:
+            try:
+                client.write(line)
+            except OSError as e:
+                log.info(f"Cannot deliver to client: {e}")
+
+    def _read_device(self):
+        try:
+            while True:
+                line = self.device.read()
+                if line and line.strip():
+                    self._dispatch(line)
+        except Exception as e:
+            log.error(f"Lost connection to {self.endpoint_url}: {e}")
+            self.server.shutdown()
+
+    def start(self):
+        "Starts serving in background threads and returns the proxy"
+        self.reader = threading.Thread(target=self._read_device, daemon=True)
+        self.reader.start()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        log.info(f"Proxy for {self.endpoint_url} listening at {self.endpoint()}")
+        return self
+
+    def close(self):
+        "Stops serving and closes the connection to the device"
+        self.server.shutdown()
+        self.server.server_close()
+        self.device.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+def default_path(endpoint):
+    "Default socket filename for a device endpoint"
+    import tempfile, re
+    name = re.sub("[^A-Za-z0-9.-]+", "-", Endpoint(endpoint).host).strip("-")
+    return os.path.join(tempfile.gettempdir(), f"lucidac-{name or 'proxy'}.sock")
+
+if __name__ == "__main__":
+    import argparse, time
+    parser = argparse.ArgumentParser(description="Shares LUCIDACs between local clients. " +
+        "Clients connect with the endpoint URL unix:/path/to/socket.", prog="python -m lucipy.proxy")
+    parser.add_argument("endpoints", nargs="*", help="Endpoint URLs of the devices. If not given, detects a LUCIDAC.")
+    parser.add_argument("-l", "--listen", action="append", default=[], help="Socket filename, once per endpoint in the same order")
+    parser.add_argument("--cache-ttl", type=float, default=60, help="Lifetime of cached answers in seconds, 0 disables caching")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log every client connection")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    endpoints = args.endpoints
+    if not endpoints:
+        from .detect import detect
+        endpoints = [ detect(single=True) ]
+        if not endpoints[0]:
+            parser.error("No endpoint given and no LUCIDAC detected.")
+    if len(args.listen) > len(endpoints):
+        parser.error("More --listen sockets than endpoints given")
+    paths = args.listen + [ default_path(e) for e in endpoints[len(args.listen):] ]
+
+    proxies = [ Proxy(e, path, cache_ttl=args.cache_ttl).start() for e, path in zip(endpoints, paths) ]
+    for proxy in proxies:
+        print(f"Serving {proxy.endpoint_url} at {proxy.endpoint()}")
+    try:
+        while all(proxy.reader.is_alive() for proxy in proxies):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    for proxy in proxies:
+        proxy.close()
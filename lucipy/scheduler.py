@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+"""
+Distributes many runs over a pool of LUCIDACs.
+
+A campaign of runs (for instance a large parameter study) is described as a list of
+*jobs*, each consisting of a circuit and its run and DAQ configuration. The
+:class:`Scheduler` connects to several LUCIDACs and dispatches the jobs to whichever
+device is free, using one worker thread per device. Jobs which fail due to a
+:class:`~lucipy.synchc.RemoteError` or a lost connection are retried, if possible on
+another device. Jobs failing with any other exception (for instance raised by the
+``reduce`` function) are not retried but marked as failed.
+
+>>> sched = Scheduler(["emu:/", "emu:/"])
+>>> from lucipy import Circuit
+>>> def constant(ic):
+...     c = Circuit()
+...     c.measure(c.int(ic=ic))
+...     return c
+>>> for ic in [0.1, 0.2, 0.3, 0.4]:
+...     job = sched.submit(constant(ic), num_channels=1, op_time=100_000)
+>>> jobs = sched.run()
+>>> [ round(float(job.result[0,0]), 3) for job in jobs ]
+[-0.1, -0.2, -0.3, -0.4]
+>>> sched.report()["succeeded"]
+4
+
+This module uses threads and not ``asyncio``, in line with :mod:`~lucipy.synchc`.
+"""
+
+import logging, queue, threading, time
+log = logging.getLogger('scheduler')
+
+from .synchc import LUCIDAC, RemoteError
+from .detect import detect, Endpoint
+
+__all__ = ["Scheduler", "Job"]
+
+class Job:
+    """
+    A single run to be done on any device of the pool. Create jobs with
+    :meth:`Scheduler.submit`.
+
+    :ivar circuit: :class:`~lucipy.circuits.Circuit` or carrier configuration
+    :ivar config: Run and DAQ configuration, as keyword arguments for :meth:`LUCIDAC.start_run`
+    :ivar result: The data of the run (or what ``reduce`` made out of it), once done
+    :ivar error: The last exception, if the job failed finally
+    :ivar attempts: Number of times the job was tried
+    :ivar device: Endpoint of the device which did the job (or tried it last)
+    :ivar duration: Seconds the successful attempt took
+    """
+    def __init__(self, circuit, config):
+        self.circuit = circuit
+        self.config = config
+        self.result = None
+        self.error = None
+        self.attempts = 0
+        self.device = None
+        self.duration = None
+
+    @property
+    def done(self):
+        "Whether the job finished successfully"
+        return self.duration is not None
+
+    def __repr__(self):
+        state = "done" if self.done else ("failed" if self.error else "pending")
+        return f"Job({state}, attempts={self.attempts}, device={self.device})"
+
+class Scheduler:
+    """
+    Job queue with a pool of LUCIDACs as workers.
+
+    :arg endpoints: List of endpoints (strings or :class:`~lucipy.detect.Endpoint`) of the
+       devices in the pool. If not given, all devices found by :func:`~lucipy.detect.detect`
+       are used.
+    :arg retries: How often a failed job is tried again before giving up on it.
+    :arg reduce: Optional function which maps the data of a run, as returned by
+       :meth:`~lucipy.synchc.Run.data_array`, to the result of the job.
+    :arg reconnect: Whether a worker reconnects after its connection got lost. If
+       reconnecting fails, the device leaves the pool.
+    """
+    def __init__(self, endpoints=None, retries=2, reduce=None, reconnect=True):
+        if endpoints is None:
+            endpoints = detect()
+            if not endpoints:
+                raise ValueError("No endpoints given and no LUCIDAC could be detected.")
+        self.endpoints = [ Endpoint(e) for e in endpoints ]
+        self.retries = retries
+        self.reduce = reduce
+        self.reconnect = reconnect
+        #: All submitted jobs, in order of submission
+        self.jobs = []
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.started = self.finished = None
+
+    def submit(self, circuit, **run_and_daq_config) -> Job:
+        "Adds a job to the queue. The configuration is passed to :meth:`LUCIDAC.start_run`."
+        job = Job(circuit, run_and_daq_config)
+        self.jobs.append(job)
+        self.queue.put(job)
+        return job
+
+    def _work(self, hc, job):
+        hc.set_circuit(job.circuit)
+        run = hc.start_run(**job.config)
+        data = run.data_array(empty_is_fine=True)
+        return self.reduce(data) if self.reduce else data
+
+    def _worker(self, endpoint, name):
+        device = self.devices[name]
+        try:
+            hc = LUCIDAC(endpoint)
+        except Exception as e:
+            log.error(f"Cannot connect to {name}, leaving it out: {e}")
+            device["error"] = e
+            return
+
+        try:
+            while True:
+                job = self.queue.get()
+                if job is None: # all jobs are finished
+                    break
+
+                job.attempts += 1
+                job.device = name
+                start = time.perf_counter()
+                finished = True
+                try:
+                    job.result = self._work(hc, job)
+                    job.duration = time.perf_counter() - start
+                    job.error = None
+                    device["jobs"] += 1
+                    device["busy"] += job.duration
+                except Exception as e:
+                    device["failures"] += 1
+                    job.error = e
+                    # other errors, such as the ones of reduce, would just happen again
+                    retryable = isinstance(e, (RemoteError, OSError, TimeoutError))
+                    if retryable and job.attempts <= self.retries:
+                        log.warning(f"Job failed at {name} (attempt {job.attempts}), retrying: {e}")
+                        self.queue.put(job)
+                        finished = False
+                    else:
+                        log.error(f"Job failed at {name} (attempt {job.attempts}), giving up: {e!r}")
+                    if isinstance(e, (OSError, TimeoutError)): # lost connection
+                        if not self.reconnect:
+                            device["error"] = e
+                            return
+                        try:
+                            hc.close()
+                            hc = LUCIDAC(endpoint)
+                        except Exception as e:
+                            log.error(f"Cannot reconnect to {name}, leaving it out: {e}")
+                            device["error"] = e
+                            return
+                finally:
+                    if finished:
+                        self._finished()
+        finally:
+            hc.close()
+
+    def _finished(self):
+        "Counts a finished job. After the last one, wakes up every worker to stop."
+        with self.lock:
+            self.pending -= 1
+            if self.pending == 0:
+                for _ in self.endpoints:
+                    self.queue.put(None)
+
+    def run(self):
+        """
+        Works off all submitted jobs and returns the list of all jobs. Blocks until
+        every job finished or failed finally. Jobs which could not be done because no
+        device was left in the pool are marked as failed.
+        """
+        self.pending = self.queue.qsize()
+        # endpoints such as emu:/ may show up several times in the pool
+        urls = [ e.url() for e in self.endpoints ]
+        names = [ url if urls.count(url) == 1 else f"{url}#{i}" for i, url in enumerate(urls) ]
+        self.devices = { name: dict(jobs=0, failures=0, busy=0., error=None) for name in names }
+        self.started = time.perf_counter()
+        workers = [ threading.Thread(target=self._worker, args=(e, name), daemon=True) for e, name in zip(self.endpoints, names) ]
+        if self.pending == 0:
+            for _ in workers:
+                self.queue.put(None)
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.finished = time.perf_counter()
+
+        while not self.queue.empty():
+            job = self.queue.get()
+            if job is not None: # sentinels of workers which left the pool
+                job.error = job.error or RuntimeError("No device left in the pool")
+        return self.jobs
+
+    def report(self):
+        """
+        Returns an aggregate report about the last :meth:`run` as dictionary, with the
+        number of ``jobs``, ``succeeded`` and ``failed`` ones, the number of ``retries``,
+        the ``wall_time`` in seconds and the throughput in ``jobs_per_sec``. The entry
+        ``devices`` holds for each device the number of ``jobs`` done, the number of
+        ``failures``, the ``busy`` time in seconds, the ``utilization`` (busy time per
+        wall time) and the ``error`` which made it leave the pool, if any.
+        """
+        wall_time = (self.finished or time.perf_counter()) - self.started if self.started else 0
+        succeeded = sum(job.done for job in self.jobs)
+        return dict(
+            jobs = len(self.jobs),
+            succeeded = succeeded,
+            failed = len(self.jobs) - succeeded,
+            retries = sum(max(0, job.attempts - 1) for job in self.jobs),
+            wall_time = wall_time,
+            jobs_per_sec = succeeded / wall_time if wall_time else None,
+            devices = { name: dict(**device, utilization = device["busy"] / wall_time if wall_time else None)
+                for name, device in self.devices.items() },
+        )
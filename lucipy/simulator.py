@@ -26,6 +26,65 @@ def split(array, nrows, ncols):
                  .swapaxes(1, 2)
                  .reshape(-1, nrows, ncols))
 
+def clip_state(state, bound=1.4, eps=0.2):
+    "Bounded-in-bounded-out clipping of the integrator state, in place"
+    state[state > +bound] = +bound - eps
+    state[state < -bound] = -bound + eps
+
+@functools.lru_cache(maxsize=128)
+def compile_source(source, name="rhs"):
+    """
+    Compiles generated python code and returns the function ``name`` defined in it.
+    Functions are cached by their source, i.e. circuits with the same matrices share them.
+    """
+    import numpy as np
+    scope = dict(np=np, clip_state=clip_state)
+    exec(compile(source, f"<lucipy generated {name}>", "exec"), scope)
+    return scope[name]
+
+def fixed_step(fun, y0, h, num_samples, substeps=1, method="rk4", clip=False, out=None):
+    """
+    Integrates ``d/dt y = fun(t, y)`` with a fixed step size ``h``, starting at ``t=0``.
+    The state is stored every ``substeps`` steps, i.e. at the times
+    ``k*substeps*h`` for ``k in range(num_samples)``.
+
+    :arg y0: Initial state, of any shape (for instance ``(8,)`` or ``(8, N)``)
+    :arg method: ``"rk4"`` (classical Runge-Kutta) or ``"euler"`` (forward Euler)
+    :arg clip: Whether to clip the state after every step, see :func:`clip_state`
+    :arg out: Optional preallocated array of shape ``y0.shape + (num_samples,)``
+    :return: The array ``out``
+
+    >>> import numpy as np
+    >>> fixed_step(lambda t, y: -y, np.ones(1), 0.1, 3, substeps=10).round(5).tolist() # exp(-t)
+    [[1.0, 0.36788, 0.13534]]
+    """
+    import numpy as np
+    if method not in ("rk4", "euler"):
+        raise ValueError(f"Unknown {method=}, expecting 'rk4' or 'euler'")
+    y = np.array(y0, dtype=float)
+    if out is None:
+        out = np.empty(y.shape + (num_samples,))
+
+    step = 0
+    for k in range(num_samples):
+        out[..., k] = y
+        if k == num_samples - 1:
+            break
+        for _ in range(substeps):
+            t = step * h # not accumulated, to avoid drifting against the sampling grid
+            if method == "euler":
+                y = y + h * fun(t, y)
+            else:
+                k1 = fun(t, y)
+                k2 = fun(t + h/2, y + h/2 * k1)
+                k3 = fun(t + h/2, y + h/2 * k2)
+                k4 = fun(t + h, y + h * k3)
+                y = y + h/6 * (k1 + 2*k2 + 2*k3 + k4)
+            if clip:
+                clip_state(y)
+            step += 1
+    return out
+
 def remove_trailing(l, remove_value=None):
     i = len(l)
     while i > 0 and l[i - 1] == remove_value:
@@ -58,7 +117,9 @@ class Simulation:
     Important properties and limitations:
     
     * Currently only understands mblocks ``M0 = Int`` and ``M1 = Mul`` in REV1-Hardware fashion
-    * Unrolls Mul blocks at evaluation time, which is slow
+    * Multipliers which feed other multipliers are evaluated in a topological order which is
+      determined once at construction time, see :meth:`Mul_out`. Only circuits with
+      algebraic loops fall back to unrolling the Mul blocks at evaluation time, which is slow.
     * Note that the system state is purely hold in the integrators.
       It always evolves all 8 integrators and returns all 8 integrators.
       It is up to the user to use the provided mapping functions to derive the
@@ -76,6 +137,11 @@ class Simulation:
       in multiples of ``10us``. Such a time unit can be more natural for
       applications. You can set the time factor later by overwriting the ``int_factor``
       property.
+    :arg backend: How the :meth:`rhs` is evaluated. ``"numpy"`` uses dense matrix products
+      with the block matrices. ``"compiled"`` generates a python function which contains
+      only the nonzero terms of the circuit, see :meth:`rhs_source`. This is several times
+      faster for typical circuits. The generated function reflects the matrices at the
+      time of the first :meth:`rhs` call (or when ``int_factor`` was assigned last).
     
    
     Note, here is a tip to display the big matrices in one line:
@@ -85,9 +151,14 @@ class Simulation:
 
     """
     
-    def __init__(self, circuit, realtime=False):
+    def __init__(self, circuit, realtime=False, backend="numpy"):
         import numpy as np
         
+        if backend not in ("numpy", "compiled"):
+            raise ValueError(f"Unknown {backend=}, expecting 'numpy' or 'compiled'")
+        self.backend = backend
+        self.compiled_rhs = None
+        
         circuit.sanity_check()
 
         self.ics = np.array(circuit.ics)
@@ -142,9 +213,119 @@ class Simulation:
         global_factor = 1 if realtime else 10_000
         self.int_factor = np.array(circuit.k0s) / global_factor
         
+        #: Evaluation plan for the multipliers, see :meth:`mul_plan`
+        self.mul_levels = self.mul_plan()
+
+        # Sparse form of UCI for rhs_ensemble: For each route, the source row in
+        # [Iout, Mout, constant] and the target row in [Iin, Min]. As in UCI, routes
+        # from the constant giver are recognized by the masked lanes.
+        from .circuits import Route
+        routes = [ r for r in circuit.routes if r.uin != Route.do_not_connect and r.iout != Route.do_not_connect ]
+        is_const = lambda r: self.u_constant and ((r.uin == 15 and r.lane < 16) or (r.uin == 14 and r.lane >= 16))
+        self.route_sources = np.array([ 16 if is_const(r) else r.uin for r in routes ], dtype=int)
+        self.route_targets = np.array([ r.iout for r in routes ], dtype=int)
+        #: Coefficients of the connected routes, in the order of ``circuit.routes``.
+        #: Per-member variations of them can be passed to :meth:`solve_ensemble`.
+        self.route_coefficients = np.array([ r.coeff for r in routes ], dtype=float)
+    
+    @property
+    def int_factor(self):
+        "Time scaling of the integrators, i.e. ``k0`` divided by the time unit"
+        return self._int_factor
+    
+    @int_factor.setter
+    def int_factor(self, int_factor):
+        self._int_factor = int_factor
+        self.compiled_rhs = None # is generated again
+    
+    def rhs_source(self):
+        """
+        Generates the python code of a specialized :meth:`rhs` function for the circuit,
+        which is used by the ``compiled`` backend. It contains only the nonzero terms of the
+        circuit, with the constants, multipliers and ``int_factor`` folded in. Returns
+        ``None`` if this is not possible, i.e. if the multipliers form an algebraic loop.
+        
+        >>> from lucipy import Circuit
+        >>> c = Circuit()
+        >>> x = c.int(ic=0.1)
+        >>> _ = c.connect(c.const(), x, weight=0.5)
+        >>> print(Simulation(c, realtime=True).rhs_source())
+        def rhs(t, state, clip=False):
+            if clip:
+                clip_state(state)
+            return np.array((-5000.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0))
+        """
+        if self.mul_levels is None:
+            return None
+        
+        def linear(row_I, row_M, constant, factor=1):
+            "Code of a sum with the nonzero terms of a row of the block matrices"
+            terms = [ f"{float(factor*a)!r}*i{j}" for j, a in enumerate(row_I) if a ] + \
+                    [ f"{float(factor*b)!r}*m{j}" for j, b in enumerate(row_M[0:4]) if b ]
+            if constant:
+                terms.append(repr(float(factor*constant)))
+            return " + ".join(terms) if terms else "0.0"
+        
+        lines = [ "def rhs(t, state, clip=False):", "    if clip:", "        clip_state(state)" ]
+        if self.A.any() or self.C.any():
+            lines.append(f"    i0, i1, i2, i3, i4, i5, i6, i7 = state.tolist()")
+        
+        # only multipliers whose output is used are evaluated
+        needed = [ j for j in range(4) if self.B[:, j].any() or self.D[:, j].any() ]
+        for level in self.mul_levels:
+            for j in level:
+                if j in needed:
+                    a = linear(self.C[2*j], self.D[2*j], self.constant[8+2*j])
+                    b = linear(self.C[2*j+1], self.D[2*j+1], self.constant[8+2*j+1])
+                    lines.append(f"    m{j} = ({a}) * ({b})")
+        
+        int_sign = -1 # in LUCIDAC REV1, integrators *do* negate
+        derivatives = [ linear(self.A[k], self.B[k], self.constant[k], int_sign*float(self.int_factor[k])) for k in range(8) ]
+        lines.append(f"    return np.array(({', '.join(derivatives)}))")
+        return "\n".join(lines)
+    
+    def mul_plan(self):
+        """
+        Determines in which order the multipliers have to be evaluated, given the
+        MUL to MUL connections in the D block. Returns a list of *levels*, each one
+        being an array of multiplier indices. The multipliers within a level only depend
+        on integrators and multipliers of earlier levels. Returns ``None`` if the
+        multipliers form an algebraic loop.
+        
+        >>> from lucipy import Circuit
+        >>> c = Circuit()
+        >>> x = c.int(ic=0.5)
+        >>> x2, x4 = c.mul(), c.mul()
+        >>> _ = c.connect(x, x2.a), c.connect(x, x2.b), c.connect(x2, x4.a), c.connect(x2, x4.b)
+        >>> _ = c.connect(x4, x)
+        >>> [ level.tolist() for level in Simulation(c).mul_plan() ]
+        [[0, 2, 3], [1]]
+        """
+        import numpy as np
+        num_muls = 4 # the other four outputs of the MMulBlock are constant
+        # depends[j,k]: multiplier j takes (one of) its inputs from multiplier k
+        depends = (self.D[:, :num_muls] != 0).reshape(num_muls, 2, num_muls).any(axis=1)
+        level = [None] * num_muls
+        levels = []
+        remaining = set(range(num_muls))
+        while remaining:
+            ready = [ j for j in sorted(remaining) if all(level[k] is not None for k in np.flatnonzero(depends[j])) ]
+            if not ready:
+                return None # algebraic loop
+            for j in ready:
+                level[j] = len(levels)
+            levels.append(np.array(ready))
+            remaining -= set(ready)
+        return levels
+        
     def Mul_out(self, Iout, t=0):
         """
-        Determine Min from Iout, the 'loop unrolling' way.
+        Determine Mout from Iout. Each multiplier is evaluated exactly once, in the
+        order given by :attr:`mul_levels`. Multipliers of the same level are evaluated
+        at once.
+        
+        If the circuit has algebraic loops (or ACL_IN is used), falls back to the 'loop
+        unrolling' way, see :meth:`Mul_out_unrolled`.
     
         :arg Iout: Output of MathInt-Block. This is a list with 8 floats. This
            is also the current system state.
@@ -152,6 +333,27 @@ class Simulation:
            to the ``acl_in`` callback.
         :return: Mout, the output of the MathMul-Block. Numpy array of shape ``(8,)``
         """
+        if self.mul_levels is None or self.use_acl_in:
+            return self.Mul_out_unrolled(Iout, t)
+        import numpy as np
+        
+        # The sums are carried out in the same order as in Mul_out_unrolled, thus
+        # the results are identical.
+        Min_from_Iout = self.C.dot(Iout)
+        Min = Min_from_Iout + self.constant[8:16]
+        Mout = np.zeros((8,)) # the constant sources on MMulblock are zero
+        for level in self.mul_levels:
+            inputs = np.concatenate((2*level, 2*level+1))
+            Min[inputs] = Min_from_Iout[inputs] + self.D[inputs].dot(Mout) + self.constant[8:16][inputs]
+            Mout[level] = Min[2*level] * Min[2*level+1]
+        return Mout
+    
+    def Mul_out_unrolled(self, Iout, t=0):
+        """
+        Determine Mout from Iout, the 'loop unrolling' way: Evaluates all multipliers
+        repeatedly until the result does not change any more. This is only needed for
+        circuits with algebraic loops. Arguments as in :meth:`Mul_out`.
+        """
         import numpy as np
 
         Min0 = np.zeros((8,)) # initial guess
@@ -212,13 +414,19 @@ class Simulation:
     
     def rhs(self, t, state, clip=False):
         "Evaluates the Right Hand Side (rhs) as in ``d/dt state=rhs(t,state)``"
+        if self.backend == "compiled" and not self.use_acl_in:
+            if self.compiled_rhs is None:
+                source = self.rhs_source()
+                # False marks circuits which cannot be compiled
+                self.compiled_rhs = compile_source(source) if source else False
+            if self.compiled_rhs:
+                return self.compiled_rhs(t, state, clip)
+        
         Iout = state
         
         #eps = 1e-2 * np.random.random()
-        eps = 0.2
         if clip:
-            Iout[Iout > +1.4] = +1.4 - eps
-            Iout[Iout < -1.4] = -1.4 + eps
+            clip_state(Iout)
 
         Mout = self.Mul_out(Iout, t)
         
@@ -235,6 +443,96 @@ class Simulation:
         #print(t)
         return int_sign * Iin * self.int_factor
     
+    def jac(self, t, state):
+        """
+        Evaluates the Jacobian ``d rhs / d state`` of the :meth:`rhs` analytically, as a
+        matrix of shape ``(8,8)``. The multipliers are bilinear, thus their derivatives
+        follow from the product rule, propagated along the :attr:`mul_levels`.
+        Clipping is not taken into account.
+        
+        Implicit solvers such as ``Radau``, ``BDF`` and ``LSODA`` need the Jacobian. If it is
+        not given, they estimate it with finite differences, costing 8 or more further
+        :meth:`rhs` calls each time. :meth:`solve_ivp` passes this method automatically.
+        Returns ``None`` for circuits with algebraic loops.
+        
+        >>> from lucipy import Circuit
+        >>> c = Circuit()
+        >>> x = c.int(ic=0.5)
+        >>> x2 = c.mul()
+        >>> _ = c.connect(x, x2.a), c.connect(x, x2.b), c.connect(x2, x)
+        >>> float(Simulation(c, realtime=True).jac(0, [0.5, 0, 0, 0, 0, 0, 0, 0])[0,0]) # d/dx -k0*x^2 = -2*k0*x
+        -10000.0
+        """
+        if self.mul_levels is None or self.use_acl_in:
+            return None
+        import numpy as np
+        state = np.asarray(state, dtype=float)
+        Mout = self.Mul_out(state, t)
+        Min = self.C.dot(state) + self.D.dot(Mout) + self.constant[8:16]
+        
+        # derivatives of the multiplier outputs with respect to the state
+        dMout = np.zeros((8,8))
+        for level in self.mul_levels:
+            a, b = 2*level, 2*level+1
+            dMin_a = self.C[a] + self.D[a].dot(dMout)
+            dMin_b = self.C[b] + self.D[b].dot(dMout)
+            dMout[level] = Min[b][:,None] * dMin_a + Min[a][:,None] * dMin_b
+        
+        int_sign = -1 # as in rhs
+        return (int_sign * self.int_factor)[:,None] * (self.A + self.B.dot(dMout))
+
+    def rhs_ensemble(self, t, states, coefficients=None, clip=False):
+        """
+        Evaluates the :meth:`rhs` for many states at once, i.e. for an ensemble of
+        ``N`` copies of the circuit.
+
+        :arg states: Array of shape ``(8, N)``, one column per member
+        :arg coefficients: Optional route coefficients per member, as array of shape
+           ``(len(route_coefficients), N)``. Defaults to :attr:`route_coefficients` for
+           all members.
+        :arg clip: As in :meth:`rhs`, applied in place to ``states``.
+        :return: Array of shape ``(8, N)``
+
+        The circuit is evaluated route by route, such that the coefficients can differ
+        between the members without a pair of 16x16 matrices for each one.
+
+        >>> import numpy as np
+        >>> from lucipy import Circuit
+        >>> c = Circuit()
+        >>> x = c.int()
+        >>> _ = c.connect(c.const(), x, weight=0.5)
+        >>> Simulation(c, realtime=True).rhs_ensemble(0, np.zeros((8,3)), [[0.1, 0.2, 0.3]])[0]
+        array([-1000., -2000., -3000.])
+        """
+        if self.mul_levels is None or self.use_acl_in:
+            raise ValueError("Ensembles require a circuit without algebraic loops and ACL_IN")
+        import numpy as np
+        if clip:
+            clip_state(states)
+
+        num_members = states.shape[1]
+        if coefficients is None:
+            coefficients = self.route_coefficients[:, None]
+        coefficients = np.asarray(coefficients, dtype=float)
+
+        # rows: Iout, Mout, constant giver. The constant sources on MMulblock are zero.
+        sources = np.zeros((17, num_members))
+        sources[0:8] = states
+        sources[16] = self.u_constant or 0
+
+        def inputs(target):
+            "Sum of all routes ending at the given Mblock input"
+            routes = self.route_targets == target
+            return (coefficients[routes] * sources[self.route_sources[routes]]).sum(axis=0)
+
+        for level in self.mul_levels:
+            for j in level:
+                sources[8+j] = inputs(8+2*j) * inputs(8+2*j+1)
+
+        int_sign = -1 # as in rhs
+        Iin = np.array([ inputs(k) for k in range(8) ])
+        return (int_sign * self.int_factor)[:,None] * Iin
+
     def mblocks_output(self, Iout, Mout=None):
         """
         Returns the full two-Math block outputs as continous array, with indices from
@@ -320,7 +618,9 @@ class Simulation:
            is used. If given, a list with ``0 <= size <= 8`` has to be provided.
         :arg clip: Whether to carry out bounded-in-bounded-out value clipping as a real analog computer would do
         :arg dense_output: value ``True``allows for interpolating on ``res.sol(linspace(...))``
-        :arg method: value ``LSODA`` is good for stiff problems
+        :arg method: value ``LSODA`` is good for stiff problems. For the implicit methods
+           ``Radau``, ``BDF`` and ``LSODA``, the analytic Jacobian :meth:`jac` is passed
+           automatically, unless a ``jac`` is given.
         :arg t_eval: In order to get a solution on equidistant time, for instance you can
            pass this option an ``np.linspace(0, t_final, num=500)``
         :arg ics_sign: The overall sign for the integrator initial conditions. Since the real
@@ -352,16 +652,168 @@ class Simulation:
         i.e. the ADCs or Front panel output (ACLs), you can map the resulting state
         vector (at any soution time) throught :meth:`adc_values` and :meth:`acl_out_values`.        
         """
+        ics = self.initial_state(ics, ics_sign)
+        
+        implicit = kwargs_for_solve_ivp.get("method") in ("Radau", "BDF", "LSODA")
+        if implicit and "jac" not in kwargs_for_solve_ivp and self.mul_levels is not None and not self.use_acl_in:
+            kwargs_for_solve_ivp["jac"] = self.jac
+        
+        from scipy.integrate import solve_ivp
+        return solve_ivp(lambda t,state: self.rhs(t,state,clip), [0, t_final], ics, **kwargs_for_solve_ivp)
+
+    def initial_state(self, ics=None, ics_sign=-1):
+        "Returns the state at ``t=0``, with ``ics`` and ``ics_sign`` as in :meth:`solve_ivp`"
         import numpy as np
         if np.all(ics == None):
             ics = self.ics
         elif len(ics) < len(self.ics):
             ics = list(ics) + [0]*(len(self.ics) - len(ics))
-            
-        ics = ics_sign * np.array(ics)
-        
-        from scipy.integrate import solve_ivp
-        return solve_ivp(lambda t,state: self.rhs(t,state,clip), [0, t_final], ics, **kwargs_for_solve_ivp)
+        return ics_sign * np.array(ics)
+
+    def solve_fixed(self, t_final, sample_rate, method="rk4", max_step=None, clip=False, ics=None, ics_sign=-1, out=None):
+        """
+        Solves the initial value problem with a fixed step size, on the sampling grid of
+        the ADCs. In contrast to :meth:`solve_ivp`, the :meth:`rhs` is evaluated in regular
+        intervals, so clipping happens after every step and does not produce artefacts.
+        
+        :arg t_final: Final time, as in :meth:`solve_ivp`
+        :arg sample_rate: Number of samples per time unit. With ``realtime=True``, this is
+           the ``sample_rate`` of the DAQ configuration of LUCIDAC.
+        :arg method: ``"rk4"`` or ``"euler"``, see :func:`fixed_step`
+        :arg max_step: Maximum step size. Every sampling interval is divided in as many steps
+           as needed. Defaults to a fiftieth of the time constant of the fastest integrator.
+        :arg clip: Whether to clip the state after every step
+        :arg ics: As in :meth:`solve_ivp`
+        :arg ics_sign: As in :meth:`solve_ivp`
+        :arg out: Optional preallocated array of shape ``(8, num_samples)``
+        :return: Tuple ``(t, y)`` of the ``num_samples = int(t_final*sample_rate)`` sampling
+           times ``t = k/sample_rate`` and the integrator states ``y`` at these times, in the
+           same shape as in the result of :meth:`solve_ivp`.
+        
+        >>> from lucipy import Circuit
+        >>> e = Circuit()
+        >>> ramp = e.int(ic=-1)
+        >>> _ = e.connect(e.const(), ramp, weight=0.1)
+        >>> t, y = Simulation(e).solve_fixed(10, sample_rate=2)
+        >>> y[0].round(3).tolist()
+        [1.0, 0.95, 0.9, 0.85, 0.8, 0.75, 0.7, 0.65, 0.6, 0.55, 0.5, 0.45, 0.4, 0.35, 0.3, 0.25, 0.2, 0.15, 0.1, 0.05]
+        """
+        import numpy as np
+        import math
+        num_samples = int(t_final * sample_rate)
+        if max_step is None:
+            max_step = 0.02 / np.max(np.abs(self.int_factor))
+        substeps = max(1, math.ceil(1 / sample_rate / max_step))
+        h = 1 / sample_rate / substeps
+        
+        y = fixed_step(self.rhs, self.initial_state(ics, ics_sign), h, num_samples, substeps, method, clip, out)
+        return np.arange(num_samples) / sample_rate, y
+
+    def solve_ensemble(self, ics_batch, t_eval, coefficients=None, clip=False, ics_sign=-1,
+                       method="RK45", batch_size=10_000, out=None, **solver_options):
+        """
+        Solves the circuit for an ensemble of initial conditions and/or coefficients at
+        once, for instance for Monte Carlo studies. In contrast to calling :meth:`solve_ivp`
+        for each member, the states of all members are advanced together as one ``(8, N)``
+        matrix, with one call of :meth:`rhs_ensemble` per solver stage.
+
+        :arg ics_batch: Initial conditions, as array of shape ``(N, k)`` with ``k <= 8``
+           (missing ones are zero). If ``None``, the configuration of the circuit is used
+           for all members.
+        :arg t_eval: Times where the states are stored, starting at ``0``.
+        :arg coefficients: Optional route coefficients per member, as array of shape
+           ``(N, len(route_coefficients))``, for instance a perturbation such as
+           ``sim.route_coefficients * rng.normal(1, 0.01, (N, len(sim.route_coefficients)))``.
+           The order is the one of :attr:`route_coefficients`.
+        :arg clip: As in :meth:`solve_ivp`
+        :arg ics_sign: As in :meth:`solve_ivp`
+        :arg method: An explicit ``scipy.integrate`` solver, i.e. ``RK45``, ``RK23`` or
+           ``DOP853``, or one of the fixed step methods ``rk4`` and ``euler`` of
+           :func:`fixed_step`. These require an equidistant ``t_eval`` and take the option
+           ``max_step`` as in :meth:`solve_fixed`.
+        :arg batch_size: Number of members which are solved together. The step sizes
+           within a batch are chosen by its most demanding member.
+        :arg out: Optional preallocated array of shape ``(N, 8, len(t_eval))`` which
+           receives the result.
+        :arg solver_options: Passed to the solver, for instance ``rtol`` and ``atol``. The
+           fixed step methods only take ``max_step`` and raise a ``TypeError`` otherwise.
+        :return: The array ``out``, holding the integrator states of member ``n`` at the
+           times ``t_eval`` in ``out[n]``.
+
+        >>> from lucipy import Circuit
+        >>> c = Circuit()
+        >>> x = c.int()
+        >>> _ = c.connect(c.const(), x, weight=0.1)
+        >>> y = Simulation(c).solve_ensemble([[-0.5], [0.5]], [0, 2, 4])
+        >>> y.shape
+        (2, 8, 3)
+        >>> y[:,0,:].round(3).tolist() # ramps with slope -0.1
+        [[0.5, 0.3, 0.1], [-0.5, -0.7, -0.9]]
+        """
+        import numpy as np
+        import scipy.integrate, math
+
+        t_eval = np.asarray(t_eval, dtype=float)
+        if coefficients is not None:
+            coefficients = np.asarray(coefficients, dtype=float)
+        if ics_batch is None:
+            if coefficients is None:
+                raise ValueError("Need ics_batch or coefficients to determine the ensemble size")
+            ics_batch = np.tile(self.ics, (len(coefficients), 1))
+        ics_batch = np.asarray(ics_batch, dtype=float)
+        num_members = len(ics_batch)
+        if coefficients is not None and coefficients.shape != (num_members, len(self.route_coefficients)):
+            raise ValueError(f"Expecting coefficients of shape {(num_members, len(self.route_coefficients))}, got {coefficients.shape}")
+
+        shape = (num_members, 8, len(t_eval))
+        if out is None:
+            out = np.empty(shape)
+        elif out.shape != shape:
+            raise ValueError(f"Expecting out of shape {shape}, got {out.shape}")
+
+        fixed = method in ("rk4", "euler")
+        if fixed:
+            sample_period = t_eval[1] - t_eval[0] if len(t_eval) > 1 else 1
+            if t_eval[0] != 0 or not np.allclose(np.diff(t_eval), sample_period):
+                raise ValueError(f"Method {method} requires an equidistant t_eval starting at 0")
+            unsupported = sorted(set(solver_options) - {"max_step"})
+            if unsupported:
+                raise TypeError(f"Method {method} only takes the option max_step, not {', '.join(unsupported)}")
+            max_step = solver_options.get("max_step", 0.02 / np.max(np.abs(self.int_factor)))
+            substeps = max(1, math.ceil(sample_period / max_step))
+        else:
+            solver_class = getattr(scipy.integrate, method)
+
+        for start in range(0, num_members, batch_size):
+            members = slice(start, min(start + batch_size, num_members))
+            n = members.stop - members.start
+
+            ics = np.zeros((8, n))
+            ics[:ics_batch.shape[1]] = ics_sign * ics_batch[members].T
+            batch_coefficients = None if coefficients is None else coefficients[members].T
+
+            if fixed:
+                fun = lambda t, y: self.rhs_ensemble(t, y, batch_coefficients)
+                fixed_step(fun, ics, sample_period / substeps, len(t_eval), substeps, method, clip, out[members].transpose(1, 0, 2))
+                continue
+
+            def fun(t, y):
+                return self.rhs_ensemble(t, y.reshape(8, n), batch_coefficients, clip).ravel()
+
+            solver = solver_class(fun, 0, ics.ravel(), t_eval[-1], **solver_options)
+            done = np.searchsorted(t_eval, 0, side="right") # t_eval points at t=0
+            out[members, :, :done] = ics.T[:, :, None]
+            while done < len(t_eval):
+                message = solver.step()
+                if solver.status == "failed":
+                    raise ValueError(f"Solving members {start}..{members.stop} failed at t={solver.t}: {message}")
+                reached = np.searchsorted(t_eval, solver.t, side="right")
+                if reached > done:
+                    sol = solver.dense_output()
+                    for k in range(done, reached):
+                        out[members, :, k] = sol(t_eval[k]).reshape(8, n).T
+                    done = reached
+        return out
 
 
 def find(element, structure):
@@ -496,13 +948,13 @@ class Emulation:
 
     def micros(self):
         "Returns microseconds since initialization, mimics microcontroller uptime"
-        uptime_sec = self.started - time.time()
-        return int(uptime_sec / 1e6)
+        uptime_sec = time.monotonic() - self.started
+        return int(uptime_sec * 1e6) % 2**32
 
     @expose
     def ping(self):
         "Emulates the ping behaviour (approximatively)"
-        return { "now": datetime.now().isoformat(), "micros": self.micros() }
+        return { "now": datetime.datetime.now().isoformat(), "micros": self.micros() }
         
     @expose
     def reset(self):
@@ -598,6 +1050,24 @@ class Emulation:
         "sample_rate": 500_000,
     }
     
+    #: Integrator for runs. ``"solve_ivp"`` uses :meth:`Simulation.solve_ivp` with adaptive
+    #: steps and interpolates on the sampling grid, with a step size and cost independent
+    #: of the sample rate. ``"rk4"`` or ``"euler"`` use :meth:`Simulation.solve_fixed`,
+    #: which clips after every step but always steps through the whole sampling grid.
+    integrator = "solve_ivp"
+    
+    #: Tolerances for ``integrator = "solve_ivp"``
+    integrator_tolerances = dict(rtol=1e-6, atol=1e-9)
+    
+    @expose
+    def manual_mode(self, to):
+        """
+        Accepts the manual mode changes (``ic``, ``op``, ``halt``, ``minion``, ...) but
+        has no further effect. In particular minions run immediately without waiting
+        for a master.
+        """
+        self.mode = to
+    
     #@expose("out-of-band")
     @expose
     def start_run(self, **start_run_msg):
@@ -605,6 +1075,8 @@ class Emulation:
         Emulate an actual run with the LUCIDAC Run queue and FlexIO data aquisition.
         This will return the ADC measurements on the requested sampling points.
         There are no constraints for the sampling rate, in contrast to real LUCIDAC.
+        As in hardware, the samples are taken at the times ``k/sample_rate``. The
+        integration method is chosen with :attr:`integrator`.
         
         This function does it all in one rush "in sync" , no need for a dedicated queue.
         Internally, it just prepares all envelopes and sends them out then alltogether.
@@ -629,7 +1101,7 @@ class Emulation:
                 'num_channels': 0,                 # should obey
                 'sample_op': True,                 # will ignore
                 'sample_op_end': True,             # will ignore
-                'sample_rate': 500000              # will ignore
+                'sample_rate': 500000              # determines the sampling times
             }}
         
 
@@ -651,7 +1123,6 @@ class Emulation:
         
         import numpy as np
         num_samples = int(t_final_sec * samples_per_second)
-        sampling_times = np.linspace(0, t_final_sec, num_samples)
         
         reply_envelopes = []
         
@@ -662,14 +1133,22 @@ class Emulation:
         circuit = Circuit().load(self.circuit)
         #print(circuit)
         #print(f"{t_final_sec=} {t_final_sec=} {samples_per_second=} {num_samples=} {sampling_times.shape=}")
-        sim = Simulation(circuit, realtime=True)
-        res = sim.solve_ivp(t_final_sec, dense_output=True)
+        if self.integrator == "solve_ivp":
+            sim = Simulation(circuit, realtime=True)
+            res = sim.solve_ivp(t_final_sec, dense_output=True, **self.integrator_tolerances)
+            if res.status != 0:
+                raise ValueError(f"ODE Solver failed: {res}")
+            sampling_times = np.arange(num_samples) / samples_per_second
+            states = res.sol(sampling_times) if num_samples else np.empty((8, 0))
+        else:
+            sim = Simulation(circuit, realtime=True, backend="compiled")
+            # integrates with fixed steps on the sampling grid of the ADCs
+            sampling_times, states = sim.solve_fixed(t_final_sec, samples_per_second, method=self.integrator)
         
-        if res.status != 0:
-            raise ValueError(f"ODE Solver failed: {res}")
-        #assert data.t[-1] == t_final
+        if not np.all(np.isfinite(states)):
+            raise ValueError(f"ODE Solver failed: Diverged within {t_final_sec=}")
         
-        states_sampled = res.sol(sampling_times).T
+        states_sampled = states.T
         assert states_sampled.shape == (num_samples, 8)
         
         adc_samples = [sim.adc_values(state) for state in states_sampled]
@@ -692,6 +1171,70 @@ class Emulation:
         reply_envelopes.append({"type": "run_state_change", "msg": { "id": run_id, "t": self.micros(), "old": "NEW", "new": "DONE" }})
         return reply_envelopes
     
+    #: Size of a decoded ``ota_update_stream`` payload, as announced by ``ota_update_init``
+    ota_chunk_size = 4096
+    
+    @expose
+    def ota_update_status(self):
+        """
+        Reports the state of an over-the-air firmware upgrade. The emulator just
+        collects the image in memory.
+        """
+        ota = getattr(self, "ota", None)
+        status = dict(is_upgrade_running = ota is not None, buffer_addr = 0, buffer_size = 8*1024*1024)
+        if ota:
+            import hashlib
+            actual_hash = hashlib.sha256(ota["image"]).hexdigest()
+            status.update(
+                name = ota["name"],
+                imagelen = ota["imagelen"],
+                bin_chunk_size = self.ota_chunk_size,
+                bytes_transmitted = len(ota["image"]),
+                transfer_completed = len(ota["image"]) == ota["imagelen"],
+                upstream_hash = ota["upstream_hash"],
+                actual_hash = actual_hash,
+                hash_correct = actual_hash == ota["upstream_hash"],
+            )
+        return status
+    
+    @expose
+    def ota_update_init(self, name, imagelen, upstream_hash):
+        "Starts an over-the-air upgrade"
+        if getattr(self, "ota", None):
+            return {"error": "Upgrade already running, abort it first"}
+        self.ota = dict(name=name, imagelen=imagelen, upstream_hash=upstream_hash, image=bytearray())
+        return {"encoding": "binary-base64", "bin_chunk_size": self.ota_chunk_size}
+    
+    @expose
+    def ota_update_stream(self, payload, offset=None):
+        "Receives a chunk of the image. If the offset is given, it has to be the number of bytes received so far."
+        import base64
+        ota = getattr(self, "ota", None)
+        if not ota:
+            return {"error": "No upgrade running"}
+        if offset is not None and offset != len(ota["image"]):
+            return {"error": f"Chunk at offset {offset} but expected offset {len(ota['image'])}"}
+        chunk = base64.b64decode(payload)
+        if len(ota["image"]) + len(chunk) > ota["imagelen"]:
+            return {"error": "Image exceeds announced length"}
+        ota["image"] += chunk
+    
+    @expose
+    def ota_update_abort(self):
+        "Aborts a running over-the-air upgrade"
+        self.ota = None
+    
+    @expose
+    def ota_update_complete(self):
+        """
+        Finishes an over-the-air upgrade. The real LUCIDAC would reboot into the new image,
+        the emulator only forgets it.
+        """
+        status = self.ota_update_status()
+        if not status.get("hash_correct"):
+            return {"error": "Cannot complete upgrade, transfer incomplete or corrupted"}
+        self.ota = None
+    
     @expose
     def help(self):
         return {
@@ -701,24 +1244,19 @@ class Emulation:
     
     def exposed_methods(self):
         "Returns a dictionary of exposed methods with string key names and callables as values"
-        all_methods = (a for a in dir(self) if callable(getattr(self, a)) and not a.startswith('__'))
-        exposed_methods = { a: getattr(self, a) for a in all_methods if hasattr(getattr(self, a), 'exposed') }
-        return exposed_methods
+        if "_exposed_methods" not in self.__dict__:
+            # looking them up for each request is costly, in particular for emu:/?direct
+            all_methods = (a for a in dir(self) if callable(getattr(self, a)) and not a.startswith('__'))
+            self._exposed_methods = { a: getattr(self, a) for a in all_methods if hasattr(getattr(self, a), 'exposed') }
+        return self._exposed_methods
     
-    
-    def handle_request(self, line, return_always_list=False):
+    def handle_envelope(self, envelope):
         """
-        Handles incoming JSONL encoded envelope and respons with a string encoded JSONL envelope.
-   
-        :param line: String encoded JSONL input envelope
-        :param return_always_list: Returns always a list of strings
-        :returns: String encoded JSONL single envelope. If out-of-bound messages are generated, will
-          return a list of such strings.
+        Handles an incoming envelope given as dictionary and returns the list of reply
+        envelopes, also as dictionaries. This is the part of :meth:`handle_request` which
+        does not deal with JSON and is used directly by the ``emu:/?direct`` endpoint.
+        Note that messages are passed by reference.
         """
-        
-        # decided halfway to do it in another way
-        #json_writer = (lambda envelope: writer((json.dumps(envelope)+"\n").encode("utf-8"))) if writer else None
-        
         def decorate_protocol_reply(ret):
             if isinstance(ret["msg"], dict) and "error" in ret["msg"]:
                 ret["error"] = ret["msg"]["error"]
@@ -726,64 +1264,81 @@ class Emulation:
                 ret["code"] = -2
             else:
                 ret["code"] = 0 
-            
-            return json.dumps(ret) + "\n"
+            return ret
         
-        try:
-            if not line or line.isspace():
-                return "\n"
-            envelope = json.loads(line)
-            #print(f"Parsed {envelope=}")
-            ret = {}
-            if "id" in envelope:
-                ret["id"] = envelope["id"]
-            if "type" in envelope:
-                ret["type"] = envelope["type"]
+        ret = {}
+        if "id" in envelope:
+            ret["id"] = envelope["id"]
+        if "type" in envelope:
+            ret["type"] = envelope["type"]
+        
+        methods = self.exposed_methods()
+        if envelope.get("type") in methods:
+            method = methods[ envelope["type"] ]
+            try:
+                msg_in = envelope["msg"] if "msg" in envelope and isinstance(envelope["msg"], dict) else {}
+
+                #if method.exposed == "out-of-band":
+                    #ret["msg"] = method(**msg_in, writer=json_writer)
+                #else:
+                
+                # The outcome is EITHER just a single msg_out
+                # OR it is a list of whole RecvEnvelopes
             
-            methods = self.exposed_methods()
-            if envelope["type"] in methods:
-                method = methods[ envelope["type"] ]
-                try:
-                    msg_in = envelope["msg"] if "msg" in envelope and isinstance(envelope["msg"], dict) else {}
-
-                    #if method.exposed == "out-of-band":
-                        #ret["msg"] = method(**msg_in, writer=json_writer)
-                    #else:
-                    
-                    # The outcome is EITHER just a single msg_out
-                    # OR it is a list of whole RecvEnvelopes
+                outcome = method(**msg_in)
                 
-                    outcome = method(**msg_in)
-                    
-                    if isinstance(outcome, list):
-                        return list(map(decorate_protocol_reply, outcome))
-                    else:
-                        ret["msg"] = outcome
-                except Exception as e:
-                    print(f"Exception at handling {envelope=}: ", e)
-                    if self.debug:
-                        # fancy debugging, python included
-                        import sys, traceback, pdb
-                        extype, value, tb = sys.exc_info()
-                        traceback.print_exc()
-                        pdb.post_mortem(tb)
-                    ret["msg"] = {"error": f"Error captured by handle_request(): {type(e).__name__}: {e}" }
-            else:   
-                ret["msg"] = {'error': "Don't know this message type"}
+                if isinstance(outcome, list):
+                    # the reply to the request carries its id, as in the firmware
+                    for reply in outcome:
+                        if reply.get("type") == envelope["type"] and "id" in ret:
+                            reply.setdefault("id", ret["id"])
+                    return list(map(decorate_protocol_reply, outcome))
+                else:
+                    ret["msg"] = outcome
+            except Exception as e:
+                print(f"Exception at handling {envelope=}: ", e)
+                if self.debug:
+                    # fancy debugging, python included
+                    import sys, traceback, pdb
+                    extype, value, tb = sys.exc_info()
+                    traceback.print_exc()
+                    pdb.post_mortem(tb)
+                ret["msg"] = {"error": f"Error captured by handle_request(): {type(e).__name__}: {e}" }
+        else:   
+            ret["msg"] = {'error': "Don't know this message type"}
+        
+        return [decorate_protocol_reply(ret)]
+    
+    def handle_request(self, line, return_always_list=False):
+        """
+        Handles incoming JSONL encoded envelope and respons with a string encoded JSONL envelope.
+   
+        :param line: String encoded JSONL input envelope
+        :param return_always_list: Returns always a list of strings
+        :returns: String encoded JSONL single envelope. If out-of-bound messages are generated, will
+          return a list of such strings.
+        """
+        if not line or line.isspace():
+            return "\n"
+        try:
+            replies = self.handle_envelope(json.loads(line))
         except json.JSONDecodeError as e:
-            ret = { "msg": { "error": f"Cannot read message '{line}', error: {e}" } }
+            replies = [{ "msg": {}, "error": f"Cannot read message '{line}', error: {e}", "code": -2 }]
         
-        ret = decorate_protocol_reply(ret)
-        return [ret] if return_always_list else ret
+        replies = [ json.dumps(reply) + "\n" for reply in replies ]
+        return replies if return_always_list or len(replies) > 1 else replies[0]
     
-    def __init__(self, bind_addr="127.0.0.1", bind_port=5732, emulated_mac=default_emulated_mac, debug=False):
+    def __init__(self, bind_addr="127.0.0.1", bind_port=5732, emulated_mac=default_emulated_mac, debug=False, unix_socket=None):
         """
         :arg bind_addr: Adress to bind to, can also be a hostname. Use "0.0.0.0" to listen on all interfaces.
         :art bind_port: TCP port to bind to. Use ``0`` to let the Operating System find a free port.
+        :arg unix_socket: If given, listen on a Unix domain socket with this filename instead
+           of TCP. Clients connect with the endpoint ``unix:/path/to/socket``. This saves the
+           TCP/IP stack for local tests.
         """
         self.mac = emulated_mac
         self.reset()
-        self.started = time.time()
+        self.started = time.monotonic()
         parent = self
         
         class TCPRequestHandler(socketserver.StreamRequestHandler):
@@ -795,6 +1350,8 @@ class Emulation:
                     try:
                         #print(f"{has_data(self.rfile)=} {has_data(self.wfile)=}")
                         line = self.rfile.readline().decode("utf-8")
+                        if not line:
+                            return # client closed the connection
                         #print(f"Got {line=}")
                         responses = parent.handle_request(line, return_always_list=True)
                         #print(f"Writing out {response=}")
@@ -808,7 +1365,7 @@ class Emulation:
                         print(e)
                         return
         
-        self.addr = (bind_addr, bind_port)
+        self.addr = unix_socket if unix_socket else (bind_addr, bind_port)
         self.handler_class = TCPRequestHandler
         self.debug = debug
         
@@ -826,6 +1383,17 @@ class Emulation:
                 print(f"Server crash: {e}")
                 return
     
+    def _make_server(self, mixin=None):
+        "Creates the TCP or Unix domain socket server, optionally with a Forking or Threading mixin"
+        if isinstance(self.addr, str):
+            base = socketserver.UnixStreamServer
+            if os.path.exists(self.addr):
+                os.unlink(self.addr) # stale socket of an earlier run
+        else:
+            base = socketserver.TCPServer
+        Server = type("Server", (mixin, base) if mixin else (base,), {})
+        return Server(self.addr, self.handler_class)
+    
     def serve_forking(self):
         """
         Starts TCP server in a seperate process. Furthermore, the TCP Server will fork for each incoming
@@ -842,9 +1410,7 @@ class Emulation:
             proc.join()
         
         """
-        class TCPServer(socketserver.ForkingMixIn, socketserver.TCPServer):
-            pass
-        self.server = TCPServer(self.addr, self.handler_class)
+        self.server = self._make_server(socketserver.ForkingMixIn)
         self.obtained_addr = self.server.server_address
         proc = multiprocessing.Process(target=self.server.serve_forever)
         proc.start()
@@ -870,9 +1436,7 @@ class Emulation:
         
            There is still some bug here and the server started within a thread never responds.
         """
-        class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-            pass
-        self.server = TCPServer(self.addr, self.handler_class)
+        self.server = self._make_server(socketserver.ThreadingMixIn)
         
         with self.server:
             self.obtained_addr = self.server.server_address
@@ -889,9 +1453,7 @@ class Emulation:
         Starts TCP server in main thread. This hands over control to the socket server event queue.
         Only one client can connect at a time. The function will never return except user interaction.        
         """
-        class TCPServer(socketserver.TCPServer):
-            pass
-        self.server = TCPServer(self.addr, self.handler_class)
+        self.server = self._make_server()
         self._serve_forever() # will never return except exception
     
     def endpoint(self):
@@ -899,6 +1461,8 @@ class Emulation:
         Determines endpoint URL if some server has been started. Endpoints are Strings.
         If a server has been started, this returns the actual Port assigned if port ``0`` was requested.
         """
+        if isinstance(self.addr, str):
+            return f"unix:{self.addr}"
         ip, port = self.obtained_addr if hasattr(self, "obtained_addr") else self.addr
         return f"tcp://{ip}:{port}"
 
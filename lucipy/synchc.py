@@ -25,25 +25,21 @@ The main class to use from this module is :class:`LUCIDAC`.
 """
 
 # all this is only python standard library  :)
-import logging, time, socket, select, json, types, typing, \
-    itertools, os, functools, collections, uuid, time, warnings
+import logging, time, socket, select, json, types, typing, re, \
+    itertools, os, functools, collections, contextlib, uuid, time, warnings, \
+    queue, threading, copy
 log = logging.getLogger('synchc')
-logging.basicConfig(level=logging.INFO)
 
 from .detect import detect, Endpoint
 
 __all__ = """
-    LUCIDAC Run LUCIGroup
+    LUCIDAC Run LUCIGroup GroupRun
+    Instrumentation ResponseCache ClockSync
     RemoteError LocalError
 """.split()
 
 nonempty = lambda lst: [x for x in lst if x]
 
-try:
-    import serial
-except ModuleNotFoundError:
-    serial = None
-
 class dotdict(dict):
     """dot.notation access to dictionary attributes"""
     #__getattr__ = dict.get
@@ -53,11 +49,84 @@ class dotdict(dict):
     __setattr__ = dict.__setitem__
     __delattr__ = dict.__delitem__
 
-def has_data(fh):
-    "Peeks a file handle (checks for data without reading/consuming)"
-    rlist, wlist, xlist = select.select([fh], [],[], 0)
+def deep_merge(target, update):
+    """
+    Merges the nested dictionary ``update`` into ``target``, in place. Keys are
+    turned into strings, as JSON would do. Lists in ``target`` are indexed by the keys
+    instead. Everything else than dictionaries is overwritten.
+    
+    >>> deep_merge({"/0": {"/M0": {"a": 1}}}, {"/0": {"/M0": {"b": 2}, "/U": [1]}})
+    {'/0': {'/M0': {'a': 1, 'b': 2}, '/U': [1]}}
+    >>> deep_merge({"elements": [{"ic": 0, "k": 100}, {"ic": 0}]}, {"elements": {"1": {"ic": 0.5}}})
+    {'elements': [{'ic': 0, 'k': 100}, {'ic': 0.5}]}
+    """
+    for key, value in update.items():
+        if isinstance(target, list):
+            key = int(key)
+            current = target[key]
+        else:
+            key = str(key)
+            current = target.get(key)
+        if isinstance(value, dict) and isinstance(current, (dict, list)):
+            deep_merge(current, value)
+        elif isinstance(value, dict):
+            target[key] = deep_merge({}, value)
+        else:
+            target[key] = value
+    return target
+
+def circuit_delta(old, new, path=[]):
+    """
+    Determines which entities differ between two (carrier level) configurations.
+    Entities are the keys starting with a slash. An entity is returned as a whole if
+    its own settings (the keys without slash) changed or if child entities were added
+    or removed. Otherwise only the changed children are returned. The result is a list
+    of ``(path, config)`` tuples, where an empty path stands for the whole configuration.
+    
+    >>> old = {"/0": {"/C": {"elements": [0.1, 0.2]}, "/I": {"elements": [1]}}}
+    >>> circuit_delta(old, {"/0": {"/C": {"elements": [0.1, 0.3]}, "/I": {"elements": [1]}}})
+    [(['0', 'C'], {'elements': [0.1, 0.3]})]
+    >>> circuit_delta(old, old)
+    []
+    """
+    if old == new:
+        return []
+    is_entity = lambda key: key.startswith("/")
+    if not isinstance(old, dict) or not isinstance(new, dict) \
+        or {k for k in old if is_entity(k)} != {k for k in new if is_entity(k)} \
+        or {k: v for k, v in old.items() if not is_entity(k)} != {k: v for k, v in new.items() if not is_entity(k)}:
+        return [(path, new)]
+    return [ delta for key in new if is_entity(key)
+        for delta in circuit_delta(old[key], new[key], path + [key[1:]]) ]
+
+def removes_keys(old, new):
+    """
+    Whether ``new`` lacks any of the (nested) keys of ``old``. An incremental update
+    with ``new`` would leave these settings of ``old`` in place.
+    
+    >>> removes_keys({"/0": {"/C": {}, "/I": {}}}, {"/0": {"/C": {}}})
+    True
+    >>> removes_keys({"elements": [{"ic": 1}]}, {"elements": [{"ic": 0.5, "k": 100}], "more": 4})
+    False
+    """
+    if isinstance(old, list) and isinstance(new, list):
+        return len(new) < len(old) or any(removes_keys(o, n) for o, n in zip(old, new))
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return False
+    return any(key not in new or removes_keys(old[key], new[key]) for key in old)
+
+def has_data(fh, timeout=0):
+    """
+    Peeks a file handle (checks for data without reading/consuming). If a timeout
+    (in seconds) is given, waits that long for data to arrive. ``None`` waits forever.
+    """
+    rlist, wlist, xlist = select.select([fh], [],[], timeout)
     return len(rlist) != 0
 
+def remaining(deadline):
+    "Seconds left until a ``time.monotonic()`` deadline, or None if there is no deadline"
+    return None if deadline is None else max(0, deadline - time.monotonic())
+
 
 class RemoteError(Exception):
     """
@@ -92,10 +161,77 @@ class LocalError(ValueError):
     """
     pass
 
-class tcpsocket:
-    "A socket with readline support"
-    def __init__(self, host, port, auto_reconnect=True):
+class linebuffer:
+    """
+    Base class for byte streams with readline support.
+    
+    Reading happens on bytes level: Data is received into a reusable buffer and complete
+    lines are cut out of it, without decoding them. This saves several copies per line
+    compared to a text mode file object, which matters for the high rate ``run_data``
+    streams. :class:`jsonlines` parses the bytes directly.
+    
+    Subclasses implement ``_receive_into(view, timeout)`` which receives at least one
+    byte into the given memoryview and returns the number of bytes received.
+    It raises a ``TimeoutError`` if nothing arrived within ``timeout`` seconds and a
+    ``ConnectionResetError`` if the stream was closed.
+    
+    :arg bufsize: Initial size of the userspace receive buffer in bytes. It grows if
+       a single line does not fit in.
+    """
+    def reset_buffer(self, bufsize=65536):
+        # received data lives in buf[start:end]
+        self.buf = bytearray(bufsize)
+        self.view = memoryview(self.buf)
+        self.start = self.end = 0
+    def _fill(self, timeout=None):
+        "Receives more data into the buffer, making room for it first"
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.start > 0 and self.end == len(self.buf):
+            # move the incomplete line to the beginning
+            pending = self.end - self.start
+            self.buf[0:pending] = bytes(self.view[self.start:self.end])
+            self.start, self.end = 0, pending
+        if self.end == len(self.buf):
+            # a single line is longer then the buffer
+            self.view.release()
+            self.buf.extend(bytes(len(self.buf)))
+            self.view = memoryview(self.buf)
+        self.end += self._receive_into(self.view[self.end:], timeout)
+    def readline(self, timeout=None):
+        """
+        Returns a complete line as bytes. Blocks until a line arrived. If that takes
+        longer then ``timeout`` seconds, raises a ``TimeoutError``.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            newline = self.buf.find(b"\n", self.start, self.end)
+            if newline >= 0:
+                line = bytes(self.view[self.start:newline+1])
+                self.start = newline + 1
+                return line
+            try:
+                self._fill(remaining(deadline))
+            except TimeoutError:
+                raise TimeoutError(f"No answer from {self} within {timeout} seconds")
+    def has_line(self):
+        "Whether a complete line was already received, i.e. readline will not block"
+        return self.buf.find(b"\n", self.start, self.end) >= 0
+
+class tcpsocket(linebuffer):
+    """
+    A socket with readline support, see :class:`linebuffer`.
+    
+    :arg nodelay: Set ``TCP_NODELAY``, i.e. disable Nagle's algorithm. This reduces the
+       latency of small request messages.
+    :arg rcvbuf: If given, the kernel receive buffer size (``SO_RCVBUF``) in bytes
+    :arg sndbuf: If given, the kernel send buffer size (``SO_SNDBUF``) in bytes
+    :arg bufsize: Initial size of the userspace receive buffer in bytes.
+    """
+    def __init__(self, host, port, auto_reconnect=True, nodelay=True, rcvbuf=None, sndbuf=None, bufsize=65536):
         self.host, self.port, self.auto_reconnect = host, port, auto_reconnect
+        self.nodelay, self.rcvbuf, self.sndbuf = nodelay, rcvbuf, sndbuf
+        self.bufsize = bufsize
         self.debug_print = False
         self.connect()
     def connect(self):
@@ -104,8 +240,14 @@ class tcpsocket:
         else:
             log.info(f"Connecting to TCP {self.host}:{self.port}...")
         self.s = socket.socket()
+        if self.nodelay:
+            self.s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.rcvbuf:
+            self.s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        if self.sndbuf:
+            self.s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
         self.s.connect((self.host,self.port))
-        self.fh = self.s.makefile(mode="rw", encoding="utf-8")
+        self.reset_buffer(self.bufsize)
     def close(self):
         return self.s.close()
         #del self.s
@@ -114,9 +256,7 @@ class tcpsocket:
         try:
             if self.debug_print:
                 print(f"tcpsocket.send({sth=})")
-            #self.s.sendall(sth.encode("ascii"))
-            self.fh.write(sth + "\n")
-            self.fh.flush()
+            self.s.sendall((sth + "\n").encode("utf-8"))
             #print("tcpsocket.send() completed")
         except (BrokenPipeError, ConnectionResetError) as e:
             if self.debug_print:
@@ -126,60 +266,115 @@ class tcpsocket:
                 return self.send(sth)
             else:
                 raise e
-    def read(self, *args, **kwargs):
-        "Returns a complete line as string. See instead also: self.s.recv(123)"
+    def _receive_into(self, view, timeout):
+        if timeout is not None and not has_data(self.s, timeout):
+            raise TimeoutError()
+        received = self.s.recv_into(view)
+        if received == 0:
+            raise ConnectionResetError(f"Connection closed by {self}")
+        return received
+    def read(self, timeout=None):
+        """
+        Returns a complete line as bytes. See instead also: self.s.recv(123)
+        Blocks until a line arrived. If that takes longer then ``timeout`` seconds,
+        raises a ``TimeoutError``. If the connection was lost, raises a
+        ``ConnectionError``, also when ``auto_reconnect`` reestablished it, since
+        replies to requests sent over the old connection will never arrive.
+        """
         try:
-            #print("tcpsocket.readline()")
-            #import ipdb; ipdb.set_trace()
-            line = self.fh.readline()
+            line = self.readline(timeout)
             if self.debug_print:
                 print(f"tcpsocket.read() = {line}")
             return line
-        except UnicodeDecodeError as e:
-            print(f"tcpsocket.read(): {e}. Input Bytes are: {e.object}")
-            return ""
         except ConnectionResetError as e:
             if self.debug_print:
                 print(f"tcpsocket.read: {e}")
             if self.auto_reconnect:
                 self.connect()
-                return "" # empty line, since query protcol should not readline empty socket
+                raise ConnectionError(f"Connection to {self} was lost and reestablished, pending replies are lost") from e
             else:
                 raise e
     def has_data(self):
-        return has_data(self.s)
+        return self.has_line() or has_data(self.s)
     def __repr__(self):
         return f"tcp://{self.host}:{self.port}"
-    
-# TODO: Probably refactor code, the classes tcpsocket and serialsocket share most of their logic
 
-class serialsocket:
-    "Uses pyserial to connect to directly attached device"
-    def __init__(self, device):
-        if not serial:
+class unixsocket(tcpsocket):
+    """
+    A Unix domain socket with readline support, used for instance by the local
+    :mod:`~lucipy.proxy`. Endpoint URLs look like ``unix:/tmp/lucidac.sock``.
+    """
+    def __init__(self, path, auto_reconnect=False, bufsize=65536):
+        self.path, self.auto_reconnect, self.bufsize = path, auto_reconnect, bufsize
+        self.debug_print = False
+        self.connect()
+    def connect(self):
+        if(hasattr(self, 's')):
+            log.warning(f"Trying to reconnect to {self.path}...")
+        else:
+            log.info(f"Connecting to Unix socket {self.path}...")
+        self.s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.s.connect(self.path)
+        self.reset_buffer(self.bufsize)
+    def __repr__(self):
+        return f"unix:{self.path}"
+
+class serialsocket(linebuffer):
+    """
+    Uses pyserial to connect to directly attached device, with readline support
+    as in :class:`linebuffer`.
+    
+    LUCIDACs are attached as USB CDC devices, where the baud rate has no meaning and
+    the USB full speed or high speed link determines the throughput. Therefore all
+    bytes the operating system has already received are taken in a single read call,
+    instead of reading byte by byte as ``Serial.readline()`` would do.
+    
+    :arg bufsize: Initial size of the userspace receive buffer in bytes.
+    :arg write_timeout: If given, seconds after which a blocking write to the device
+       gives up with a ``serial.SerialTimeoutException``.
+    :arg baudrate: Passed to pyserial, only relevant for real UARTs.
+    """
+    def __init__(self, device, bufsize=65536, write_timeout=None, baudrate=115200):
+        try:
+            import serial
+        except ModuleNotFoundError:
             raise ImportError("PySerial not available, please install with 'pip install pyserial'")
         self.device = device
-        self.fh = serial.Serial(self.device)
-        # sometimes there is stuff stuck in the serial port. Read all of it and wipe it.
-        while self.has_data():
-            self.fh.readline()
+        log.info(f"Connecting to serial {self.device}...")
+        self.fh = serial.Serial(self.device, baudrate=baudrate, write_timeout=write_timeout)
+        self.reset_buffer(bufsize)
+        # sometimes there is stuff stuck in the serial port. Wipe it.
+        self.fh.reset_input_buffer()
     def close(self):
         return self.fh.close()
     def send(self, sth):
-        print(f"serialsocket.send({sth})")
-        self.fh.write(sth.encode("ascii") + b"\n")
+        "Expects sth to be a string"
+        log.debug(f"serialsocket.send({sth})")
+        self.fh.write(sth.encode("utf-8") + b"\n")
         self.fh.flush()
-        print(f"serialsocket.send completed")
-    def read(self):
-        # block until have read exactly one line
-        while self.has_data():
-            ret = self.fh.readline()
-            print(f"serialsocket.read(): {ret}")
-            return ret
+    def _receive_into(self, view, timeout):
+        # pyserial waits for the first byte with the timeout, then takes whatever
+        # else is available without waiting.
+        self.fh.timeout = timeout
+        first = self.fh.read(1)
+        if not first:
+            raise TimeoutError()
+        view[0:1] = first
+        more = min(self.fh.in_waiting, len(view) - 1)
+        if more:
+            self.fh.timeout = 0
+            received = self.fh.readinto(view[1:1+more])
+            return 1 + (received or 0)
+        return 1
+    def read(self, timeout=None):
+        "Blocks until have read exactly one line, raises TimeoutError after timeout seconds"
+        line = self.readline(timeout)
+        log.debug(f"serialsocket.read(): {line}")
+        return line
     def has_data(self):
-        return has_data(self.fh)
+        return self.has_line() or self.fh.in_waiting > 0
     def __repr__(self):
-        return f"socket:/{self.device}"
+        return f"serial:{self.device}"
 
 class emusocket:
     "Emulates a socket with a callback function"
@@ -189,16 +384,18 @@ class emusocket:
             emu = Emulation(debug=debug)
             callback = lambda line: emu.handle_request(line)
         self.callback = callback
-        self.return_buffer = []
+        self.return_buffer = collections.deque()
     def send(self, sth):
         ret = self.callback(sth)
         if isinstance(ret, list):
-            self.return_buffer += ret
+            self.return_buffer.extend(ret)
         else:
             self.return_buffer.append(ret)
-    def read(self):
-        if self.has_data():
-            return self.return_buffer.pop(0)
+    def read(self, timeout=None):
+        if not self.has_data():
+            # all answers are produced within send(), waiting cannot help
+            raise TimeoutError(f"Emulated socket has nothing to read")
+        return self.return_buffer.popleft()
     def close(self):
         pass
     def has_data(self):
@@ -206,48 +403,522 @@ class emusocket:
     def __repr__(self):
         return f"emu:/?callback={self.callback}"
 
+class emudirect:
+    """
+    Connects to an in-process :class:`~lucipy.simulator.Emulation` without any
+    serialization: Envelopes are passed as dictionaries straight to
+    :meth:`~lucipy.simulator.Emulation.handle_envelope`. This is used instead of
+    :class:`jsonlines` for the endpoint ``emu:/?direct`` and speaks dictionaries at front
+    the same way.
+    
+    Since messages are passed by reference, neither the requests nor the answers should
+    be modified after sending or receiving, respectively.
+    
+    >>> hc = LUCIDAC("emu:/?direct")
+    >>> hc.get_entities() == LUCIDAC("emu:/").get_entities()
+    True
+    """
+    def __init__(self, emulation=None, instrumentation=None, debug=False):
+        if not emulation:
+            from .simulator import Emulation
+            emulation = Emulation(debug=debug)
+        self.emulation = emulation
+        self.instrumentation = instrumentation
+        self.return_buffer = collections.deque()
+    def send(self, envelope):
+        t0 = time.perf_counter()
+        replies = self.emulation.handle_envelope(envelope)
+        if self.instrumentation:
+            self.instrumentation.sent(envelope, 0, t0, t0, t0)
+        self.return_buffer.extend(replies)
+    def read(self, timeout=None):
+        if not self.return_buffer:
+            # all answers are produced within send(), waiting cannot help
+            raise TimeoutError(f"Emulated socket has nothing to read")
+        envelope = self.return_buffer.popleft()
+        if self.instrumentation:
+            t0 = time.perf_counter()
+            self.instrumentation.received(envelope, 0, t0, t0, t0)
+        return envelope
+    def read_all(self):
+        "Reads all messages which are already available"
+        while self.return_buffer:
+            yield self.read()
+    def close(self):
+        pass
+    def has_data(self):
+        return len(self.return_buffer)
+    def __repr__(self):
+        return "emu:/?direct"
+
+class recordsocket:
+    """
+    Wraps any other socket and records the exchanged lines with timestamps to a file,
+    for replaying them later with :class:`replaysocket`. Enable it with the endpoint URL
+    query argument ``?record=filename``, for instance ``tcp://192.168.1.2?record=trace.jsonl``.
+    
+    The trace is a JSONL file itself, where every line is an object such as
+    ``{"t": 0.0123, "send": "..."}`` or ``{"t": 0.0125, "recv": "..."}`` holding the
+    seconds since the connection was opened and the raw line.
+    """
+    def __init__(self, actual_socket, filename):
+        self.sock = actual_socket
+        self.filename = filename
+        self.fh = open(filename, "w")
+        self.start = time.monotonic()
+    def _record(self, direction, line):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        self.fh.write(json.dumps({"t": time.monotonic() - self.start, direction: line.rstrip("\n")}) + "\n")
+    def send(self, sth):
+        self._record("send", sth)
+        return self.sock.send(sth)
+    def read(self, timeout=None):
+        line = self.sock.read(timeout=timeout)
+        if line and line.strip():
+            self._record("recv", line)
+        return line
+    def has_data(self):
+        return self.sock.has_data()
+    def close(self):
+        self.fh.close()
+        return self.sock.close()
+    def __repr__(self):
+        return f"{self.sock!r}?record={self.filename}"
+
+class replaysocket:
+    """
+    Serves the responses from a trace recorded by :class:`recordsocket`, instead
+    of talking to a device. Use it with the endpoint ``replay:/path/to/trace.jsonl``.
+    This allows for benchmarking the client side (parsing, :class:`Run`) against the
+    traffic of a real device, but without the device, and much faster then the
+    :class:`~lucipy.simulator.Emulation`.
+    
+    The client must send the same sequence of messages as in the recording. After each
+    message sent, the lines recorded up to the next sent message become available for
+    reading. As the envelope ids are random, the ids of the recording are replaced
+    by the ones of the client in all responses. If the client sends another type of
+    message then recorded, a :class:`LocalError` is raised.
+    
+    :arg paced: If set (``replay:/trace.jsonl?paced``), responses are held back until
+       they are due according to the original timing, relative to the time the
+       request was sent. Otherwise responses are served as fast as possible.
+    """
+    uuid = re.compile(rb"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+    
+    def __init__(self, filename, paced=False):
+        self.filename, self.paced = filename, paced
+        # conversation is a list of (send_time, send_line, [ (recv_time, recv_parts), ... ])
+        self.conversation = [(0, None, [])]
+        with open(filename) as fh:
+            for line in fh:
+                record = json.loads(line)
+                if "send" in record:
+                    self.conversation.append((record["t"], record["send"].encode("utf-8"), []))
+                else:
+                    # split ids from the rest of the line, for exchanging them quickly
+                    line = record["recv"].encode("utf-8") + b"\n"
+                    self.conversation[-1][2].append((record["t"], self.uuid.split(line), self.uuid.findall(line)))
+        self.position = 0
+        self.ids = {}
+        self.available = collections.deque()
+        self._release(time.monotonic())
+    def _release(self, now):
+        send_time, _, responses = self.conversation[self.position]
+        for recv_time, parts, ids in responses:
+            self.available.append((now + recv_time - send_time if self.paced else 0, parts, ids))
+    def send(self, sth):
+        now = time.monotonic()
+        self.position += 1
+        if self.position >= len(self.conversation):
+            raise LocalError(f"Replay of {self.filename} is exhausted, cannot send {sth}")
+        recorded = self.conversation[self.position][1]
+        sent = sth.encode("utf-8")
+        if json.loads(recorded).get("type") != json.loads(sent).get("type"):
+            raise LocalError(f"Replay of {self.filename} diverged. Recorded {recorded} but sent {sth}")
+        self.ids.update(zip(self.uuid.findall(recorded), self.uuid.findall(sent)))
+        self._release(now)
+    def read(self, timeout=None):
+        "Returns the next response line as bytes"
+        if not self.available:
+            # nothing more will arrive without sending
+            raise TimeoutError(f"Replay of {self.filename} has nothing to read")
+        due, parts, ids = self.available[0]
+        if self.paced and due > time.monotonic():
+            if timeout is not None and due - time.monotonic() > timeout:
+                time.sleep(timeout)
+                raise TimeoutError(f"No answer from {self} within {timeout} seconds")
+            time.sleep(max(0, due - time.monotonic()))
+        self.available.popleft()
+        if not ids:
+            return parts[0]
+        line = [parts[0]]
+        for old_id, part in zip(ids, parts[1:]):
+            line.append(self.ids.get(old_id, old_id))
+            line.append(part)
+        return b"".join(line)
+    def has_data(self):
+        return len(self.available) > 0 and (not self.paced or self.available[0][0] <= time.monotonic())
+    def close(self):
+        pass
+    def __repr__(self):
+        return f"replay:{self.filename}" + ("?paced" if self.paced else "")
+
 class jsonlines:
-    "Middleware that speaks dictionaries at front and JSON at back"
-    def __init__(self, actual_socket, ignore_invalid_json_reads=False):
+    """
+    Middleware that speaks dictionaries at front and JSON (lines as str or bytes) at back.
+    If an :class:`Instrumentation` is given, it is informed about every message.
+    """
+    def __init__(self, actual_socket, ignore_invalid_json_reads=False, instrumentation=None):
         self.sock = actual_socket
         self.ignore_invalid_json_reads = ignore_invalid_json_reads
+        self.instrumentation = instrumentation
     @staticmethod
     def makeSocket(cls, actual_socket_type, *args, **kwargs):
         return cls(actual_socket_type(*args, **kwargs))
     def send(self, sth):
-        #print(f"jsonlines.send({json.dumps(sth)}")
-        self.sock.send(json.dumps(sth))
-        #print(f"jsonlines.send completed")
-    def read(self, *args, **kwargs):
-        #print("jsonlines.read()")
-        read = self.sock.read(*args, **kwargs)
-        #print("jsonlines.read() got ", read)
+        if not self.instrumentation:
+            return self.sock.send(json.dumps(sth))
+        t0 = time.perf_counter()
+        line = json.dumps(sth)
+        t1 = time.perf_counter()
+        self.sock.send(line)
+        t2 = time.perf_counter()
+        self.instrumentation.sent(sth, len(line)+1, t0, t1, t2)
+    def read(self, timeout=None):
+        """
+        Reads the next message. Blocks until one arrived (waiting on the socket, not
+        polling). Raises a ``TimeoutError`` if none arrived within ``timeout`` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        t0 = time.perf_counter()
+        read = self.sock.read(timeout=timeout)
         while not read or not read.strip():
-            print("haven't read anything, trying again")
-            time.sleep(0.2)
-            read = self.sock.read(*args, **kwargs)
-        #print(f"jsonlines.read() got {read}")
+            # empty lines are fine, just wait for the next one
+            read = self.sock.read(timeout=remaining(deadline))
         try:
-            return json.loads(read)
-        except json.JSONDecodeError as s:
+            if not self.instrumentation:
+                return json.loads(read)
+            t1 = time.perf_counter()
+            envelope = json.loads(read)
+            self.instrumentation.received(envelope, len(read), t0, t1, time.perf_counter())
+            return envelope
+        except (json.JSONDecodeError, UnicodeDecodeError) as s:
             if self.ignore_invalid_json_reads:
                 log.info(f"Received non-JSON message: '{read}'. Will read again")
-                return self.read(*args, **kwargs)
+                return self.read(timeout=remaining(deadline))
             else:
                 raise LocalError(f"Could not decode as JSON: {s}. Received message ({len(read)} characters) is '{read}'")
     def close(self):
         return self.sock.close()
     def read_all(self):
+        "Reads all messages which are already available, without blocking"
         while self.sock.has_data():
-            yield self.read()
+            read = self.sock.read()
+            if not read or not read.strip():
+                continue
+            try:
+                t0 = time.perf_counter()
+                envelope = json.loads(read)
+                if self.instrumentation:
+                    self.instrumentation.received(envelope, len(read), t0, t0, time.perf_counter())
+                yield envelope
+            except (json.JSONDecodeError, UnicodeDecodeError) as s:
+                if not self.ignore_invalid_json_reads:
+                    raise LocalError(f"Could not decode as JSON: {s}. Received message ({len(read)} characters) is '{read}'")
+                log.info(f"Received non-JSON message: '{read}'. Ignoring")
+
+class Instrumentation:
+    """
+    Collects counters and timings about the messages exchanged with a LUCIDAC. Every
+    :class:`LUCIDAC` has one as :attr:`LUCIDAC.instrumentation`, see :meth:`LUCIDAC.stats`
+    for the collected numbers and :meth:`LUCIDAC.trace` for a timeline export.
+    
+    The time spent for exchanging a message is splitted into the phases
+    *serialize* (``json.dumps``), *send* (writing to the socket), *wait* (reading
+    a line from the socket, including waiting for it) and *parse* (``json.loads``).
+    The latency of a query is the time from sending the request until its reply
+    (with the same envelope ``id``) was parsed.
+    
+    Hooks are callables which get called for every message:
+    
+    * ``on_send(envelope, num_bytes)`` after a message was sent
+    * ``on_recv(envelope, num_bytes)`` after a message was received
+    
+    Add them with ``hc.instrumentation.on_send.append(callback)``. They are called
+    from the thread which reads the message, which is the background thread of a
+    run started with ``background=True``.
+    
+    :arg latency_buckets: Upper bounds (in seconds) of the histogram bins for the
+       query latencies. An additional bin counts everything above.
+    """
+    def __init__(self, latency_buckets=(1e-4, 1e-3, 1e-2, 1e-1, 1, 10)):
+        self.latency_buckets = latency_buckets
+        self.on_send = []
+        self.on_recv = []
+        #: List of Chrome trace events, or None if not tracing
+        self.trace_events = None
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        "Sets all counters to zero"
+        with self.lock:
+            self.requests = self.responses = self.messages_in = 0
+            self.bytes_out = self.bytes_in = 0
+            self.time = dict(serialize=0., send=0., wait=0., parse=0.)
+            self.messages = collections.Counter() # incoming, by type
+            self.latencies = {} # by type
+            self.pending = {} # envelope id -> (type, send time)
+            self.run_data = dict(chunks=0, samples=0, first=None, last=None)
+    
+    def _event(self, name, cat, ph, ts, **kw):
+        self.trace_events.append(dict(name=name, cat=cat, ph=ph, ts=ts*1e6,
+            pid=os.getpid(), tid=threading.get_ident(), **kw))
+    
+    def sent(self, envelope, num_bytes, t0, t1, t2):
+        "Called by :class:`jsonlines` with the times before serialization, before and after sending"
+        msg_type, msg_id = envelope.get("type"), envelope.get("id")
+        with self.lock:
+            self.requests += 1
+            self.bytes_out += num_bytes
+            self.time["serialize"] += t1 - t0
+            self.time["send"] += t2 - t1
+            if msg_id is not None:
+                self.pending[msg_id] = (msg_type, t0)
+            if self.trace_events is not None:
+                self._event(f"send {msg_type}", "send", "X", t0, dur=(t2-t0)*1e6)
+                if msg_id is not None:
+                    self._event(msg_type, "query", "b", t0, id=str(msg_id))
+        for hook in self.on_send:
+            hook(envelope, num_bytes)
+    
+    def received(self, envelope, num_bytes, t0, t1, t2):
+        "Called by :class:`jsonlines` with the times before waiting, before and after parsing"
+        msg_type, msg_id = envelope.get("type"), envelope.get("id")
+        with self.lock:
+            self.messages_in += 1
+            self.bytes_in += num_bytes
+            self.time["wait"] += t1 - t0
+            self.time["parse"] += t2 - t1
+            self.messages[msg_type] += 1
+            if msg_id is not None and msg_id in self.pending:
+                sent_type, sent_at = self.pending.pop(msg_id)
+                self.responses += 1
+                self._record_latency(sent_type, t2 - sent_at)
+                if self.trace_events is not None:
+                    self._event(sent_type, "query", "e", t2, id=str(msg_id))
+            if msg_type == "run_data":
+                run_data = self.run_data
+                run_data["chunks"] += 1
+                run_data["samples"] += len(envelope.get("msg", {}).get("data", []))
+                run_data["first"] = run_data["first"] or t2
+                run_data["last"] = t2
+            if self.trace_events is not None:
+                self._event(f"recv {msg_type}", "recv", "X", t0, dur=(t2-t0)*1e6)
+        for hook in self.on_recv:
+            hook(envelope, num_bytes)
+    
+    def _record_latency(self, msg_type, latency):
+        if msg_type not in self.latencies:
+            self.latencies[msg_type] = dict(count=0, total=0., min=latency, max=latency,
+                histogram=[0]*(len(self.latency_buckets)+1))
+        stat = self.latencies[msg_type]
+        stat["count"] += 1
+        stat["total"] += latency
+        stat["min"] = min(stat["min"], latency)
+        stat["max"] = max(stat["max"], latency)
+        stat["histogram"][sum(latency > bound for bound in self.latency_buckets)] += 1
+    
+    def stats(self):
+        "Returns a snapshot of all counters as nested dictionary, see :meth:`LUCIDAC.stats`"
+        with self.lock:
+            run_data = self.run_data
+            duration = (run_data["last"] - run_data["first"]) if run_data["first"] else 0
+            bounds = list(self.latency_buckets) + [float("inf")]
+            return dict(
+                requests = self.requests,
+                responses = self.responses,
+                messages_in = self.messages_in,
+                bytes_out = self.bytes_out,
+                bytes_in = self.bytes_in,
+                time = dict(self.time),
+                messages = dict(self.messages),
+                latency = { msg_type: dict(
+                    count = stat["count"],
+                    mean = stat["total"] / stat["count"],
+                    min = stat["min"],
+                    max = stat["max"],
+                    histogram = dict(zip(bounds, stat["histogram"])),
+                ) for msg_type, stat in self.latencies.items() },
+                run_data = dict(
+                    chunks = run_data["chunks"],
+                    samples = run_data["samples"],
+                    chunks_per_sec = run_data["chunks"] / duration if duration else None,
+                    samples_per_sec = run_data["samples"] / duration if duration else None,
+                ),
+            )
+    
+    def start_trace(self):
+        "Starts recording a timeline of all messages, see :meth:`write_trace`"
+        with self.lock:
+            self.trace_events = []
+    
+    def write_trace(self, filename):
+        """
+        Stops recording and writes the timeline in the Chrome trace event format
+        (JSON), which can be opened with ``chrome://tracing`` or https://ui.perfetto.dev/
+        """
+        with self.lock:
+            events, self.trace_events = self.trace_events or [], None
+        with open(filename, "w") as fh:
+            json.dump(dict(traceEvents=events, displayTimeUnit="ms"), fh)
+
+class ResponseCache:
+    """
+    Cache for the answers of idempotent queries, as used by :class:`LUCIDAC`.
+    
+    Answers are keyed by the message type and content. Entries expire after ``ttl``
+    seconds. Each connection has its own cache, see :attr:`LUCIDAC.cache`.
+    
+    >>> cache = ResponseCache(ttl=10)
+    >>> cache.get("sys_ident", {}) is None
+    True
+    >>> cache.put("sys_ident", {}, {"serial": 123})
+    >>> cache.get("sys_ident", {})
+    {'serial': 123}
+    >>> cache.stats()
+    {'entries': 1, 'hits': 1, 'misses': 1, 'invalidations': 0}
+    
+    :arg ttl: Lifetime of entries in seconds. A ttl of ``0`` disables the cache,
+       ``None`` lets entries live until they are invalidated.
+    """
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.entries = {} # key -> (expiry time, answer)
+        self.hits = self.misses = self.invalidations = 0
+    
+    @staticmethod
+    def key(msg_type, msg):
+        return msg_type + json.dumps(msg, sort_keys=True)
+    
+    def get(self, msg_type, msg):
+        "Returns a copy of the cached answer, or None if there is no fresh one"
+        key = self.key(msg_type, msg)
+        if key in self.entries:
+            expires, answer = self.entries[key]
+            if expires is None or time.monotonic() < expires:
+                self.hits += 1
+                return dotdict(copy.deepcopy(answer)) if isinstance(answer, dict) else copy.deepcopy(answer)
+            del self.entries[key]
+        self.misses += 1
+        return None
+    
+    def put(self, msg_type, msg, answer):
+        "Stores a copy of an answer"
+        if self.ttl == 0:
+            return
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        # answers are dotdicts, which cannot be deep-copied themselves
+        answer = dict(answer) if isinstance(answer, dict) else answer
+        self.entries[self.key(msg_type, msg)] = (expires, copy.deepcopy(answer))
+    
+    def invalidate(self, msg_type=None):
+        "Drops all entries, or only the ones of the given message type"
+        if msg_type is None:
+            self.entries.clear()
+        else:
+            prefix = msg_type + "{"
+            self.entries = { k: v for k, v in self.entries.items() if not k.startswith(prefix) }
+        self.invalidations += 1
+    
+    def stats(self):
+        "Returns the number of entries, hits, misses and invalidations"
+        return dict(entries=len(self.entries), hits=self.hits, misses=self.misses, invalidations=self.invalidations)
+
+class ClockSync:
+    """
+    Relation between the device clock (``micros``, the microseconds since boot of the
+    microcontroller) and the monotonic host clock (:func:`time.monotonic`), as estimated
+    by :meth:`LUCIDAC.sync_clock` from a series of pings.
+    
+    The relation is modeled as linear, ``host = reference + (1 + drift) * (micros - micros_reference) / 1e6``.
+    The device clock is a 32 bit counter which wraps around after about 71 minutes.
+    This is taken into account for device times close to the reference.
+    
+    >>> clock = ClockSync([(10.0, 10.002, 1_000_000), (11.0, 11.002, 2_000_000)])
+    >>> round(clock.offset, 6), round(clock.drift, 6), round(clock.rtt, 6)
+    (9.001, 0.0, 0.002)
+    >>> round(clock.to_host(1_500_000), 6)
+    10.501
+    
+    :arg pings: List of ``(host time before, host time after, device micros)`` tuples
+    :arg best: Fraction of the pings with the shortest round trip time which are used
+       for the estimate. Pings which took long are likely to be delayed in one direction.
+    
+    :ivar offset: Host time at which the device clock was zero (ignoring the drift)
+    :ivar drift: Relative rate deviation of the device clock, i.e. ``1e-6`` is one ppm
+    :ivar rtt: Shortest round trip time in seconds, a bound to the error of the offset
+    """
+    wrap = 2**32
+    
+    def __init__(self, pings, best=0.5):
+        if not pings:
+            raise ValueError("Cannot synchronize clocks without pings")
+        pings = sorted(pings, key=lambda p: p[1] - p[0])
+        pings = pings[:max(2, int(len(pings) * best))]
+        self.rtt = pings[0][1] - pings[0][0]
+        self.micros_reference = pings[0][2]
+        
+        # least squares fit of the host time of the reply (midpoint) over the device time
+        xs = [ self._unwrap(micros) / 1e6 for before, after, micros in pings ]
+        ys = [ (before + after) / 2 for before, after, micros in pings ]
+        mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+        sxx = sum((x - mx)**2 for x in xs)
+        slope = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx if sxx else 1
+        self.drift = slope - 1
+        self.reference = my - slope * mx
+        self.offset = self.reference - self.micros_reference / 1e6
+    
+    def _unwrap(self, micros):
+        "Device time in microseconds relative to the reference, accounting for a single wraparound"
+        delta = (micros - self.micros_reference) % self.wrap
+        return delta - self.wrap if delta >= self.wrap // 2 else delta
+    
+    def to_host(self, micros):
+        "Converts a device time (in microseconds) to host time (in seconds)"
+        return self.reference + (1 + self.drift) * self._unwrap(micros) / 1e6
+    
+    def __repr__(self):
+        return f"ClockSync(offset={self.offset:.6f}, drift={self.drift*1e6:.1f}ppm, rtt={self.rtt*1e6:.0f}us)"
 
 def endpoint2socket(endpoint_url: typing.Union[Endpoint,str]) -> typing.Union[tcpsocket,serialsocket]:
-    "Provides the appropriate *synchronous* socket for a given endpoint"
+    """
+    Provides the appropriate *synchronous* socket for a given endpoint. If the
+    endpoint has the query argument ``record=filename``, the socket is wrapped by
+    a :class:`recordsocket`.
+    """
     endpoint = Endpoint(endpoint_url)
-    if endpoint.scheme == "serial": # serial:/dev/ttyFooBar
-        return serialsocket(endpoint.host)
-    elif endpoint.scheme == "tcp": # tcp://192.168.1.2:5732
-        return tcpsocket(endpoint.host, endpoint.port, auto_reconnect="auto_reconnect" in endpoint.args)
+    if "record" in endpoint.args:
+        args = dict(endpoint.args)
+        filename = args.pop("record")
+        endpoint.args = args
+        return recordsocket(endpoint2socket(endpoint), filename)
+    optional_int = lambda key: int(endpoint.args[key]) if key in endpoint.args else None
+    if endpoint.scheme == "replay": # replay:/path/to/trace.jsonl or replay:/path/to/trace.jsonl?paced
+        return replaysocket(endpoint.host, paced="paced" in endpoint.args)
+    if endpoint.scheme == "serial": # serial:/dev/ttyFooBar or serial:/dev/ttyACM0?timeout=2&bufsize=1048576
+        return serialsocket(endpoint.host, bufsize = optional_int("bufsize") or 65536,
+            write_timeout = float(endpoint.args["timeout"]) if "timeout" in endpoint.args else None,
+            baudrate = optional_int("baudrate") or 115200)
+    elif endpoint.scheme == "tcp": # tcp://192.168.1.2:5732 or tcp://192.168.1.2?nodelay=0&rcvbuf=1048576
+        return tcpsocket(endpoint.host, endpoint.port, auto_reconnect="auto_reconnect" in endpoint.args,
+            nodelay = endpoint.args.get("nodelay", "1") not in ["0", "false", "no"],
+            rcvbuf = optional_int("rcvbuf"), sndbuf = optional_int("sndbuf"),
+            bufsize = optional_int("bufsize") or 65536)
+    elif endpoint.scheme == "unix": # unix:/tmp/lucidac.sock, for instance the lucipy.proxy
+        return unixsocket(endpoint.host, auto_reconnect="auto_reconnect" in endpoint.args,
+            bufsize = optional_int("bufsize") or 65536)
     elif endpoint.scheme in ["emu","sim"]: # emu:/ or emu:/?debug
         return emusocket(debug="debug" in endpoint.args)
     elif endpoint.scheme == "zeroconf":
@@ -267,18 +938,195 @@ class Run:
     An instance of this class is returned by :meth:`LUCIDAC.start_run`. This instance is properly "handled off" by
     calling :meth:`data` and then wiping it.
     
+    By default, the socket is only read when the user pulls data, for instance by
+    iterating over :meth:`next_data`. If the processing of the data is slow, this stalls
+    the connection and can make the device side buffer overflow. With ``background=True``,
+    a reader thread drains the socket into a bounded queue instead and :meth:`next_data`
+    consumes from that queue. If the queue is full, further data are dropped and counted.
+    See :meth:`queue_stats` for inspecting the queue. If the connection is used for
+    another query or run before the data were read completely, the run is closed
+    first, see :meth:`close`.
+    
+    Each received message is stamped with the host time (:func:`time.monotonic`) at
+    which it was read from the socket. See :meth:`timing` for a breakdown of where
+    the time of a run went.
+    
+    :arg background: Start a background reader thread
+    :arg queue_size: Maximum number of ``run_data`` envelopes held in the queue
+    :arg requested: Host time at which the run was requested
     """
     run_states = "DONE ERROR IC NEW OP OP_END QUEUED TAKE_OFF TMP_HALT".split()
     
-    def __init__(self, hc):
+    def __init__(self, hc, background=False, queue_size=10_000, requested=None):
         self.hc = hc
+        
+        #: Host time at which the run was requested and at which the device acknowledged it
+        self.requested = requested
+        self.started = time.monotonic()
+        #: Host receive time and number of samples for each ``run_data`` chunk
+        self.chunks = []
+        #: Tuples ``(new state, device time in microseconds, host receive time)`` for
+        #: each ``run_state_change`` message
+        self.state_changes = []
+        # host receive time of the last envelope returned by _read
+        self.received = None
 
         # in newer versions of the firmware, when `sample_op_end` is set in the
         # run_config, the state of all M-elements is sent - when reading messages,
         # we store this data separately from the data during the run
         self.op_end_data = None
+        
+        #: Queue filled by the background reader, None if not reading in background
+        self.queue = None
+        #: Maximum number of envelopes which were waiting in the queue at the same time
+        self.high_water_mark = 0
+        #: Number of run_data envelopes dropped because the queue was full
+        self.dropped = 0
+        
+        #: Background reader thread, None if not reading in background
+        self.reader = None
+        # Whether the reader passes on messages. Guarded by reader_lock, as is stopping,
+        # which makes the reader wait for the confirmation of stop().
+        self.reader_lock = threading.Lock()
+        self.reading = False
+        self.stopping = False
+        
+        if background:
+            self.queue = queue.Queue(maxsize=queue_size)
+            self.reading = True
+            self.reader = threading.Thread(target=self._read_in_background, daemon=True)
+            hc._background_run = self
+            self.reader.start()
+    
+    def _is_last_message(self, envelope):
+        "Whether the envelope ends the stream of messages belonging to this run"
+        if envelope.get("type") == "stop_run":
+            return True
+        if self.stopping:
+            return False # the confirmation of stop() is still to come
+        if envelope.get("type") == "run_state_change":
+            new = envelope["msg"]["new"]
+            return new == "ERROR" or (new == "DONE" and not self.hc.run_config.repetitive)
+        return False
+    
+    def _read_in_background(self):
+        try:
+            while True:
+                envelope = self.hc.sock.read()
+                received = time.monotonic()
+                if envelope.get("type") == "run_data":
+                    try:
+                        self.queue.put_nowait((received, envelope))
+                    except queue.Full:
+                        self.dropped += 1
+                        continue
+                else:
+                    # control messages must never be dropped
+                    self.queue.put((received, envelope))
+                self.high_water_mark = max(self.high_water_mark, self.queue.qsize())
+                with self.reader_lock:
+                    if self._is_last_message(envelope):
+                        self.reading = False
+                        return
+        except Exception as e:
+            self.queue.put((time.monotonic(), e)) # raised in the consuming thread
+    
+    def _read(self):
+        "Reads the next envelope, either from the socket or from the background queue"
+        if self.queue is None:
+            envelope = self.hc.sock.read()
+            self.received = time.monotonic()
+            return envelope
+        self.received, envelope = self.queue.get()
+        if isinstance(envelope, Exception):
+            raise envelope
+        return envelope
+    
+    def close(self):
+        """
+        Stops the background reader, if any: Reads the remaining messages of the run
+        (stopping it first if it is repetitive or unlimited), discards them and joins the
+        reader thread. Otherwise the thread would read replies meant for later queries.
+        This is called automatically when the connection is used for another query or run.
+        """
+        if self.hc._background_run is self:
+            self.hc._background_run = None
+        if self.reader is None or not self.reader.is_alive():
+            return
+        try:
+            if self.hc.run_config.repetitive or self.hc.run_config.unlimited_op_time:
+                self.stop()
+            else:
+                for _ in self.next_data():
+                    pass
+        except Exception as e:
+            log.warning(f"Error while closing the run: {e!r}")
+        self.reader.join()
+    
+    def queue_stats(self):
+        """
+        Returns statistics about the background reader queue, as a dictionary with
+        the current ``depth`` of the queue, the ``high_water_mark`` (maximum depth) and
+        the number of ``dropped`` envelopes. Returns ``None`` if the run does not read
+        in background.
+        """
+        if self.queue is None:
+            return None
+        return dict(depth=self.queue.qsize(), high_water_mark=self.high_water_mark,
+            dropped=self.dropped, maxsize=self.queue.maxsize)
+    
+    def timing(self):
+        """
+        Returns a latency breakdown of the run, as far as it was read, as a dictionary.
+        All times are in seconds, relative to the request of the run:
+        
+        * ``acknowledged``: The device answered the ``start_run`` query
+        * ``first_sample``, ``last_sample``: The first and last data chunk was received
+        * ``done``: The final ``run_state_change`` was received
+        * ``states``: For each state change the ``state``, the host time it was ``received``
+          and, if the clock of the device was synchronized with :meth:`LUCIDAC.sync_clock`,
+          the host time at which it ``happened`` on the device and the ``latency`` until
+          it was received.
+        * ``ic_start``: When the IC phase began, if known from the state changes
+        * ``chunks``, ``samples``: Number of received data chunks and samples
+        
+        >>> from lucipy import Circuit
+        >>> c = Circuit()
+        >>> _ = c.measure(c.int(ic=0.5))
+        >>> hc = LUCIDAC("emu:/")
+        >>> hc.set_circuit(c)
+        >>> run = hc.start_run(num_channels=1, op_time=100_000)
+        >>> data = run.data()
+        >>> timing = run.timing()
+        >>> 0 <= timing["acknowledged"] <= timing["first_sample"] <= timing["last_sample"] <= timing["done"]
+        True
+        >>> timing["samples"] == len(data)
+        True
+        """
+        origin = self.started if self.requested is None else self.requested
+        rel = lambda t: None if t is None else t - origin
+        clock = self.hc.clock
+        states = []
+        for state, device_t, received in self.state_changes:
+            entry = dict(state=state, received=rel(received))
+            if clock is not None and device_t is not None:
+                entry["happened"] = rel(clock.to_host(device_t))
+                entry["latency"] = received - clock.to_host(device_t)
+            states.append(entry)
+        ic_start = [ entry["happened"] for entry in states if entry["state"] == "IC" and "happened" in entry ]
+        done = [ entry["received"] for entry in states if entry["state"] in ("DONE", "ERROR") ]
+        return dict(
+            acknowledged = rel(self.started),
+            first_sample = rel(self.chunks[0][0]) if self.chunks else None,
+            last_sample = rel(self.chunks[-1][0]) if self.chunks else None,
+            done = done[-1] if done else None,
+            ic_start = ic_start[0] if ic_start else None,
+            states = states,
+            chunks = len(self.chunks),
+            samples = sum(n for t, n in self.chunks),
+        )
     
-    def next_data(self, mark_op_end_by_none: bool = False) -> typing.Optional[typing.Iterator[typing.List[float]]]:
+    def next_data(self, mark_op_end_by_none: bool = False, timestamps: bool = False) -> typing.Optional[typing.Iterator[typing.List[float]]]:
         """
         Reads next dataset from DAQ (data aquisiton) which is streamed during the run.
         A call to this function yields a single dataset once arrived. It returns
@@ -297,9 +1145,10 @@ class Run:
 
         :arg mark_op_end_by_none: For repetitive runs, if set, return a "None" entry
             everytime an IC/OP cycle ended.
+        :arg timestamps: If set, yield tuples ``(host receive time, dataset)`` instead.
         """
         while True:
-            envelope = self.hc.sock.read()
+            envelope = self._read()
             if envelope["type"] == "run_data":
                 # TODO check for proper run id and entity.
 
@@ -311,10 +1160,12 @@ class Run:
 
                 msg_data = envelope["msg"]["data"]
                 assert all(self.hc.daq_config["num_channels"] == len(line) for line in msg_data)
-                yield msg_data
+                self.chunks.append((self.received, len(msg_data)))
+                yield (self.received, msg_data) if timestamps else msg_data
             elif envelope["type"] == "run_state_change":
                 msg_old = envelope["msg"]["new"]
                 msg_new = envelope["msg"]["new"]
+                self.state_changes.append((msg_new, envelope["msg"].get("t"), self.received))
                 if msg_new == "DONE":
                     if self.hc.run_config.repetitive:
                         if mark_op_end_by_none:
@@ -348,7 +1199,8 @@ class Run:
         >>> x, y, z = data[:,0], data[:,1], data[:,2]        # doctest: +SKIP
         >>> plt.plot(x)                                      # doctest: +SKIP
     
-        See also :meth:`next_data` and example application codes.
+        See also :meth:`next_data` and example application codes. If you are going
+        to convert the data to a numpy array anyway, :meth:`data_array` is faster.
         
         :arg empty_is_fine: Whether to raise when no data have been aquired or
            happily return an empty array. Raising a ``LocalError`` (i.e. the default
@@ -357,11 +1209,65 @@ class Run:
            something on  ``np.array(run.data())`` will most likely result in an
            ``IndexError: index 0 is out of bounds for axis 0 with size 0`` or similar.
         """
-        res = sum(self.next_data(), []) # joins lists at outer level
+        res = []
+        for chunk in self.next_data():
+            res.extend(chunk) # joins lists at outer level, in linear time
+        self._warn_dropped()
         if len(res) == 0 and not empty_is_fine:
             raise LocalError("Expected data stream but got not a single data point")
         return res
     
+    def _warn_dropped(self):
+        if self.dropped:
+            warnings.warn(f"Background reader dropped {self.dropped} run_data envelopes because the queue was full. Increase queue_size.")
+    
+    def expected_samples(self) -> int:
+        """
+        Estimates the number of samples per channel the run will produce, derived
+        from the ``sample_rate`` in the DAQ configuration and the ``op_time`` in the
+        run configuration. The device might send a sample more or less, depending
+        on ``sample_op`` and ``sample_op_end``. Returns ``0`` if no estimate is
+        possible, for instance for unlimited or repetitive runs.
+        """
+        if self.hc.run_config.unlimited_op_time or self.hc.run_config.repetitive:
+            return 0
+        op_time_sec = self.hc.run_config.op_time / 1e9
+        return int(op_time_sec * self.hc.daq_config.sample_rate)
+    
+    def data_array(self, empty_is_fine=False):
+        """
+        Returns all measurement data as a numpy array of shape
+        ``(NUM_SAMPLING_POINTS, NUM_CHANNELS)``.
+        
+        This is the numpy counterpart of :meth:`data`. Instead of joining python
+        lists, each chunk streamed by :meth:`next_data` is copied straight into a
+        float array which is preallocated according to :meth:`expected_samples`.
+        If the device sends more data than expected, the array grows geometrically.
+        This keeps both run time and peak memory linear in the number of samples,
+        which matters for long runs with high sample rates.
+        
+        >>> data = run.data_array()                          # doctest: +SKIP
+        >>> x, y, z = data[:,0], data[:,1], data[:,2]        # doctest: +SKIP
+        
+        :arg empty_is_fine: See :meth:`data`.
+        """
+        import numpy as np
+        num_channels = self.hc.daq_config.num_channels
+        res = np.empty((max(self.expected_samples(), 1), num_channels))
+        filled = 0
+        for chunk in self.next_data():
+            chunk = np.asarray(chunk, dtype=res.dtype).reshape(-1, num_channels)
+            if filled + len(chunk) > len(res):
+                grown = np.empty((max(2*len(res), filled + len(chunk)), num_channels))
+                grown[:filled] = res[:filled]
+                res = grown
+            res[filled:filled+len(chunk)] = chunk
+            filled += len(chunk)
+        self._warn_dropped()
+        if filled == 0 and not empty_is_fine:
+            raise LocalError("Expected data stream but got not a single data point")
+        return res[:filled]
+    
     def op_end_state(self) -> typing.Optional[typing.List[typing.List[float]]]:
         """
         When `sample_op_end` in the run config is `True`, the device will 
@@ -378,6 +1284,14 @@ class Run:
         :return True if the computation was stopped, False if there was an error.
         """
 
+        # the background reader passes on the confirmation, if it did not finish yet.
+        # It must not be closed by the query.
+        if self.hc._background_run is self:
+            self.hc._background_run = None
+        with self.reader_lock:
+            self.stopping = True
+            read = self._read if self.reading or self.queue is None else self.hc.sock.read
+        
         # while the run is active, other messages could be sent in between this
         # query and the `stop_run` answer, hence don't assume that the next message
         # is the confirmation
@@ -388,9 +1302,11 @@ class Run:
 
         # reads remaining messages until a `stop_run` confirmation is sent
         while True:
-            envelope = self.hc.sock.read()
+            envelope = read()
 
             if envelope['type'] == "stop_run":
+                if self.reader is not None:
+                    self.reader.join()
                 return (envelope["code"] == 0)
             else:
                 # ignore other enevlopes for now
@@ -414,6 +1330,15 @@ class LUCIDAC:
         For details, see :ref:`lucipy-detection`.
     :param auto_reconnect: Whether reconnect in case of loss connection (TODO: Move
         to parameter ``?reconnect`` in the endpoint URL syntax)
+    :param emulation: An existing :class:`~lucipy.simulator.Emulation` to talk to
+        in-process instead of a new one, for instance to inspect or customize it. The
+        endpoint defaults to ``emu:/?direct`` then, ``emu:/`` is possible as well:
+        
+        >>> from lucipy import Emulation
+        >>> emu = Emulation()
+        >>> hc = LUCIDAC(emulation=emu)
+        >>> hc.get_mac() == emu.mac
+        True
     """
    
     ENDPOINT_ENV_NAME = "LUCIDAC_ENDPOINT"
@@ -434,13 +1359,16 @@ class LUCIDAC:
         sys_ident sys_reboot
     """.split()
     
-    # Commands which can be memoized for a given endpoint/instance, makes
-    # it cheaper to call them repeatedly
-    memoizable = "sys_ident".split()
-    ## TODO: Get rid of this memoization because with arguments it can lead to weird errors, for instance
-    #    hc.sys_ident(dict(blink=True))  -> TypeError: unhashable type: 'dict'
+    # Idempotent commands whose answers are kept in the per-instance :attr:`cache`,
+    # makes it cheaper to call them repeatedly
+    cacheable = "sys_ident get_entities help get_circuit".split()
+    
+    # Commands which change the device state and therefore invalidate the :attr:`cache`
+    mutating = "set_circuit reset_circuit sys_reboot net_set net_reset ota_update_complete".split()
     
-    def __init__(self, endpoint_url=None, auto_reconnect=True):
+    def __init__(self, endpoint_url=None, auto_reconnect=True, emulation=None):
+        if emulation is not None and not endpoint_url:
+            endpoint_url = "emu:/?direct"
         if not endpoint_url:
             if self.ENDPOINT_ENV_NAME in os.environ:
                 endpoint_url = os.environ[self.ENDPOINT_ENV_NAME]
@@ -455,8 +1383,20 @@ class LUCIDAC:
                     # one wants to modify the env variable name.
 
         endpoint = Endpoint(endpoint_url)
-        socket = endpoint2socket(endpoint_url)
-        self.sock = jsonlines(socket, ignore_invalid_json_reads = endpoint.scheme == "serial")
+        if emulation is not None and endpoint.scheme not in ["emu","sim"]:
+            raise ValueError(f"An emulation can only be used with emu:/ endpoints, not with {endpoint_url=}")
+        #: Counters and timings of the communication, see :meth:`stats`
+        self.instrumentation = Instrumentation()
+        if endpoint.scheme in ["emu","sim"] and "direct" in endpoint.args:
+            # in-process emulator, without serializing to JSON at all
+            self.sock = emudirect(emulation, instrumentation = self.instrumentation, debug = "debug" in endpoint.args)
+        else:
+            if emulation is not None:
+                socket = emusocket(callback = emulation.handle_request)
+            else:
+                socket = endpoint2socket(endpoint_url)
+            self.sock = jsonlines(socket, ignore_invalid_json_reads = endpoint.scheme == "serial",
+                instrumentation = self.instrumentation)
         self.req_id = 50
         
         #: Ethernet Mac address of Microcontroller, required for the circuit entity hierarchy
@@ -496,6 +1436,45 @@ class LUCIDAC:
             calibrate_routes=True,
         )
         
+        #: Out-of-band messages (such as ``log`` or ``run_state_change``) which arrived
+        #: while waiting for query responses. Only the most recent ones are kept.
+        self.out_of_band = collections.deque(maxlen=100)
+        
+        # State of an active :meth:`pipeline`, None if not pipelining.
+        self._pipeline = None
+        
+        # State of an active :meth:`batch`, None if not batching.
+        self._batch = None
+        
+        # Run with an active background reader, see Run.close
+        self._background_run = None
+        
+        #: If enabled, :meth:`set_circuit` only sends the entities which changed since
+        #: the last configuration it sent. Can also be enabled with the endpoint URL
+        #: query argument ``?delta``.
+        self.delta_uploads = "delta" in endpoint.args
+        #: Last configuration acknowledged by the device, as sent by :meth:`set_circuit`.
+        #: None if unknown, for instance after other queries changed the circuit.
+        self.last_circuit = None
+        
+        #: Timeout for queries in seconds, None means waiting forever. Can be set with the
+        #: endpoint URL query argument, as in ``tcp://192.168.1.2?timeout=2.5``
+        self.default_timeout = float(endpoint.args["timeout"]) if "timeout" in endpoint.args else None
+        # Envelope ids of queries which timed out, their late answers are ignored
+        self.timed_out_ids = set()
+        
+        #: Answers of idempotent queries (see :attr:`cacheable`), which are invalidated by
+        #: mutating queries. The lifetime in seconds can be set with the endpoint URL
+        #: query argument ``?cache_ttl``, ``?cache_ttl=0`` disables caching. It is
+        #: disabled by default for ``unix:`` endpoints, which are usually shared with other
+        #: clients by the :mod:`~lucipy.proxy` (which caches itself). This instance would not
+        #: notice their changes, for instance a ``set_circuit``.
+        default_ttl = 0 if endpoint.scheme == "unix" else 60
+        self.cache = ResponseCache(ttl=float(endpoint.args["cache_ttl"]) if "cache_ttl" in endpoint.args else default_ttl)
+        
+        #: Relation of the device clock to the host clock, see :meth:`sync_clock`
+        self.clock = None
+        
         self.user = endpoint.user
         self.password = endpoint.password
         
@@ -503,7 +1482,7 @@ class LUCIDAC:
             self.login()
     
     def __repr__(self):
-        return f"LUCIDAC(\"{self.sock.sock}\")"
+        return f"LUCIDAC(\"{getattr(self.sock, 'sock', self.sock)}\")"
     
     def close(self):
         """
@@ -523,17 +1502,45 @@ class LUCIDAC:
         self.sock.send(envelope)
         return envelope
     
-    def _recv(self, sent_envelope, ignore_run_state_change=True):
-        resp = dotdict(self.sock.read())
+    def _route_out_of_band(self, resp, ignore_run_state_change=True):
+        "Logs and stores messages which are no response to a query. Returns whether resp was one."
         if ignore_run_state_change and "type" in resp and resp.type == "run_state_change":
             log.info(f"run_state_change: {resp.msg}")
-            return self._recv(sent_envelope, ignore_run_state_change=True)
-        if "type" in resp and resp.type == "log":
+        elif "type" in resp and resp.type == "log":
             log.info(f"Device Log {resp}")#[{resp.time}] {resp.msg}")
-            return self._recv(sent_envelope, ignore_run_state_change=True)
-        if sent_envelope == resp:
-            # This is a serial socket replying first what was typed. Read another time.
-            return self._recv(sent_envelope, ignore_run_state_change=ignore_run_state_change)
+        else:
+            return False
+        self.out_of_band.append(resp)
+        return True
+    
+    def _read(self, deadline):
+        "Reads the next message, discarding late answers to queries which timed out"
+        while True:
+            try:
+                resp = dotdict(self.sock.read(timeout=remaining(deadline)))
+            except TimeoutError as e:
+                raise TimeoutError(f"{self}: {e}") from None
+            if "id" in resp and resp.id in self.timed_out_ids:
+                log.info(f"Discarding late answer to timed out query: {resp=}")
+                self.timed_out_ids.discard(resp.id)
+                continue
+            return resp
+    
+    def _recv(self, sent_envelope, ignore_run_state_change=True, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                resp = self._read(deadline)
+            except TimeoutError:
+                self.timed_out_ids.add(sent_envelope.id)
+                raise
+            if self._route_out_of_band(resp, ignore_run_state_change):
+                ignore_run_state_change = True
+                continue
+            if sent_envelope == resp:
+                # This is a serial socket replying first what was typed. Read another time.
+                continue
+            break
         if "error" in resp:
             raise RemoteError(resp)
         if resp.type == sent_envelope.type:
@@ -543,12 +1550,187 @@ class LUCIDAC:
             log.error(f"req(type={sent_envelope.type}) received unexpected: {resp=}")
             return resp
 
-    def query(self, msg_type , msg={}, ignore_run_state_change=True, ignore_response=False):
-        "Sends a query and waits for the answer, returns that answer"
+    def query(self, msg_type , msg={}, ignore_run_state_change=True, ignore_response=False, timeout=None):
+        """
+        Sends a query and waits for the answer, returns that answer.
+        
+        Within a :meth:`pipeline`, does not wait but returns ``None`` immediately.
+        
+        :arg timeout: Maximum time to wait for the answer, in seconds. If exceeded, a
+           ``TimeoutError`` is raised. If the answer arrives later, it is discarded
+           silently. If not given, :attr:`default_timeout` is used.
+        """
+        if self._background_run is not None:
+            self._background_run.close()
+        if msg_type in ["set_circuit", "reset_circuit"]:
+            # the remote configuration is not known any more, see set_circuit
+            self.last_circuit = None
+        if msg_type in self.mutating:
+            self.cache.invalidate()
+        
+        cacheable = msg_type in self.cacheable and self._pipeline is None and not ignore_response
+        if cacheable:
+            answer = self.cache.get(msg_type, msg)
+            if answer is not None:
+                return answer
+        
         envelope = dotdict(self.send(msg_type, msg))
+        
+        if self._pipeline is not None and not ignore_response:
+            self._pipeline.pending[envelope.id] = envelope
+            self._pipeline.order.append(envelope.id)
+            while len(self._pipeline.pending) >= self._pipeline.window:
+                self._recv_pipelined()
+            return
 
         if not ignore_response:
-            return self._recv(envelope)
+            answer = self._recv(envelope, timeout=self.default_timeout if timeout is None else timeout)
+            if cacheable and answer is not None:
+                self.cache.put(msg_type, msg, answer)
+            return answer
+    
+    def _recv_pipelined(self):
+        "Reads a single message and assigns it to the pending pipelined query by envelope id"
+        pipe = self._pipeline
+        try:
+            resp = self._read(None if pipe.timeout is None else time.monotonic() + pipe.timeout)
+        except TimeoutError:
+            self.timed_out_ids.update(pipe.pending.keys())
+            raise
+        if self._route_out_of_band(resp):
+            return
+        if "id" not in resp or resp.id not in pipe.pending:
+            log.error(f"pipeline received unexpected: {resp=}")
+            self.out_of_band.append(resp)
+            return
+        if pipe.pending[resp.id] == resp:
+            # This is a serial socket replying first what was typed. Read another time.
+            return
+        pipe.pending.pop(resp.id)
+        if "error" in resp:
+            pipe.results[resp.id] = RemoteError(resp)
+        else:
+            pipe.results[resp.id] = resp.msg if resp.msg != {} else None
+    
+    @contextlib.contextmanager
+    def pipeline(self, window=32, timeout=None):
+        """
+        Context manager for sending many queries without waiting for each reply.
+        
+        Within the context, :meth:`query` (and thus all shorthands such as
+        :meth:`set_by_path` or :meth:`set_leds`) only sends the request and returns
+        ``None``. Up to ``window`` requests are in flight at the same time, replies
+        are matched to their requests by the envelope id. When leaving the context,
+        all outstanding replies are collected and the yielded list is filled with the
+        responses, in order of the requests:
+        
+        >>> hc = LUCIDAC("emu:/")
+        >>> with hc.pipeline() as results:
+        ...     hc.set_leds(0x55)
+        ...     hc.get_circuit()
+        >>> results[1]["config"]["/FP"]
+        {'leds': 85}
+        
+        Out-of-band messages (``log``, ``run_state_change``) which arrive meanwhile
+        are logged and stored in :attr:`out_of_band`. If any request failed, the first
+        :class:`RemoteError` is raised after all replies have been collected, so the
+        connection remains in a consistent state.
+        
+        Note that queries which need a reply for their own work, such as :meth:`get_mac`,
+        do not work within the pipeline. The mac address is therefore queried before.
+        
+        :arg window: Maximum number of requests in flight. This avoids a deadlock
+           when both the send and receive buffers are full.
+        :arg timeout: Maximum time to wait for the next reply, in seconds. If exceeded,
+           a ``TimeoutError`` is raised. If not given, :attr:`default_timeout` is used.
+        """
+        if self._pipeline is not None:
+            raise LocalError("Pipelines cannot be nested")
+        self.get_mac()
+        results = []
+        self._pipeline = types.SimpleNamespace(pending=collections.OrderedDict(), order=[], results={},
+            window=window, timeout=self.default_timeout if timeout is None else timeout)
+        try:
+            yield results
+        finally:
+            try:
+                while self._pipeline.pending:
+                    self._recv_pipelined()
+            except:
+                self.last_circuit = None
+                raise
+            finally:
+                pipe, self._pipeline = self._pipeline, None
+        results.extend(pipe.results.get(i) for i in pipe.order)
+        for res in results:
+            if isinstance(res, RemoteError):
+                # a set_circuit within the pipeline may have failed
+                self.last_circuit = None
+                raise res
+    
+    def query_many(self, queries, window=32, timeout=None):
+        """
+        Sends many queries back-to-back and returns the list of answers, in the
+        same order as the queries. Queries are given as a list of message types
+        or ``(msg_type, msg)`` tuples. See :meth:`pipeline` for details.
+        
+        >>> hc = LUCIDAC("emu:/")
+        >>> hc.query_many([ "reset_circuit", ("get_circuit", {}) ])[0] is None
+        True
+        """
+        with self.pipeline(window=window, timeout=timeout) as results:
+            for query in queries:
+                msg_type, msg = (query, {}) if isinstance(query, str) else query
+                self.query(msg_type, msg)
+        return results
+    
+    def stats(self):
+        """
+        Returns counters and timings about the communication so far, as a dictionary
+        with the keys
+        
+        * ``requests``, ``responses``, ``messages_in``: Number of messages sent, replies
+          matched to requests and messages received in total
+        * ``bytes_out``, ``bytes_in``: Transferred bytes
+        * ``time``: Seconds spent in the phases ``serialize``, ``send``, ``wait`` and ``parse``
+        * ``messages``: Number of received messages by type
+        * ``latency``: For each query type ``count``, ``mean``, ``min`` and ``max`` in seconds
+          and a ``histogram`` mapping the upper bounds of the bins to counts
+        * ``run_data``: Number of received ``chunks`` and ``samples`` and their rates
+        * ``cache``: Number of ``entries``, ``hits``, ``misses`` and ``invalidations``
+          of the :attr:`cache`
+        
+        See :class:`Instrumentation` for hooking into the communication.
+        
+        >>> hc = LUCIDAC("emu:/")
+        >>> hc.instrumentation.reset()
+        >>> for i in range(3): _ = hc.get_circuit()
+        >>> stats = hc.stats()
+        >>> stats["requests"], stats["latency"]["get_circuit"]["count"], stats["cache"]["hits"]
+        (1, 1, 2)
+        """
+        return dict(self.instrumentation.stats(), cache=self.cache.stats())
+    
+    @contextlib.contextmanager
+    def trace(self, filename):
+        """
+        Records a timeline of all messages within the ``with`` block and writes it
+        to ``filename`` in the Chrome trace event format. Open it with ``chrome://tracing``
+        or https://ui.perfetto.dev/ to see where the time goes, for instance in a
+        parameter sweep:
+        
+        ::
+        
+            with hc.trace("sweep.json"):
+                for k in ks:
+                    hc.set_circuit(...)
+                    hc.start_run().data()
+        """
+        self.instrumentation.start_trace()
+        try:
+            yield self.instrumentation
+        finally:
+            self.instrumentation.write_trace(filename)
     
     def slurp(self):
         """
@@ -633,6 +1815,14 @@ class LUCIDAC:
            the configuration on the LUCIDAC.
         :param calibrate_...: Perform the device calibration scheme. Currently disabled.
         
+        If :attr:`delta_uploads` is enabled and the configuration sent before is still
+        valid, only the entities which changed (such as ``/0/C`` when sweeping a
+        coefficient) are sent, with ``reset_before=False``. This does not apply if any
+        of the further parameters is given, or if the new configuration removes settings
+        or entities or changes the top level keys (such as ``adc_channels``). Then the
+        whole configuration is sent as usual. After an upload with further parameters
+        (such as ``reset_before=False``), the next upload is a whole one as well.
+        
         .. note::
         
            This also determines the ideal IC time *if* that has not been set
@@ -663,8 +1853,35 @@ class LUCIDAC:
             from .simulator import remove_trailing
             num_channels = len(remove_trailing(carrier_config["adc_channels"], None))
             self.set_daq(num_channels=num_channels)
-                    
-        return self.query("set_circuit", outer_config)
+        
+        if not self.delta_uploads:
+            return self.query("set_circuit", outer_config)
+        
+        # normalize, as the configuration is compared to the next one
+        carrier_config = json.loads(json.dumps(carrier_config))
+        last_circuit = self.last_circuit
+        changes = circuit_delta(last_circuit, carrier_config) if last_circuit is not None else None
+        def last_at(path):
+            return functools.reduce(lambda config, entity: config["/" + entity], path, last_circuit)
+        # incremental updates cannot remove anything, this requires a reset
+        incremental = changes is not None and not further_commands and \
+            all(path and not removes_keys(last_at(path), config) for path, config in changes)
+        if not incremental:
+            ret = self.query("set_circuit", outer_config)
+        else:
+            deltas = [ ("set_circuit", { "entity": [self.get_mac()] + path, "config": config, "reset_before": False })
+                for path, config in changes ]
+            if len(deltas) > 1 and self._pipeline is None:
+                ret = self.query_many(deltas)[-1]
+            else:
+                ret = None
+                for msg_type, msg in deltas:
+                    ret = self.query(msg_type, msg)
+        # within a pipeline, this is undone by pipeline() if any query fails.
+        # With further parameters, the device state is not known, for instance without
+        # a reset the new configuration was merged into the old one.
+        self.last_circuit = None if further_commands else carrier_config
+        return ret
         
     
     def set_config(self, circuit):
@@ -768,6 +1985,14 @@ class LUCIDAC:
         """
         path, config = self.resolve_path(path, config)
         
+        if self._batch is not None:
+            tree = config
+            for entity in reversed(path):
+                tree = { "/"+entity: tree }
+            deep_merge(self._batch.config, tree)
+            self._batch.calls += 1
+            return
+        
         cluster_index = 0
         outer_config = {
             "entity": [self.get_mac()] + path, #[self.get_mac(), str(cluster_index)] + path,
@@ -776,6 +2001,49 @@ class LUCIDAC:
         }
         return self.query("set_circuit", outer_config)
     
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Collects all :meth:`set_by_path` calls within the ``with`` block and sends them
+        as a single ``set_circuit`` message at the end of the block. The configurations
+        are deep-merged into one carrier level configuration, where later calls win over
+        earlier ones. This saves a round trip per call.
+        
+        The context manager yields an object with the number of collected ``calls`` and
+        the number of ``messages_saved``. If an exception happens within the block,
+        nothing is sent.
+        
+        >>> hc = LUCIDAC("emu:/")
+        >>> with hc.batch() as batch:
+        ...     hc.set_by_path("/0/M0//elements/0", {"ic":0.23, "k":100})
+        ...     hc.set_by_path("/0/M0//elements/1", {"ic":-0.5, "k":100})
+        ...     hc.set_leds(42)
+        >>> batch.messages_saved
+        2
+        >>> hc.get_circuit()["config"]["/0"]["/M0"]["elements"]["1"]
+        {'ic': -0.5, 'k': 100}
+        
+        Batches can be nested, only the outermost one sends.
+        """
+        if self._batch is not None:
+            yield self._batch
+            return
+        self._batch = batch = types.SimpleNamespace(config={}, calls=0, messages_saved=0)
+        try:
+            yield batch
+        except:
+            self._batch = None
+            raise
+        self._batch = None
+        if batch.calls:
+            batch.messages_saved = batch.calls - 1
+            log.debug(f"Sending {batch.calls} batched set_by_path calls as one set_circuit")
+            self.query("set_circuit", {
+                "entity": [self.get_mac()],
+                "config": batch.config,
+                **self.circuit_options
+            })
+    
     def set_leds(self, leds_as_integer):
         return self.set_by_path("FP", { "leds": leds_as_integer })
         
@@ -894,7 +2162,7 @@ class LUCIDAC:
             self.run_config.repetitive = repetitive
         return self.run_config
 
-    def start_run(self, clear_queue=True, end_repetitive=True, run_type="sleepy", **run_and_daq_config) -> Run:
+    def start_run(self, clear_queue=True, end_repetitive=True, run_type="sleepy", background=False, queue_size=10_000, **run_and_daq_config) -> Run:
         """
         Start a run on the LUCIDAC. A run is a IC/OP cycle. See :class:`Run` for details.
         In order to configurer the run, use :meth:`set_run` and :meth:`set_daq` before
@@ -904,6 +2172,8 @@ class LUCIDAC:
         :param clear_queue: Clear queue before submitting, making sure any leftover
            repetitive run is wiped. This is equivalent to calling :meth:`stop_run` before
             this method.
+        :param background: Read the DAQ data in a background thread into a queue with
+           at most ``queue_size`` entries. See :class:`Run` for details.
         """
         
         for k,v in run_and_daq_config.items():
@@ -937,17 +2207,262 @@ class LUCIDAC:
             self.manual_mode("op")
             return None
         
+        if self._background_run is not None:
+            self._background_run.close()
         self.slurp() # slurp old run data or similar
+        requested = time.monotonic()
         ret = self.query("start_run", start_run_msg)
         if ret:
             raise LocalError(f"Run did not start successfully. Expected answer to 'start_run' but got {ret=}")
     
-        return Run(self)
+        return Run(self, background=background, queue_size=queue_size, requested=requested)
     
     def run(self, **kwargs) -> Run:
         "Alias for :meth:`start_run`. See there for details."
         return self.start_run(**kwargs)
     
+    def sweep(self, circuit, grid, run_config={}, reduce=None, checkpoint=None):
+        """
+        Runs a parameter sweep: For every point of a regular grid, the circuit is configured,
+        a run is made and its data are collected. This is a replacement for hand-written
+        loops over :meth:`set_circuit`, :meth:`start_run` and :meth:`Run.data`.
+        
+        :arg circuit: Either a *factory*, i.e. a function which is called with the circuit
+           parameters of a grid point as keyword arguments and returns a
+           :class:`~lucipy.circuits.Circuit` or carrier configuration. Or a *template*, i.e.
+           a circuit or carrier configuration where the grid parameters are paths in the
+           notation of :meth:`resolve_path`, such as ``"/0/M0//elements/0/ic"``, which are
+           replaced with the values of the grid point.
+        :arg grid: Dictionary mapping parameter names to the list of values they take.
+           The sweep goes over all combinations, the last parameter varies fastest.
+           Parameters which are keys of :attr:`run_config` or :attr:`daq_config` (such as
+           ``op_time`` or ``sample_rate``) go to :meth:`start_run` instead of the circuit.
+        :arg run_config: Further run and DAQ configuration, as keyword arguments for
+           :meth:`start_run`, which is the same for all grid points.
+        :arg reduce: Optional function which maps the data of a run, as returned by
+           :meth:`Run.data_array`, to the result for the grid point, for instance a scalar.
+        :arg checkpoint: Optional filename. After every finished grid point, the results
+           so far are written to this file (atomically, by replacing it). If the file
+           already exists, the sweep resumes and only the missing grid points are measured.
+           An unreadable file, for instance from an interrupted write of an older version,
+           is ignored and the sweep starts again.
+        :returns: A numpy array with one axis per grid parameter (in order of ``grid``),
+           followed by the axes of the results. If the results differ in their shape
+           (such as runs with a different ``op_time``), an object array of the results.
+        
+        The data of a run are read completely before the configuration for the next grid
+        point is uploaded. The device streams the data while it is still computing, so
+        uploading during the data transfer would reconfigure the running circuit. Only
+        the ``reduce`` function and the checkpoint write of a finished grid point overlap
+        with the upload for the next one, which is sent without waiting for the answer
+        (see :meth:`pipeline`). Consider enabling :attr:`delta_uploads` for template
+        sweeps, which makes the uploads smaller.
+        
+        >>> hc = LUCIDAC("emu:/")
+        >>> from lucipy import Circuit
+        >>> def ramp(slope):
+        ...     c = Circuit()
+        ...     x = c.int(ic=0)
+        ...     c.connect(c.const(), x, weight=slope)
+        ...     c.measure(x)
+        ...     return c
+        >>> res = hc.sweep(ramp, {"slope": [-0.1, 0.1, 0.2]}, dict(num_channels=1, op_time=200_000),
+        ...     reduce = lambda data: data[-1, 0]) # final value of the (negating) integrator
+        >>> print(res.round(2))
+        [ 0.2 -0.2 -0.4]
+        """
+        import numpy as np, pickle
+        names = list(grid.keys())
+        values = [list(grid[name]) for name in names]
+        shape = tuple(len(v) for v in values)
+        is_run_config = lambda name: name in self.run_config or name in self.daq_config
+        
+        template = None
+        if not callable(circuit):
+            from .circuits import Circuit
+            template = circuit.generate() if isinstance(circuit, Circuit) else circuit
+        
+        def configure(index):
+            point = { name: v[i] for name, v, i in zip(names, values, index) if not is_run_config(name) }
+            if template is None:
+                config = circuit(**point)
+            else:
+                config = copy.deepcopy(template)
+                for key, value in point.items():
+                    path, entity_config = self.resolve_path(key, value)
+                    for entity in reversed(path):
+                        entity_config = { "/"+entity: entity_config }
+                    deep_merge(config, entity_config)
+            self.set_circuit(config)
+        
+        results = {}
+        spec = dict(zip(names, values))
+        if checkpoint:
+            try:
+                with open(checkpoint, "rb") as fh:
+                    saved_spec, saved_results = pickle.load(fh)
+            except FileNotFoundError:
+                pass
+            except (EOFError, pickle.UnpicklingError, ValueError) as e:
+                log.warning(f"Ignoring unreadable checkpoint {checkpoint}, starting again: {e!r}")
+            else:
+                if saved_spec != spec:
+                    raise LocalError(f"Checkpoint {checkpoint} was written for a different grid")
+                results = saved_results
+                log.info(f"Resuming sweep from {checkpoint} with {len(results)} of {np.prod(shape)} points done")
+        
+        def store(index, data):
+            results[index] = reduce(data) if reduce else data
+            if checkpoint:
+                temporary = f"{checkpoint}.tmp"
+                with open(temporary, "wb") as fh:
+                    pickle.dump((spec, results), fh)
+                os.replace(temporary, checkpoint)
+        
+        todo = [ index for index in np.ndindex(*shape) if index not in results ]
+        if todo:
+            configure(todo[0])
+        for n, index in enumerate(todo):
+            run_point = { name: v[i] for name, v, i in zip(names, values, index) if is_run_config(name) }
+            run = self.start_run(**dict(run_config, **run_point)) # the grid point wins
+            data = run.data_array(empty_is_fine=True)
+            if n + 1 < len(todo):
+                with self.pipeline():
+                    configure(todo[n+1])
+                    store(index, data)
+            else:
+                store(index, data)
+        
+        outcome = [ results[index] for index in np.ndindex(*shape) ]
+        if len(set(np.shape(res) for res in outcome)) == 1:
+            return np.array(outcome).reshape(shape + np.shape(outcome[0]))
+        ret = np.empty(len(outcome), dtype=object)
+        ret[:] = outcome
+        return ret.reshape(shape)
+    
+    def ota_upload(self, image, window=16, resume=True, name="lucipy-ota", progress=None, timeout=None):
+        """
+        Uploads a firmware image for an over-the-air (OTA) upgrade. The image is sent in
+        base64 encoded chunks with up to ``window`` chunks in flight (see :meth:`pipeline`),
+        so the upload is not bound by the round trip time per chunk.
+        
+        If an upload of the same image was interrupted before, it is resumed at the
+        offset the device reports with ``ota_update_status``. Any other running upgrade
+        is aborted. When the upload is interrupted by an exception (such as a lost
+        connection or ``KeyboardInterrupt``), the partial upload is kept on the device
+        for resuming with the next call. Use ``hc.query("ota_update_abort")`` to discard it.
+        
+        At the end, the hash of the image is verified by the device. If it does not match,
+        the upgrade is aborted and a :class:`LocalError` is raised. This method does not
+        finish the upgrade. Call ``hc.send("ota_update_complete")`` for that, which makes the
+        device reboot into the new firmware.
+        
+        The basic OTA protocol only requires ``ota_update_status`` to report
+        ``is_upgrade_running`` and, during an upgrade, ``transfer_completed`` and
+        ``hash_correct``. Resuming and the ``offset`` sent with each chunk (which lets the
+        device reject chunks out of order) additionally require the status to report
+        ``bytes_transmitted``, ``bin_chunk_size``, ``imagelen`` and ``upstream_hash``, as
+        the emulator does. For devices which do not report them, the upload always starts
+        from scratch and the chunks are sent without offset.
+        
+        :arg image: The binary firmware image (``bytes``)
+        :arg window: Number of chunks in flight
+        :arg resume: Whether to continue an interrupted upload of the same image
+        :arg name: Name of the image, as shown by the device
+        :arg progress: Callback ``progress(bytes_sent, total_bytes)``, called after each
+           chunk was sent (up to ``window`` chunks may not be acknowledged yet)
+        :returns: A dictionary with the number of ``bytes`` and ``chunks`` sent, the offset
+           the upload ``resumed_from``, the ``seconds`` it took and ``bytes_per_sec``
+        
+        >>> import os
+        >>> hc = LUCIDAC("emu:/")
+        >>> report = hc.ota_upload(os.urandom(100_000))
+        >>> report["chunks"], report["resumed_from"]
+        (25, 0)
+        """
+        import base64, hashlib
+        upstream_hash = hashlib.sha256(image).hexdigest()
+        start = time.perf_counter()
+        
+        progress_fields = ("bytes_transmitted", "bin_chunk_size", "imagelen", "upstream_hash")
+        status = self.query("ota_update_status", timeout=timeout)
+        if "is_upgrade_running" not in status:
+            raise LocalError(f"Device does not support OTA upgrades, it reported {status=}")
+        offset = 0
+        with_offsets = all(key in status for key in progress_fields)
+        if status.is_upgrade_running and resume and with_offsets \
+            and status.upstream_hash == upstream_hash and status.imagelen == len(image):
+            offset = status.bytes_transmitted
+            chunk_size = status.bin_chunk_size
+            log.info(f"Resuming OTA upload of {len(image)} bytes at offset {offset}")
+        else:
+            if status.is_upgrade_running:
+                log.warning("Aborting the OTA upgrade already running")
+                self.query("ota_update_abort", timeout=timeout)
+            if status.get("buffer_size") and status.buffer_size < len(image):
+                raise LocalError(f"Image with {len(image)} bytes does not fit in the OTA buffer of {status.buffer_size} bytes")
+            instructions = self.query("ota_update_init", dict(name=name, imagelen=len(image), upstream_hash=upstream_hash), timeout=timeout)
+            if instructions.encoding != "binary-base64":
+                raise LocalError(f"Can only upload base64 encoded images, but device requires {instructions=}")
+            chunk_size = instructions.bin_chunk_size
+            status = self.query("ota_update_status", timeout=timeout)
+            with_offsets = all(key in status for key in progress_fields)
+            if not with_offsets:
+                log.info("Device does not report the OTA upload progress, sending chunks without offsets")
+        
+        offsets = range(offset, len(image), chunk_size)
+        with self.pipeline(window=window, timeout=timeout):
+            for chunk_offset in offsets:
+                chunk = image[chunk_offset:chunk_offset+chunk_size]
+                msg = dict(payload=base64.b64encode(chunk).decode())
+                if with_offsets:
+                    msg["offset"] = chunk_offset
+                self.query("ota_update_stream", msg)
+                if progress:
+                    progress(chunk_offset + len(chunk), len(image))
+        
+        status = self.query("ota_update_status", timeout=timeout)
+        if "transfer_completed" not in status or "hash_correct" not in status:
+            self.query("ota_update_abort", timeout=timeout)
+            raise LocalError(f"Device does not report transfer_completed and hash_correct, cannot verify the upload. Aborted the upgrade. Device reported {status=}")
+        if not status.transfer_completed or not status.hash_correct:
+            self.query("ota_update_abort", timeout=timeout)
+            raise LocalError(f"OTA upload failed, aborted the upgrade. Device reported {status=}")
+        
+        seconds = time.perf_counter() - start
+        report = dict(bytes=len(image) - offset, chunks=len(offsets), resumed_from=offset,
+            seconds=seconds, bytes_per_sec=(len(image) - offset) / seconds)
+        log.info(f"Uploaded {report['bytes']} bytes in {seconds:.2f}s ({report['bytes_per_sec']/1e3:.1f} kB/s)")
+        return report
+    
+    def sync_clock(self, pings=20, best=0.5, interval=0) -> ClockSync:
+        """
+        Estimates offset and drift of the device clock relative to the host clock from
+        a number of pings and stores the result in :attr:`clock`. Afterwards, device
+        times such as the ones in ``run_state_change`` messages can be related to host
+        times, see :meth:`Run.timing`. The longer the pings are spread in time, the
+        better the drift can be estimated.
+        
+        >>> hc = LUCIDAC("emu:/")
+        >>> clock = hc.sync_clock()
+        >>> clock.rtt < 1
+        True
+        
+        :arg pings: Number of pings
+        :arg best: Fraction of the fastest pings which are used, see :class:`ClockSync`
+        :arg interval: Seconds to wait between the pings
+        """
+        samples = []
+        for i in range(pings):
+            if i and interval:
+                time.sleep(interval)
+            before = time.monotonic()
+            micros = self.query("ping")["micros"]
+            samples.append((before, time.monotonic(), micros))
+        self.clock = ClockSync(samples, best=best)
+        log.info(f"Synchronized clock of {self}: {self.clock}")
+        return self.clock
+    
     def manual_mode(self, to:str):
         "manual mode control"
         return self.query("manual_mode", dict(to=to))
@@ -962,12 +2477,37 @@ class LUCIDAC:
 for cmd in LUCIDAC.commands:
     shorthand = (lambda cmd: lambda self, msg={}: self.query(cmd, msg))(cmd)
     shorthand.__doc__ = f'Shorthand for ``query("{cmd}", msg)``, see :meth:`query`.'
-
-    if hasattr(functools, "cache") and cmd in LUCIDAC.memoizable:
-        shorthand = functools.cache(shorthand)
     if not hasattr(LUCIDAC, cmd):
         setattr(LUCIDAC, cmd, shorthand)
 
+class GroupRun:
+    """
+    The runs of all members of a :class:`LUCIGroup`, as returned by :meth:`LUCIGroup.start_run`.
+    
+    :ivar runs: List of :class:`Run` instances, in order of :attr:`LUCIGroup.members`.
+    """
+    def __init__(self, group, runs):
+        self.group = group
+        self.runs = runs
+    
+    def data_arrays(self):
+        "Reads the data of all runs concurrently and returns the list of :meth:`Run.data_array`"
+        return self.group.broadcast(lambda hc, i: self.runs[i].data_array(empty_is_fine=True))
+    
+    def data_array(self):
+        """
+        Reads the data of all runs and returns them as a single array with the channels
+        of all members next to each other. As the members are triggered by the master
+        at the same time, the samples are aligned in time. If the members provide a
+        different number of samples, the array is cut to the shortest.
+        """
+        import numpy as np
+        arrays = self.data_arrays()
+        num_samples = min(len(a) for a in arrays)
+        if any(len(a) != num_samples for a in arrays):
+            log.warning(f"Group members provided different number of samples, {[len(a) for a in arrays]}, cutting to {num_samples}")
+        return np.hstack([ a[:num_samples] for a in arrays ])
+
 class LUCIGroup:
     """
     Group of LUCIDACs in a master/minion setup. Usage is like
@@ -978,13 +2518,19 @@ class LUCIGroup:
     >>> group  = LUCIGroup(gru, kevin, bob) # doctest: +SKIP
     >>> group.set_circuit(...)              # doctest: +SKIP
     >>> group.start_run() ...               # doctest: +SKIP
+    
+    The methods :meth:`set_circuit`, :meth:`reset_circuit`, :meth:`set_daq` and :meth:`set_run`
+    address all members concurrently, using a thread per member, and return the list
+    of results per member. Thus configuring the group takes about as long as configuring
+    a single LUCIDAC. All other methods are forwarded only to the master.
     """
     
     def __init__(self, master: LUCIDAC, *minions: LUCIDAC):
         self.master = master
         self.minions = minions
-        for minion in self.minions:
-            res = minion.manual_mode("minion")
+        #: All LUCIDACs in the group, the master being the first
+        self.members = [master, *minions]
+        for res, minion in zip(self.broadcast(lambda hc, i: hc.manual_mode("minion"), self.minions), self.minions):
             if res:
                 raise ValueError(f"Failed to make {minion} a minion, returned {res}")
     
@@ -995,7 +2541,52 @@ class LUCIGroup:
             # However, in the moment this does not even work on free floating teensies with
             # LUCIDAC REV1 hardware, cf. hybrid-controller#145.
             return getattr(self.master, attr)
-        
+    
+    def broadcast(self, func, members=None):
+        """
+        Calls ``func(hc, index)`` for all members (or the given list of LUCIDACs) concurrently
+        and returns the list of results. If any call raises an exception, the first one is
+        raised after all calls have finished.
+        """
+        import concurrent.futures
+        members = self.members if members is None else members
+        if len(members) <= 1:
+            return [ func(hc, i) for i, hc in enumerate(members) ]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(members)) as pool:
+            futures = [ pool.submit(func, hc, i) for i, hc in enumerate(members) ]
+        return [ future.result() for future in futures ]
+    
+    def set_circuit(self, carrier_config, **further_commands):
+        """
+        Sets the circuit on all members, see :meth:`LUCIDAC.set_circuit`. ``carrier_config``
+        is either a single configuration for all members or a list with one configuration
+        per member.
+        """
+        per_member = carrier_config if isinstance(carrier_config, (list, tuple)) else [carrier_config]*len(self.members)
+        if len(per_member) != len(self.members):
+            raise ValueError(f"Expected {len(self.members)} configurations, one per member, got {len(per_member)}")
+        return self.broadcast(lambda hc, i: hc.set_circuit(per_member[i], **further_commands))
+    
+    def reset_circuit(self, msg={}):
+        "Resets the circuit on all members"
+        return self.broadcast(lambda hc, i: hc.reset_circuit(msg))
+    
+    def set_daq(self, **daq_config):
+        "Sets the same DAQ configuration on all members, see :meth:`LUCIDAC.set_daq`"
+        return self.broadcast(lambda hc, i: hc.set_daq(**daq_config))
+    
+    def set_run(self, **run_config):
+        "Sets the same run configuration on all members, see :meth:`LUCIDAC.set_run`"
+        return self.broadcast(lambda hc, i: hc.set_run(**run_config))
+    
+    def start_run(self, **run_and_daq_config) -> GroupRun:
+        """
+        Starts a run on all members, see :meth:`LUCIDAC.start_run`. The minions are prepared
+        first, concurrently, and then wait for the master which is started last. Use
+        :meth:`GroupRun.data_array` for reading the data of all members at once.
+        """
+        runs = self.broadcast(lambda hc, i: hc.start_run(**run_and_daq_config), self.minions)
+        return GroupRun(self, [ self.master.start_run(**run_and_daq_config), *runs ])
     
     
 
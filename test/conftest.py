@@ -0,0 +1,13 @@
+import pytest
+from lucipy import Emulation
+
+@pytest.fixture
+def endpoints():
+    "Endpoints of a pool of three emulators, each one served in its own process"
+    emus = [ Emulation("127.0.0.1", 0) for i in range(3) ]
+    procs = [ emu.serve_forking() for emu in emus ]
+    yield [ emu.endpoint() for emu in emus ]
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        proc.join(timeout=5)
@@ -0,0 +1,85 @@
+import asyncio, pytest, numpy as np
+from lucipy import Emulation
+from lucipy.asynchc import AsyncLUCIDAC
+
+from fixture_circuits import circuit_sinus
+
+def test_many_requests_in_flight(endpoints):
+    async def main():
+        async with AsyncLUCIDAC(endpoints[0]) as hc:
+            await hc.set_leds(0)
+            results = await asyncio.gather(*[ hc.get_circuit() for i in range(50) ])
+            assert all(res == results[0] for res in results)
+            assert (await hc.get_entities()).keys() == { Emulation.default_emulated_mac }
+    asyncio.run(main())
+
+def test_run_on_many_devices(endpoints):
+    async def run_sinus(endpoint):
+        async with AsyncLUCIDAC(endpoint) as hc:
+            await hc.set_circuit(circuit_sinus().generate())
+            hc.set_daq(num_channels=2, sample_rate=125_000)
+            hc.set_run(op_time=900_000)
+            run = await hc.start_run()
+            return await run.data_array()
+
+    async def main():
+        return await asyncio.gather(*[ run_sinus(endpoint) for endpoint in endpoints ])
+
+    results = asyncio.run(main())
+    assert all(data.shape == (112, 2) for data in results)
+    assert all(np.array_equal(data, results[0]) for data in results)
+
+def serve_lines(reply):
+    "Starts a TCP server answering every line with reply(envelope), returns the server and its endpoint"
+    import json
+    async def handle(reader, writer):
+        while line := await reader.readline():
+            writer.write(reply(json.loads(line)))
+            await writer.drain()
+        writer.close()
+    async def start():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        return server, f"tcp://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    return start()
+
+def test_long_lines():
+    import json
+    big = list(range(100_000)) # about 600 KiB of JSON
+    async def main():
+        server, endpoint = await serve_lines(lambda envelope: (json.dumps(dict(envelope, msg=big)) + "\n").encode())
+        async with server, AsyncLUCIDAC(endpoint) as hc:
+            assert await hc.query("get_circuit", timeout=5) == big
+    asyncio.run(main())
+
+def test_reader_failure_fails_pending_queries():
+    async def main():
+        server, endpoint = await serve_lines(lambda envelope: b"this is not json\n")
+        async with server, AsyncLUCIDAC(endpoint) as hc:
+            with pytest.raises(ValueError):
+                await hc.query("get_circuit", timeout=5)
+    asyncio.run(main())
+
+def test_rejected_run_is_forgotten():
+    import json
+    from lucipy.synchc import LocalError
+    async def main():
+        server, endpoint = await serve_lines(lambda envelope: (json.dumps(dict(envelope, msg={"busy": True})) + "\n").encode())
+        async with server, AsyncLUCIDAC(endpoint) as hc:
+            with pytest.raises(LocalError):
+                await hc.start_run(op_time=1000)
+            assert hc.runs == {}
+    asyncio.run(main())
+
+def test_close_fails_pending_queries():
+    async def main():
+        server, endpoint = await serve_lines(lambda envelope: b"") # never answers
+        async with server:
+            hc = await AsyncLUCIDAC(endpoint).connect()
+            query = asyncio.ensure_future(hc.query("get_circuit"))
+            await asyncio.sleep(0.05)
+            reader_task = hc.reader_task
+            await hc.close()
+            assert reader_task.done()
+            with pytest.raises(ConnectionError):
+                await query
+    asyncio.run(main())
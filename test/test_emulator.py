@@ -104,15 +104,37 @@ def test_run_daq(endpoint):
     assert data.shape == (num_points, channels)
     x_measured, y_measured = data.T
     
-    t = np.linspace(0, t_final_sec, num_points)
+    t = np.arange(num_points) * delta_t # sampling grid of the DAQ
     assert len(data) == len(t)
 
     # analytical solution to test problem:
     x_expected = -np.cos(t * k0) # corresponds to ic=+1
     y_expected = +np.sin(t * k0) # corresponds to ic=0
     
-    assert np.allclose(x_expected, x_measured, atol=1e-2)
-    assert np.allclose(y_expected, y_measured, atol=1e-2)
+    assert np.allclose(x_expected, x_measured, atol=1e-4)
+    assert np.allclose(y_expected, y_measured, atol=1e-4)
+
+@pytest.mark.parametrize("integrator", ["solve_ivp", "rk4"])
+@pytest.mark.parametrize("op_time,sample_rate", [(900_000, 125_000), (20_000_000, 1_000)])
+def test_run_integrators(integrator, op_time, sample_rate):
+    # long runs with few samples must be as accurate as short ones with many
+    emu = Emulation()
+    emu.integrator = integrator
+    hc = LUCIDAC(emulation=emu)
+    
+    sinus = Circuit()
+    x, y = sinus.int(ic=+1, slow=False), sinus.int(ic=0, slow=False)
+    sinus.connect(x, y)
+    sinus.connect(y, x, weight=-1)
+    sinus.measure(x)
+    sinus.measure(y)
+    hc.set_circuit(sinus.generate())
+    
+    data = hc.start_run(num_channels=2, sample_rate=sample_rate, op_time=op_time).data_array()
+    t = np.arange(len(data)) / sample_rate
+    assert len(data) == int(op_time / 1e9 * sample_rate)
+    assert np.allclose(data[:,0], -np.cos(t * 10_000), atol=1e-3)
+    assert np.allclose(data[:,1], np.sin(t * 10_000), atol=1e-3)
 
 
 def test_ramp(endpoint):
@@ -133,3 +155,529 @@ def test_ramp(endpoint):
             hc.reset_circuit()
             measure_ramp(hc, slope, lane, const_value=-1, slow=slow, do_assert=True)
         
+
+def test_run_data_array(endpoint):
+    hc = LUCIDAC(endpoint)
+    hc.set_circuit(circuit_sinus().generate())
+    hc.set_daq(num_channels=2, sample_rate=125_000)
+    hc.set_run(op_time=900_000)
+
+    run = hc.start_run()
+    assert run.expected_samples() == 112
+    data = run.data_array()
+    assert data.shape == (112, 2)
+    
+    # same as the list based path
+    assert np.array_equal(data, np.array(hc.start_run().data()))
+
+def test_query_many(endpoint):
+    hc = LUCIDAC(endpoint)
+    queries = [ ("set_circuit", {"entity": [hc.get_mac(), "FP"], "config": {"leds": i}}) for i in range(50) ]
+    queries += [ "get_circuit" ]
+    results = hc.query_many(queries, window=8)
+    assert len(results) == 51
+    assert results[:50] == [None]*50
+    assert results[-1]["config"]["/FP"] == {"leds": 49}
+
+def test_pipeline_remote_error(endpoint):
+    from lucipy.synchc import RemoteError
+    hc = LUCIDAC(endpoint)
+    with pytest.raises(RemoteError):
+        with hc.pipeline() as results:
+            hc.set_leds(0x55)
+            hc.query("no_such_command")
+            hc.set_leds(0xaa)
+    assert results[0] is None and results[2] is None
+    # connection is still in sync
+    assert hc.get_circuit()["config"]["/FP"] == {"leds": 0xaa}
+
+def test_run_background_reader(endpoint):
+    import time
+    hc = LUCIDAC(endpoint)
+    hc.set_circuit(circuit_sinus().generate())
+    hc.set_daq(num_channels=2, sample_rate=125_000)
+    hc.set_run(op_time=9_000_000) # results in 11 run_data chunks
+    reference = hc.start_run().data_array()
+
+    run = hc.start_run(background=True)
+    time.sleep(0.5) # slow consumer, reader thread fills the queue meanwhile
+    assert np.array_equal(run.data_array(), reference)
+    stats = run.queue_stats()
+    assert stats["dropped"] == 0 and stats["depth"] == 0 and stats["high_water_mark"] > 0
+
+    run = hc.start_run(background=True, queue_size=1)
+    time.sleep(0.5)
+    with pytest.warns(UserWarning, match="dropped"):
+        data = run.data_array()
+    assert run.dropped > 0
+    assert len(data) < len(reference)
+    
+    # connection is usable after the run
+    assert hc.get_circuit()["config"]["/0"] == circuit_sinus().generate()["/0"]
+
+def test_abandoned_background_run(endpoint):
+    hc = LUCIDAC(endpoint)
+    hc.set_circuit(circuit_sinus().generate())
+    hc.set_daq(num_channels=2, sample_rate=125_000)
+    hc.set_run(op_time=9_000_000)
+    
+    # the reader must not steal the replies of later queries
+    run = hc.start_run(background=True, queue_size=1)
+    assert hc.get_circuit()["config"]["/0"] == circuit_sinus().generate()["/0"]
+    assert not run.reader.is_alive()
+    
+    run = hc.start_run(background=True)
+    second = hc.start_run(background=True)
+    assert not run.reader.is_alive()
+    assert len(second.data_array()) == 1125
+    
+    # stopping a run whose reader finished reads the confirmation from the socket
+    run = hc.start_run(background=True)
+    run.data_array()
+    run.stop() # the emulator does not know stop_run, but answers
+    assert not run.reader.is_alive()
+    assert hc.get_circuit()["config"]["/0"] == circuit_sinus().generate()["/0"]
+
+def test_tcp_socket_options(endpoint):
+    # tiny buffer forces growing and compacting the receive buffer
+    hc = LUCIDAC(endpoint + "?bufsize=16&rcvbuf=65536&nodelay=0")
+    assert hc.sock.sock.bufsize == 16 and hc.sock.sock.rcvbuf == 65536 and not hc.sock.sock.nodelay
+    hc.set_circuit(circuit_sinus().generate())
+    hc.set_daq(num_channels=2, sample_rate=125_000)
+    hc.set_run(op_time=9_000_000)
+    data = hc.start_run().data_array()
+    
+    reference = LUCIDAC(endpoint)
+    reference.set_circuit(circuit_sinus().generate())
+    reference.set_daq(num_channels=2, sample_rate=125_000)
+    reference.set_run(op_time=9_000_000)
+    assert np.array_equal(data, reference.start_run().data_array())
+
+@pytest.fixture
+def slow_endpoint():
+    # A minimal JSONL server which answers "slow" queries only after half a second
+    import socket, threading, json, time
+    server = socket.create_server(("127.0.0.1", 0))
+    def serve():
+        conn, addr = server.accept()
+        for line in conn.makefile("rb"):
+            envelope = json.loads(line)
+            if envelope["type"] == "slow":
+                time.sleep(0.5)
+            reply = dict(id=envelope["id"], type=envelope["type"], msg={"was": envelope["type"]})
+            conn.sendall((json.dumps(reply) + "\n").encode())
+    threading.Thread(target=serve, daemon=True).start()
+    yield "tcp://127.0.0.1:%d" % server.getsockname()[1]
+    server.close()
+
+def test_reconnect_loses_pending_reply():
+    # A server which drops the first connection after receiving a request
+    import socket, threading, json
+    from lucipy.synchc import tcpsocket
+    server = socket.create_server(("127.0.0.1", 0))
+    def serve():
+        conn, addr = server.accept()
+        conn.makefile("rb").readline()
+        conn.close()
+        conn, addr = server.accept()
+        for line in conn.makefile("rb"):
+            conn.sendall(line)
+    threading.Thread(target=serve, daemon=True).start()
+    
+    sock = tcpsocket("127.0.0.1", server.getsockname()[1], auto_reconnect=True)
+    sock.send("lost")
+    with pytest.raises(ConnectionError):
+        sock.read(timeout=2)
+    sock.send("resent")
+    assert sock.read(timeout=2).strip() == b"resent"
+    server.close()
+
+def test_query_timeout(slow_endpoint):
+    import time
+    hc = LUCIDAC(slow_endpoint)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        hc.query("slow", timeout=0.1)
+    assert time.monotonic() - start < 0.3
+    # the late answer to "slow" is discarded
+    assert hc.query("fast", timeout=2) == {"was": "fast"}
+    
+    hc = LUCIDAC(slow_endpoint + "?timeout=0.1")
+    assert hc.default_timeout == 0.1
+
+@pytest.fixture
+def serial_endpoint():
+    # A pseudo terminal pair, with the emulator behind the master side standing in for an USB device
+    import os, threading
+    pytest.importorskip("serial")
+    if not hasattr(os, "openpty"):
+        pytest.skip("pseudo terminals require a POSIX system")
+    master, slave = os.openpty()
+    emu = Emulation()
+    def serve():
+        pending = b""
+        while True:
+            try:
+                pending += os.read(master, 65536)
+            except OSError:
+                return # pty closed
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                replies = emu.handle_request(line.decode())
+                for reply in (replies if isinstance(replies, list) else [replies]):
+                    os.write(master, (reply + "\n").encode())
+    threading.Thread(target=serve, daemon=True).start()
+    yield "serial:" + os.ttyname(slave)
+    os.close(slave)
+    os.close(master)
+
+def test_serial_transport(serial_endpoint):
+    hc = LUCIDAC(serial_endpoint + "?timeout=5&bufsize=16")
+    assert hc.default_timeout == 5
+    assert hc.get_mac()
+    hc.set_circuit(circuit_sinus().generate())
+    hc.set_daq(num_channels=2, sample_rate=125_000)
+    hc.set_run(op_time=9_000_000)
+    run = hc.start_run()
+    assert run.data_array().shape == (run.expected_samples(), 2)
+
+def test_instrumentation(endpoint, tmp_path):
+    import json
+    hc = LUCIDAC(endpoint)
+    hc.get_mac()
+    hc.instrumentation.reset()
+    received = []
+    hc.instrumentation.on_recv.append(lambda envelope, num_bytes: received.append(envelope["type"]))
+    
+    with hc.trace(tmp_path / "trace.json"):
+        hc.set_circuit(circuit_sinus().generate())
+        hc.set_daq(num_channels=2, sample_rate=125_000)
+        hc.set_run(op_time=9_000_000)
+        run = hc.start_run()
+        data = run.data()
+    
+    stats = hc.stats()
+    assert stats["requests"] == stats["responses"] == 2
+    assert stats["latency"]["set_circuit"]["count"] == 1
+    assert sum(stats["latency"]["start_run"]["histogram"].values()) == 1
+    assert stats["bytes_in"] > stats["bytes_out"] > 0
+    assert stats["run_data"]["samples"] == len(data)
+    assert stats["run_data"]["chunks"] == stats["messages"]["run_data"] == received.count("run_data") > 1
+    
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    assert {"send set_circuit", "recv run_data", "start_run"} <= {e["name"] for e in events}
+
+def test_batch(endpoint):
+    hc = LUCIDAC(endpoint)
+    hc.get_mac()
+    hc.instrumentation.reset()
+    with hc.batch() as batch:
+        for i in range(8):
+            hc.set_by_path(["0", "M0"], {"elements": {i: {"ic": i/10, "k": 100}}})
+        with hc.batch():
+            hc.set_by_path("/0/M1//elements/0", {"ic": 0.5})
+    assert batch.calls == 9 and batch.messages_saved == 8
+    assert hc.stats()["requests"] == 1
+    
+    config = hc.get_circuit()["config"]["/0"]
+    assert config["/M0"]["elements"]["7"] == {"ic": 0.7, "k": 100}
+    assert config["/M1"]["elements"]["0"] == {"ic": 0.5}
+    
+    # nothing is sent when the block fails
+    with pytest.raises(ZeroDivisionError):
+        with hc.batch():
+            hc.set_by_path("/0/M1//elements/0", {"ic": -0.5})
+            1/0
+    assert hc.get_circuit()["config"]["/0"]["/M1"]["elements"]["0"] == {"ic": 0.5}
+
+def test_delta_uploads(endpoint):
+    hc = LUCIDAC(endpoint + "?delta")
+    assert hc.delta_uploads
+    uploads = []
+    hc.instrumentation.on_send.append(lambda envelope, num_bytes:
+        envelope["type"] == "set_circuit" and uploads.append(num_bytes))
+    circuit = circuit_sinus()
+    hc.set_circuit(circuit.generate())
+    
+    for ic in [0.1, 0.2, 0.3]:
+        config = circuit.generate()
+        config["/0"]["/M0"]["elements"][0]["ic"] = ic
+        hc.set_circuit(config)
+        assert hc.get_circuit()["config"] == hc.last_circuit
+    assert len(uploads) == 4
+    assert max(uploads[1:]) < uploads[0]
+    
+    # unchanged configurations are not sent at all, other queries invalidate the state
+    hc.set_circuit(config)
+    assert len(uploads) == 4
+    hc.reset_circuit()
+    assert hc.last_circuit is None
+    hc.set_circuit(config)
+    assert hc.get_circuit()["config"] == hc.last_circuit
+
+def test_delta_uploads_fall_back_to_reset(endpoint):
+    import copy
+    hc = LUCIDAC(endpoint + "?delta")
+    sent = []
+    hc.instrumentation.on_send.append(lambda envelope, num_bytes:
+        envelope["type"] == "set_circuit" and sent.append(envelope["msg"]))
+    config = circuit_sinus().generate()
+    hc.set_circuit(config)
+    
+    changed = copy.deepcopy(config)
+    changed["/0"]["/M0"]["elements"][0]["ic"] = 0.3
+    hc.set_circuit(changed)
+    assert sent[-1]["entity"][1:] == ["0", "M0"] and sent[-1]["reset_before"] is False
+    
+    # removing top level keys, settings or entities requires a reset of the whole circuit
+    without_adc = copy.deepcopy(changed)
+    del without_adc["adc_channels"]
+    without_m1 = copy.deepcopy(without_adc)
+    del without_m1["/0"]["/M1"]
+    without_setting = copy.deepcopy(without_m1)
+    del without_setting["/0"]["/M0"]["elements"][0]["ic"]
+    for config in [without_adc, without_m1, without_setting]:
+        num_sent = len(sent)
+        hc.set_circuit(config)
+        assert len(sent) == num_sent + 1
+        assert sent[-1]["entity"] == [hc.get_mac()] and "reset_before" not in sent[-1]
+        assert sent[-1]["config"] == config
+    
+    # adding settings is possible incrementally
+    hc.set_circuit(without_m1)
+    assert sent[-1]["entity"][1:] == ["0", "M0"] and sent[-1]["reset_before"] is False
+    assert hc.get_circuit()["config"] == without_m1
+    
+    # without a reset, the device merges the configurations, the result is not known
+    hc.set_circuit(changed, reset_before=False)
+    hc.set_circuit(without_m1)
+    assert sent[-1]["entity"] == [hc.get_mac()] and "reset_before" not in sent[-1]
+    assert hc.get_circuit()["config"] == without_m1
+
+def test_sweep_resume(endpoint, tmp_path):
+    hc = LUCIDAC(endpoint + "?delta")
+    checkpoint = tmp_path / "sweep.pickle"
+    grid = {"/0/M0//elements/0/ic": [0.5, 1.0], "sample_rate": [125_000, 250_000], "op_time": [200_000, 400_000]}
+    run_config = dict(num_channels=2)
+    
+    calls = []
+    def failing_reduce(data):
+        calls.append(data.shape)
+        if len(calls) == 5:
+            raise KeyboardInterrupt()
+        return data
+    with pytest.raises(KeyboardInterrupt):
+        hc.sweep(circuit_sinus(), grid, run_config, reduce=failing_reduce, checkpoint=checkpoint)
+    
+    hc.instrumentation.reset()
+    res = hc.sweep(circuit_sinus(), grid, run_config, checkpoint=checkpoint)
+    assert hc.stats()["latency"]["start_run"]["count"] == 4 # the remaining points
+    assert res.shape == (2, 2, 2) and res.dtype == object
+    assert res[0, 1, 1].shape == (100, 2) and res[0, 0, 0].shape == (25, 2)
+    assert np.isclose(res[0, 0, 0][0, 0], 0.5 * res[1, 0, 0][0, 0])
+    
+    with pytest.raises(Exception, match="different grid"):
+        hc.sweep(circuit_sinus(), {"op_time": [100_000]}, checkpoint=checkpoint)
+    
+    # a truncated checkpoint is ignored
+    checkpoint.write_bytes(checkpoint.read_bytes()[:100])
+    hc.instrumentation.reset()
+    again = hc.sweep(circuit_sinus(), grid, run_config, checkpoint=checkpoint)
+    assert hc.stats()["latency"]["start_run"]["count"] == 8
+    assert all(np.array_equal(a, b) for a, b in zip(again.flat, res.flat))
+    assert not (tmp_path / "sweep.pickle.tmp").exists()
+
+def test_sweep_overrides_run_config(endpoint):
+    hc = LUCIDAC(endpoint)
+    res = hc.sweep(circuit_sinus(), {"op_time": [200_000, 400_000]}, dict(num_channels=2, op_time=100_000),
+        reduce=len)
+    assert res.tolist() == [100, 200]
+
+def test_group(endpoints):
+    master, *minions = [ LUCIDAC(endpoint) for endpoint in endpoints ]
+    group = master.master_for(*minions)
+    assert group.reset_circuit() == [None]*3
+    group.set_circuit([ circuit_sinus(i0=i, i1=i+1).generate() for i in range(3) ])
+    assert [ hc.get_circuit()["config"]["/0"]["/M0"] for hc in group.members ] \
+        == [ circuit_sinus(i0=i, i1=i+1).generate()["/0"]["/M0"] for i in range(3) ]
+    
+    group.set_daq(num_channels=2, sample_rate=125_000)
+    group.set_run(op_time=900_000)
+    data = group.start_run().data_array()
+    assert data.shape == (112, 6)
+    assert np.allclose(data[:, 0:2], data[:, 2:4]) and np.allclose(data[:, 0:2], data[:, 4:6])
+    
+    with pytest.raises(ValueError):
+        group.set_circuit([ circuit_sinus().generate() ])
+
+def test_record_replay(endpoint, tmp_path):
+    trace = tmp_path / "trace.jsonl"
+    def session(endpoint):
+        hc = LUCIDAC(endpoint)
+        hc.set_circuit(circuit_sinus().generate())
+        hc.set_daq(num_channels=2, sample_rate=125_000)
+        hc.set_run(op_time=9_000_000)
+        data = hc.start_run().data_array()
+        circuit = hc.get_circuit()
+        hc.close()
+        return data, circuit
+    
+    recorded_data, recorded_circuit = session(f"{endpoint}?record={trace}")
+    for replay in [f"replay:{trace}", f"replay:{trace}?paced"]:
+        data, circuit = session(replay)
+        assert np.array_equal(data, recorded_data) and circuit == recorded_circuit
+    
+    hc = LUCIDAC(f"replay:{trace}")
+    hc.get_mac()
+    with pytest.raises(Exception, match="diverged"):
+        hc.reset_circuit()
+
+def test_ota_upload(endpoint):
+    import os, base64, hashlib
+    hc = LUCIDAC(endpoint)
+    image = os.urandom(50_000)
+    
+    # an interrupted upload of the same image, which is resumed
+    instructions = hc.query("ota_update_init", dict(name="test", imagelen=len(image), upstream_hash=hashlib.sha256(image).hexdigest()))
+    chunk_size = instructions["bin_chunk_size"]
+    for offset in range(0, 3*chunk_size, chunk_size):
+        hc.query("ota_update_stream", dict(payload=base64.b64encode(image[offset:offset+chunk_size]).decode()))
+    report = hc.ota_upload(image, window=4)
+    assert report["resumed_from"] == 3*chunk_size and report["bytes"] == len(image) - 3*chunk_size
+    status = hc.query("ota_update_status")
+    assert status["hash_correct"] and status["bytes_transmitted"] == len(image)
+    
+    # a different image replaces the upload
+    other_image = os.urandom(20_000)
+    sent = []
+    report = hc.ota_upload(other_image, window=1, progress=lambda done, total: sent.append((done, total)))
+    assert sent[0] == (chunk_size, len(other_image)) and sent[-1] == (len(other_image), len(other_image))
+    assert report["resumed_from"] == 0 and report["bytes_per_sec"] > 0
+    assert hc.query("ota_update_status")["imagelen"] == len(other_image)
+    assert hc.query("ota_update_complete") is None
+    assert not hc.query("ota_update_status")["is_upgrade_running"]
+
+def test_ota_upload_basic_protocol():
+    # a device which neither reports the upload progress nor accepts chunk offsets
+    import os
+    from lucipy.synchc import LocalError
+    class BasicOta(Emulation):
+        hide = ["bytes_transmitted", "bin_chunk_size", "imagelen", "upstream_hash"]
+        
+        def ota_update_status(self):
+            status = super().ota_update_status()
+            return { key: value for key, value in status.items() if key not in self.hide }
+        ota_update_status.exposed = True
+        
+        def ota_update_stream(self, payload, **kwargs):
+            if kwargs:
+                return {"error": f"Unknown fields {kwargs}"}
+            return super().ota_update_stream(payload)
+        ota_update_stream.exposed = True
+    
+    hc = LUCIDAC(emulation=BasicOta())
+    image = os.urandom(20_000)
+    assert hc.ota_upload(image)["resumed_from"] == 0
+    assert hc.query("ota_update_status")["hash_correct"]
+    assert hc.ota_upload(image)["resumed_from"] == 0 # cannot resume, starts again
+    
+    BasicOta.hide = BasicOta.hide + ["hash_correct"]
+    with pytest.raises(LocalError, match="cannot verify"):
+        hc.ota_upload(image)
+    assert not hc.query("ota_update_status")["is_upgrade_running"]
+
+def test_response_cache(endpoint):
+    import time
+    hc = LUCIDAC(endpoint)
+    hc.instrumentation.reset()
+    for i in range(3):
+        assert list(hc.get_entities().keys())[0] == Emulation().mac
+    assert hc.stats()["requests"] == 1
+    
+    # answers are copies, modifying them does not spoil the cache
+    hc.get_circuit()["config"]["/0"] = "garbage"
+    assert hc.get_circuit()["config"]["/0"] != "garbage"
+    
+    # mutating queries invalidate the cache
+    hc.set_leds(0x0f)
+    assert hc.get_circuit()["config"]["/FP"] == {"leds": 0x0f}
+    assert hc.cache.stats()["invalidations"] >= 1
+    
+    # entries expire
+    hc.cache.ttl = 0.01
+    hc.cache.invalidate()
+    hc.get_entities()
+    time.sleep(0.02)
+    misses = hc.cache.misses
+    hc.get_entities()
+    assert hc.cache.misses == misses + 1
+    
+    uncached = LUCIDAC(f"{endpoint}?cache_ttl=0")
+    uncached.get_entities(), uncached.get_entities()
+    assert uncached.cache.hits == 0 and uncached.stats()["requests"] == 2
+
+def test_clock_sync():
+    from lucipy.synchc import ClockSync
+    # device clock running 20ppm fast and wrapping around, replies delayed by up to 40us
+    rng = np.random.default_rng(5)
+    pings = []
+    for host in np.arange(0, 10, 0.5):
+        before = host + rng.uniform(0, 1e-3)
+        delay = rng.uniform(0, 40e-6)
+        micros = int(((before + delay/2 - 3) * 1e6 / (1 + 20e-6)) % 2**32)
+        pings.append((before, before + delay, micros))
+    clock = ClockSync(pings)
+    assert abs(clock.drift - 20e-6) < 5e-6
+    assert abs(clock.to_host(micros) - (before + delay/2)) < 40e-6
+
+def test_clock_sync_and_timing(endpoint):
+    import time
+    hc = LUCIDAC(endpoint)
+    # the pings span 0.2s, thus a round trip jitter of 0.1ms makes up at most 1e-3
+    clock = hc.sync_clock(pings=10, interval=0.02)
+    assert abs(clock.drift) < 0.01
+    before = time.monotonic()
+    micros = hc.ping()["micros"]
+    assert before - 0.05 < clock.to_host(micros) < time.monotonic() + 0.05
+    
+    hc.set_circuit(circuit_sinus())
+    run = hc.start_run(num_channels=2, op_time=2_000_000)
+    chunks = list(run.next_data(timestamps=True))
+    times = [ t for t, data in chunks ]
+    assert times == sorted(times) and len(chunks) == len(run.chunks) > 1
+    
+    timing = run.timing()
+    assert timing["samples"] == sum(len(data) for t, data in chunks)
+    assert timing["first_sample"] <= timing["last_sample"] <= timing["done"]
+    done = timing["states"][-1]
+    assert done["state"] == "DONE" and abs(done["latency"]) < 0.5
+
+@pytest.fixture
+def unix_endpoint(tmp_path):
+    emu = Emulation(unix_socket=str(tmp_path / "emu.sock"))
+    proc = emu.serve_forking()
+    yield emu.endpoint()
+    proc.terminate()
+
+def test_unix_and_direct_endpoints(endpoint, unix_endpoint):
+    assert unix_endpoint.startswith("unix:")
+    results = []
+    for url in [endpoint, unix_endpoint, "emu:/?direct"]:
+        hc = LUCIDAC(url)
+        hc.set_circuit(circuit_sinus())
+        assert hc.get_circuit()["config"]["/0"] == circuit_sinus().generate()["/0"]
+        with pytest.raises(Exception, match="Don't know"):
+            hc.query("no_such_command")
+        results.append(hc.start_run(num_channels=2, op_time=500_000).data_array())
+        assert hc.stats()["run_data"]["samples"] == len(results[-1])
+    assert all(np.allclose(results[0], data) for data in results[1:])
+
+def test_given_emulation():
+    emu = Emulation()
+    for hc in [LUCIDAC(emulation=emu), LUCIDAC("emu:/", emulation=emu)]:
+        hc.set_circuit(circuit_sinus())
+        assert emu.circuit["/0"] == circuit_sinus().generate()["/0"]
+        emu.circuit = {} # the client talks to this very emulation
+        assert hc.get_circuit()["config"] == {}
+    with pytest.raises(ValueError):
+        LUCIDAC("tcp://127.0.0.1:1", emulation=emu)
@@ -0,0 +1,44 @@
+# Guards the import time of the client. Many scripts only do
+# "from lucipy import LUCIDAC" and should not pay for the simulator,
+# the circuit compiler or asyncio.
+
+import subprocess, sys
+
+# Generous budget in milliseconds for "from lucipy import LUCIDAC", measured
+# within a fresh interpreter. On a typical machine this takes around 50ms.
+IMPORT_BUDGET_MS = 150
+
+probe = """
+import sys, time
+t = time.perf_counter()
+from lucipy import LUCIDAC
+print((time.perf_counter() - t) * 1000)
+print(" ".join(sys.modules))
+"""
+
+def probe_import():
+    out = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True).stdout
+    millis, modules = out.splitlines()
+    return float(millis), modules.split()
+
+def test_lazy_modules():
+    _, modules = probe_import()
+    for heavy in ["lucipy.simulator", "lucipy.circuits", "lucipy.asynchc", "asyncio", "socketserver", "argparse", "numpy"]:
+        assert heavy not in modules
+
+def test_import_budget():
+    # best of several tries, to be robust against a busy machine
+    millis = min(probe_import()[0] for _ in range(3))
+    assert millis < IMPORT_BUDGET_MS, f"Importing the client took {millis:.1f}ms"
+
+def test_lazy_attributes():
+    import lucipy
+    assert lucipy.Emulation.__name__ == "Emulation"
+    assert callable(lucipy.detect)
+    assert set(lucipy.__all__) <= set(dir(lucipy))
+
+def test_lazy_submodules():
+    # within a fresh interpreter, as other tests already imported the submodules
+    probe = "import lucipy; print(lucipy.simulator.Simulation.__name__, lucipy.synchc.LUCIDAC.__name__, 'proxy' in dir(lucipy))"
+    out = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True).stdout
+    assert out.split() == ["Simulation", "LUCIDAC", "True"]
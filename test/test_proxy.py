@@ -0,0 +1,62 @@
+import pytest, threading, time
+import numpy as np
+from lucipy import LUCIDAC, Emulation
+from lucipy.proxy import Proxy
+
+from fixture_circuits import circuit_sinus
+
+@pytest.fixture
+def proxy(tmp_path):
+    emu = Emulation("127.0.0.1", 0)
+    proc = emu.serve_forking()
+    proxy = Proxy(emu.endpoint(), str(tmp_path / "lucidac.sock")).start()
+    yield proxy
+    proxy.close()
+    proc.terminate()
+
+def test_shared_runs(proxy):
+    a, b = LUCIDAC(proxy.endpoint()), LUCIDAC(proxy.endpoint())
+    assert a.get_mac() == b.get_mac() == Emulation().mac
+    a.set_circuit(circuit_sinus())
+    run = a.start_run(num_channels=2, op_time=500_000)
+    data = run.data_array()
+    assert data.shape[1] == 2 and len(data) > 100
+    # the other client saw nothing of the run
+    assert b.slurp() == []
+    assert b.get_circuit()["config"]["/0"] == a.get_circuit()["config"]["/0"]
+
+def test_locking(proxy):
+    a, b = LUCIDAC(proxy.endpoint()), LUCIDAC(proxy.endpoint())
+    a.lock_acquire()
+    answered = []
+    thread = threading.Thread(target=lambda: answered.append(b.set_leds(0xaa)))
+    thread.start()
+    time.sleep(0.2)
+    assert not answered # waits for the lock
+    a.set_leds(0x55)
+    a.lock_release()
+    thread.join(timeout=5)
+    assert answered
+    assert a.get_circuit()["config"]["/FP"] == {"leds": 0xaa}
+    
+    # a client which disconnects releases the lock
+    b.lock_acquire()
+    b.close()
+    assert a.get_entities()
+
+def test_cache_sees_changes_of_other_clients(proxy):
+    a, b = LUCIDAC(proxy.endpoint()), LUCIDAC(proxy.endpoint())
+    assert a.cache.ttl == 0 # the proxy caches
+    a.set_leds(0x11)
+    assert a.get_circuit()["config"]["/FP"] == {"leds": 0x11}
+    b.set_leds(0x22)
+    assert a.get_circuit()["config"]["/FP"] == {"leds": 0x22}
+    
+    # an answer to a query in flight when the circuit changes must not be cached
+    import json
+    request = dict(id="in-flight", type="get_circuit", msg={})
+    with proxy.state:
+        proxy.pending[request["id"]] = (None, request, proxy.cache_generation)
+    proxy._admit(b, dict(id="change", type="set_circuit", msg={}), "set_circuit", {})
+    proxy._dispatch(json.dumps(dict(request, msg={"config": "old"})))
+    assert proxy.cache.get("get_circuit", {}) is None
@@ -0,0 +1,55 @@
+import pytest, numpy as np
+from lucipy import Circuit
+from lucipy.scheduler import Scheduler
+
+from fixture_circuits import circuit_sinus
+
+def test_distribute_jobs(endpoints):
+    # the last endpoint does not exist and drops out of the pool
+    sched = Scheduler(endpoints + ["tcp://127.0.0.1:1"], reduce=lambda data: data.shape)
+    for op_time in range(100_000, 2_000_000, 100_000):
+        sched.submit(circuit_sinus(), num_channels=2, sample_rate=100_000, op_time=op_time)
+    jobs = sched.run()
+    for job in jobs:
+        num_samples, num_channels = job.result
+        assert num_channels == 2 and abs(num_samples - job.config["op_time"]/1e4) <= 1
+    
+    report = sched.report()
+    assert report["succeeded"] == report["jobs"] == 19 and report["failed"] == 0
+    assert report["jobs_per_sec"] > 0
+    devices = report["devices"]
+    assert devices["tcp://127.0.0.1:1"]["error"] is not None
+    assert sum(devices[e]["jobs"] for e in endpoints) == 19
+    assert sum(devices[e]["jobs"] > 0 for e in endpoints) > 1
+
+def test_retry(endpoints):
+    sched = Scheduler(endpoints[:2], retries=1)
+    good = sched.submit(circuit_sinus(), num_channels=2, op_time=100_000)
+    bad = sched.submit({"/0": {"/U": "garbage"}}, num_channels=2, op_time=100_000)
+    sched.run()
+    assert good.done and good.attempts == 1
+    assert not bad.done and bad.attempts == 2 and bad.error is not None
+    report = sched.report()
+    assert report["failed"] == 1 and report["retries"] == 1
+
+def test_raising_job(endpoints):
+    # errors other than lost connections or remote errors must not kill the worker
+    calls = []
+    def reduce(data):
+        calls.append(1)
+        if len(calls) == 1:
+            raise ValueError("bad data")
+        return data.shape
+
+    sched = Scheduler(endpoints[:2], reduce=reduce, retries=1)
+    jobs = [ sched.submit(circuit_sinus(), num_channels=2, op_time=100_000) for _ in range(4) ]
+    sched.run()
+    failed = [ job for job in jobs if not job.done ]
+    assert len(failed) == 1 and failed[0].attempts == 1 and isinstance(failed[0].error, ValueError)
+    report = sched.report()
+    assert report["succeeded"] == 3 and report["failed"] == 1
+
+def test_no_jobs(endpoints):
+    sched = Scheduler(endpoints[:2])
+    assert sched.run() == []
+    assert sched.queue.empty()
@@ -126,3 +126,164 @@ def test_ramp(slow):
     
     import numpy as np
     assert np.isclose(res.y[0,-1], expected_result)
+
+def test_multiplier_chain():
+    import numpy as np
+    c = Circuit()
+    x = c.int(ic=0.5)
+    cnst = c.const()
+    m0, m1, m2, m3 = c.muls(4)
+    # m3 = x^2 * (x^2 * 0.5) depends on m0 and m2, m2 on m0
+    c.connect(x, m0.a); c.connect(x, m0.b)
+    c.connect(m0, m2.a); c.connect(cnst, m2.b, weight=0.5)
+    c.connect(m0, m3.a); c.connect(m2, m3.b)
+    c.connect(x, m1.a); c.connect(cnst, m1.b, weight=-0.3)
+    c.connect(m3, x, weight=0.1)
+    c.connect(m1, x, weight=0.2)
+    sim = Simulation(c)
+    assert [ level.tolist() for level in sim.mul_levels ] == [[0, 1], [2], [3]]
+    
+    for state in np.random.default_rng(1).uniform(-1, 1, (20, 8)):
+        assert np.array_equal(sim.Mul_out(state), sim.Mul_out_unrolled(state))
+        xx = state[0]**2
+        assert np.allclose(sim.Mul_out(state)[[0, 1, 2, 3]], [xx, -0.3*state[0], 0.5*xx, 0.5*xx*xx])
+
+def test_algebraic_loop():
+    c = Circuit()
+    x = c.int(ic=0.5)
+    cnst = c.const()
+    m0, m1 = c.muls(2)
+    # m0 = x*(m1 + 1), m1 = x*m0 does not converge within a few iterations
+    c.connect(x, m0.a); c.connect(m1, m0.b); c.connect(cnst, m0.b)
+    c.connect(x, m1.a); c.connect(m0, m1.b)
+    c.connect(m1, x)
+    sim = Simulation(c)
+    assert sim.mul_levels is None
+    with pytest.raises(ValueError, match="algebraic loops"):
+        sim.Mul_out([0.5] + [0]*7)
+
+def test_compiled_backend():
+    import numpy as np
+    from lucipy.simulator import compile_source
+    c = Circuit()
+    x, y = c.int(ic=0.5), c.int(ic=-0.2)
+    xy = c.mul()
+    c.connect(x, xy.a); c.connect(y, xy.b)
+    c.connect(xy, x, weight=-0.5)
+    c.connect(x, y, weight=2)
+    c.connect(c.const(), y, weight=0.1)
+    c.set_k0_slow(1, True)
+    
+    numpy, compiled = Simulation(c), Simulation(c, backend="compiled")
+    for state in np.random.default_rng(2).uniform(-1.5, 1.5, (20, 8)):
+        for clip in [False, True]:
+            assert np.allclose(numpy.rhs(0, state.copy(), clip), compiled.rhs(0, state.copy(), clip))
+    assert np.allclose(numpy.solve_ivp(10).y, compiled.solve_ivp(10).y)
+    
+    # the generated function is shared between simulations of the same circuit
+    hits = compile_source.cache_info().hits
+    Simulation(c, backend="compiled").rhs(0, np.zeros(8))
+    assert compile_source.cache_info().hits == hits + 1
+    
+    # reassigning int_factor regenerates the function
+    compiled.int_factor = compiled.int_factor * 2
+    assert np.allclose(2*numpy.rhs(0, np.ones(8)), compiled.rhs(0, np.ones(8)))
+    
+    with pytest.raises(ValueError):
+        Simulation(c, backend="fortran")
+
+def test_jacobian():
+    import numpy as np
+    c = Circuit()
+    x, y, z = c.ints(3)
+    c.set_ic(0, 0.3); c.set_ic(1, -0.2); c.set_ic(2, 0.1)
+    xy, xyz = c.muls(2)
+    c.connect(x, xy.a); c.connect(y, xy.b)
+    c.connect(xy, xyz.a); c.connect(z, xyz.b, weight=2)
+    c.connect(xyz, x, weight=-1)
+    c.connect(x, y, weight=3)
+    c.connect(y, z)
+    c.connect(c.const(), z, weight=-0.1)
+    c.set_k0_slow(2, True) # stiff
+    sim = Simulation(c)
+    
+    for state in np.random.default_rng(3).uniform(-1, 1, (10, 8)):
+        h = 1e-6
+        numeric = np.array([ (sim.rhs(0, state + h*e) - sim.rhs(0, state - h*e)) / (2*h) for e in np.eye(8) ]).T
+        assert np.allclose(sim.jac(0, state), numeric, atol=1e-7)
+    
+    explicit = sim.solve_ivp(5, rtol=1e-8, atol=1e-10)
+    implicit = sim.solve_ivp(5, method="Radau", rtol=1e-8, atol=1e-10)
+    assert implicit.njev > 0 and np.allclose(explicit.y[:, -1], implicit.y[:, -1], atol=1e-6)
+
+def test_ensemble():
+    import numpy as np
+    def oscillator(damping):
+        c = Circuit()
+        x, v = c.ints(2)
+        xx = c.mul()
+        c.connect(x, v, weight=-1)
+        c.connect(v, x)
+        c.connect(x, xx.a); c.connect(x, xx.b)
+        c.connect(xx, v, weight=damping)
+        return c
+    
+    sim = Simulation(oscillator(0.5))
+    rng = np.random.default_rng(4)
+    dampings = rng.uniform(0, 1, 5)
+    coefficients = np.array([ Simulation(oscillator(d)).route_coefficients for d in dampings ])
+    ics = rng.uniform(-0.5, 0.5, (5, 2))
+    t_eval = np.linspace(0, 3, 7)
+    
+    out = np.full((5, 8, 7), np.nan)
+    ensemble = sim.solve_ensemble(ics, t_eval, coefficients, batch_size=2, out=out, rtol=1e-9, atol=1e-11)
+    assert ensemble is out
+    for n in range(5):
+        single = Simulation(oscillator(dampings[n])).solve_ivp(3, ics=ics[n], t_eval=t_eval, rtol=1e-9, atol=1e-11)
+        assert np.allclose(ensemble[n], single.y, atol=1e-7)
+    
+    # without coefficients, all members share the ones of the circuit
+    unperturbed = sim.solve_ensemble(ics[:2], t_eval, rtol=1e-9, atol=1e-11)
+    assert np.allclose(unperturbed[1], sim.solve_ivp(3, ics=ics[1], t_eval=t_eval, rtol=1e-9, atol=1e-11).y, atol=1e-7)
+    
+    with pytest.raises(ValueError):
+        sim.solve_ensemble(ics, t_eval, coefficients[:3])
+
+def test_fixed_step():
+    import numpy as np
+    c = Circuit()
+    x, v = c.ints(2)
+    c.set_ic(0, 0.5)
+    xx = c.mul()
+    c.connect(x, v, weight=-1)
+    c.connect(v, x)
+    c.connect(x, xx.a); c.connect(x, xx.b)
+    c.connect(xx, v, weight=0.3)
+    sim = Simulation(c)
+    
+    t, rk4 = sim.solve_fixed(5, sample_rate=10)
+    assert rk4.shape == (8, 50) and np.allclose(t, np.arange(50) / 10)
+    reference = sim.solve_ivp(5, t_eval=t, rtol=1e-10, atol=1e-12).y
+    assert np.allclose(rk4, reference, atol=1e-8)
+    
+    # forward Euler converges with first order
+    errors = [ np.abs(sim.solve_fixed(5, 10, method="euler", max_step=h)[1] - reference).max() for h in (1e-2, 1e-3) ]
+    assert 5 < errors[0] / errors[1] < 15
+    
+    # clipping after every step bounds the state
+    c.set_ic(0, 1)
+    c.connect(x, x, weight=-2) # grows exponentially
+    _, clipped = Simulation(c).solve_fixed(5, 10, clip=True)
+    assert np.abs(clipped).max() <= 1.4
+    
+    # the same engine advances ensembles
+    ics = [[-0.5], [0.2]]
+    ensemble = sim.solve_ensemble(ics, t, method="rk4")
+    for n in range(2):
+        assert np.allclose(ensemble[n], sim.solve_fixed(5, 10, ics=ics[n])[1])
+    with pytest.raises(ValueError):
+        sim.solve_ensemble(ics, [0, 1, 3], method="rk4")
+    # options of the adaptive solvers have no meaning here
+    assert np.allclose(sim.solve_ensemble(ics, t, method="rk4", max_step=0.01), ensemble)
+    with pytest.raises(TypeError, match="rtol"):
+        sim.solve_ensemble(ics, t, method="rk4", rtol=1e-9)